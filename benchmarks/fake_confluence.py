@@ -0,0 +1,152 @@
+"""
+Minimal in-memory stand-in for Confluence REST API. Implements only the endpoints used by the connector.
+Each request can be delayed to emulate network and Confluence latency.
+
+Run standalone:
+    $ python benchmarks/fake_confluence.py --port 8090 --latency 0.05
+"""
+import argparse
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # Benchmarks open many connections at once, default backlog of 5 makes clients wait for SYN retransmission.
+    request_queue_size = 256
+
+
+class FakeConfluence(object):
+    """
+    Storage of spaces and pages.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.spaces = set()
+        self.pages = dict()
+        self.next_id = 1000
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    def page_data(self, page):
+        """
+        Make REST API representation of the page with body and version expanded.
+        """
+        return {
+            'id': page['id'],
+            'type': 'page',
+            'title': page['title'],
+            'version': {'number': page['version']},
+            'body': {'storage': {'value': page['body'], 'representation': 'storage'}},
+        }
+
+    def handle(self, method, path, query, body):
+        """
+        Route request.
+
+        :rtype: tuple(int, dict)
+        :returns: Status code and response data.
+        """
+        with self.lock:
+            self.requests += 1
+
+        match = re.match(r'^/rest/api/space/([^/]+)$', path)
+        if match and method == 'GET':
+            if match.group(1) in self.spaces:
+                return 200, {'key': match.group(1)}
+            return 404, {'statusCode': 404, 'message': 'No space with key'}
+
+        if path.rstrip('/') == '/rest/api/space' and method == 'POST':
+            self.spaces.add(body['key'])
+            return 200, {'key': body['key']}
+
+        if path.rstrip('/') == '/rest/api/content':
+            if method == 'POST':
+                with self.lock:
+                    page = {'id': str(self.next_id), 'title': body['title'], 'version': 1,
+                            'body': body['body']['storage']['value']}
+                    self.pages[page['id']] = page
+                    self.next_id += 1
+                return 200, self.page_data(page)
+            pages = sorted(self.pages.values(), key=lambda page: int(page['id']))
+            if 'title' in query:
+                pages = [page for page in pages if page['title'] == query['title'][0]]
+            start = int(query.get('start', ['0'])[0])
+            limit = int(query.get('limit', ['25'])[0])
+            results = [self.page_data(page) for page in pages[start:start + limit]]
+            return 200, {'results': results, 'size': len(results)}
+
+        match = re.match(r'^/rest/api/content/(\d+)(/history)?$', path)
+        if match:
+            page = self.pages.get(match.group(1))
+            if page is None:
+                return 404, {'statusCode': 404, 'message': 'No content found'}
+            if match.group(2):
+                return 200, {'lastUpdated': {'number': page['version']}}
+            if method == 'GET':
+                return 200, self.page_data(page)
+            if method == 'PUT':
+                with self.lock:
+                    if body['version']['number'] != page['version'] + 1:
+                        return 409, {'statusCode': 409, 'message': 'Version must be incremented on update.'}
+                    page['version'] += 1
+                    page['body'] = body['body']['storage']['value']
+                return 200, self.page_data(page)
+
+        return 404, {'statusCode': 404, 'message': 'Not found'}
+
+    def make_handler(self):
+        """
+        Make request handler class bound to this storage.
+        """
+        confluence = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Send headers and body in one packet, otherwise delayed ACK of keep-alive connection adds ~40ms.
+            wbufsize = -1
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self):
+                url = urlparse(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length) or b'{}') if length else None
+                if confluence.latency:
+                    time.sleep(confluence.latency)
+                status, data = confluence.handle(self.command, url.path, parse_qs(url.query), body)
+                payload = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            do_GET = do_POST = do_PUT = respond
+
+        return Handler
+
+    def serve(self, host='127.0.0.1', port=0):
+        """
+        Start server in background thread.
+
+        :rtype: ThreadingHTTPServer
+        :returns: Running server. Its url port is `server.server_address[1]`.
+        """
+        server = Server((host, port), self.make_handler())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency', type=float, default=0.0, help="Seconds added to each response.")
+    arguments = parser.parse_args()
+    Server(('127.0.0.1', arguments.port), FakeConfluence(arguments.latency).make_handler()).serve_forever()
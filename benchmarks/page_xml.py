@@ -0,0 +1,228 @@
+"""
+Micro-benchmark of the page XML hot path: parsing of storage format, excerpt lookup, patching and serialization.
+
+Pages are generated with 10 to 5000 MultiExcerpt macros, each operation is run for field chains of several lengths.
+For every operation the median time and peak memory allocated by Python(tracemalloc) are reported. Memory of libxml2
+trees isn't seen by tracemalloc, so peak memory shows Python side objects only(strings, wrappers, index).
+
+Results are compared with the stored baseline, operations slower than the tolerance are reported as regressions:
+    $ python benchmarks/page_xml.py
+    $ python benchmarks/page_xml.py --save-baseline  # After intended changes of the hot path.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import tracemalloc
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alrescha.settings')
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'baselines', 'page_xml.json')
+PAGE_SIZES = (10, 100, 1000, 5000)
+CHAIN_LENGTHS = (1, 10, 50)
+
+
+def setup_django():
+    """
+    Set up Django, templates are rendered by Django template engine.
+    """
+    from django.conf import settings
+
+    # Metrics would be measured together with the XML work, so they are switched off to keep numbers comparable.
+    settings.DNC_METRICS_ENABLED = False
+
+    import django
+    django.setup()
+
+
+def make_page(macros):
+    """
+    Make storage format body with the given number of MultiExcerpt macros named `field0`, `field1`, ...
+
+    :type macros: int
+    :param macros: Number of macros.
+
+    :rtype: dict
+    :returns: Page data as returned by Confluence REST API.
+    """
+    from django.template.loader import render_to_string
+
+    content = ''.join(render_to_string('multiexcerpt.xml', {
+        'macro_id': uuid.UUID(int=number),
+        'field_name': 'field{}'.format(number),
+        'field_value': 'value {}'.format(number),
+    }) for number in range(macros))
+    return {'id': '1', 'title': 'partials-benchmark', 'body': {'storage': {'value': content}}}
+
+
+def make_chain(length, macros, value_prefix, offset=0):
+    """
+    Make field chain of fields `field<offset>`... spread over the page.
+
+    :type length: int
+    :param length: Number of fields.
+
+    :type macros: int
+    :param macros: Number of macros on the page.
+
+    :type value_prefix: str
+    :param value_prefix: `value` for values already on the page, anything else for new values.
+
+    :type offset: int
+    :param offset: Number of the first field. Zero - fields already on the page, `macros` - new fields.
+
+    :rtype: list
+    :returns: List of TextLinkedFields.
+    """
+    from django_netbox_confluence.updater.linked_fields import TextLinkedField
+
+    if offset:
+        numbers = [offset + number for number in range(length)]
+    else:
+        # Fields already on the page are spread over it. Short pages get the same field several times.
+        numbers = [number * max(1, macros // length) % macros for number in range(length)]
+    return [TextLinkedField('field{}'.format(number), '{} {}'.format(value_prefix, number)) for number in numbers]
+
+
+def measure(setup, operation, repeat):
+    """
+    Run the operation several times.
+
+    :type setup: callable
+    :param setup: Function making fresh argument of the operation, not measured.
+
+    :type operation: callable
+    :param operation: Measured function.
+
+    :type repeat: int
+    :param repeat: Number of runs.
+
+    :rtype: tuple(float, int)
+    :returns: Median time in seconds and peak of memory allocated by the operation in bytes.
+    """
+    times = list()
+    for _ in range(repeat):
+        argument = setup()
+        started = time.perf_counter()
+        operation(argument)
+        times.append(time.perf_counter() - started)
+
+    argument = setup()
+    tracemalloc.start()
+    operation(argument)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return statistics.median(times), peak
+
+
+def run(repeat):
+    """
+    Measure all operations for all page sizes and chain lengths.
+
+    :type repeat: int
+    :param repeat: Number of runs of each operation.
+
+    :rtype: dict
+    :returns: Mapping of `operation/macros/chain` to {"time": seconds, "peak": bytes}.
+    """
+    from django_netbox_confluence.updater.confluence_adapter import ConfluenceAdapter
+    from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+    results = dict()
+    for macros in PAGE_SIZES:
+        data = make_page(macros)
+        parsed = ConfluenceAdapter.parse_page(data)
+
+        def parse_page(_):
+            ConfluenceAdapter.parse_page(data)
+
+        results['parse/{}/-'.format(macros)] = measure(lambda: None, parse_page, repeat)
+        results['serialize/{}/-'.format(macros)] = measure(lambda: parsed, ConfluenceAdapter.serialize_page, repeat)
+
+        for length in CHAIN_LENGTHS:
+            same = make_chain(length, macros, 'value')
+            changed = make_chain(length, macros, 'changed')
+            new = make_chain(length, macros, 'new', offset=macros)
+
+            def lookup(page_content):
+                for field in same:
+                    ConfluenceAdapter.get_field_element(page_content, field)
+
+            def check(page_content):
+                for field in same:
+                    ConfluenceAdapter.is_field_up_to_date(page_content, field)
+
+            def update_existing(page_content):
+                WikiPageUpdater.apply_field_chain(page_content, changed)
+
+            def insert_new(page_content):
+                WikiPageUpdater.apply_field_chain(page_content, new)
+
+            def round_trip(_):
+                page_content = ConfluenceAdapter.parse_page(data)
+                WikiPageUpdater.apply_field_chain(page_content, changed)
+                ConfluenceAdapter.serialize_page(page_content)
+
+            def fresh():
+                return ConfluenceAdapter.parse_page(data)
+
+            key = '{}/' + '{}/{}'.format(macros, length)
+            results[key.format('lookup')] = measure(lambda: parsed, lookup, repeat)
+            results[key.format('check')] = measure(lambda: parsed, check, repeat)
+            results[key.format('update_existing')] = measure(fresh, update_existing, repeat)
+            results[key.format('insert_new')] = measure(fresh, insert_new, repeat)
+            results[key.format('round_trip')] = measure(lambda: None, round_trip, repeat)
+
+    return {key: {'time': seconds, 'peak': peak} for key, (seconds, peak) in results.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--repeat', type=int, default=7, help="Runs of each operation, median time is reported.")
+    parser.add_argument('--baseline', default=BASELINE_PATH, help="Baseline file.")
+    parser.add_argument('--save-baseline', action='store_true', help="Store results as the new baseline.")
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help="Relative slowdown against the baseline reported as regression.")
+    arguments = parser.parse_args()
+
+    setup_django()
+    results = run(arguments.repeat)
+
+    baseline = dict()
+    if os.path.exists(arguments.baseline) and not arguments.save_baseline:
+        with open(arguments.baseline) as baseline_file:
+            baseline = json.load(baseline_file)['results']
+
+    regressions = list()
+    print("{:<16} {:>6} {:>6} {:>12} {:>12} {:>10}".format('operation', 'macros', 'chain', 'time, ms', 'peak, KiB',
+                                                          'baseline'))
+    for key, result in results.items():
+        operation, macros, length = key.split('/')
+        change = ''
+        if key in baseline:
+            ratio = result['time'] / baseline[key]['time']
+            change = '{:+.0%}'.format(ratio - 1)
+            # Very short operations are too noisy to be judged.
+            if ratio > 1 + arguments.tolerance and result['time'] > 0.0005:
+                regressions.append(key)
+                change += ' !'
+        print("{:<16} {:>6} {:>6} {:>12.3f} {:>12.1f} {:>10}".format(operation, macros, length, result['time'] * 1000,
+                                                                     result['peak'] / 1024, change))
+
+    if arguments.save_baseline:
+        os.makedirs(os.path.dirname(arguments.baseline), exist_ok=True)
+        with open(arguments.baseline, 'w') as baseline_file:
+            json.dump({'python': sys.version.split()[0], 'repeat': arguments.repeat, 'results': results},
+                      baseline_file, indent=2, sort_keys=True)
+        print("Baseline saved to {}.".format(arguments.baseline))
+    elif regressions:
+        print("{} regression(s) against the baseline: {}".format(len(regressions), ', '.join(regressions)))
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,159 @@
+"""
+Compare requests/sec of sync(WSGI) and async(ASGI) webhook endpoints against local fake Confluence.
+
+Webhooks are processed in the request(`DNC_QUEUE_ENABLED = False`), each request updates one of `--pages` pages.
+Sync path is measured with one thread(single sync worker) and with `--concurrency` threads, async path with
+`--concurrency` concurrent requests on one event loop.
+
+    $ python benchmarks/webhook_throughput.py --requests 200 --concurrency 20 --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'alrescha.settings')
+
+from fake_confluence import FakeConfluence  # noqa: E402
+
+
+def setup_django(confluence_url, database, pool_size):
+    """
+    Configure settings for the benchmark and set up Django.
+    """
+    from django.conf import settings
+
+    settings.DATABASES = {'default': {'ENGINE': 'django.db.backends.sqlite3', 'NAME': database}}
+    settings.ALLOWED_HOSTS = ['*']
+    settings.DEBUG = False
+    settings.DNC_QUEUE_ENABLED = False
+    settings.DNC_WEBHOOK_TOKEN = 'benchmark'
+    settings.DNC_CONFLUENCE_CREDENTIALS = {'url': confluence_url, 'username': 'admin', 'password': 'admin'}
+    settings.DNC_SPACE_KEY = 'BENCH'
+    settings.DNC_CONFLUENCE_POOL_SIZE = pool_size
+
+    import django
+    django.setup()
+
+    from django.core.management import call_command
+    call_command('migrate', verbosity=0)
+
+
+def create_fields(pages):
+    """
+    Configure two fields for each of the benchmark models.
+    """
+    from django_netbox_confluence.models import NetBoxConfluenceField
+
+    for number in range(pages):
+        NetBoxConfluenceField.objects.create(model_name='model{}'.format(number), field_type='TextLinkedField',
+                                             field_name='name')
+        NetBoxConfluenceField.objects.create(model_name='model{}'.format(number), field_type='StatusLinkedField',
+                                             field_name='status')
+
+
+def make_payload(number, pages):
+    """
+    Make webhook body for `number`-th object. Objects are spread over `pages` models(pages).
+    """
+    return json.dumps({
+        'model': 'model{}'.format(number % pages),
+        'data': {
+            'id': number,
+            'name': 'object-{}'.format(number),
+            'status': {'label': 'Active' if number % 2 else 'Planned'},
+            'custom_fields': {},
+        },
+    })
+
+
+def run_sync(requests, concurrency, pages):
+    """
+    Post webhooks to the sync endpoint from `concurrency` threads.
+
+    :rtype: float
+    :returns: Requests per second.
+    """
+    from django.test import Client
+
+    def post(number):
+        response = Client().post('/netbox-wiki-api/model_change_trigger/', make_payload(number, pages),
+                                 content_type='application/json', HTTP_AUTHORIZATION='Token benchmark')
+        assert response.status_code in (200, 201), response.content
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(post, range(requests)))
+    return requests / (time.perf_counter() - started)
+
+
+def run_async(requests, concurrency, pages):
+    """
+    Post webhooks to the async endpoint with `concurrency` concurrent requests.
+    Each page is updated once before the measurement, as async adapter is created per event loop.
+
+    :rtype: float
+    :returns: Requests per second.
+    """
+    from django.test import AsyncClient
+
+    async def main():
+        client = AsyncClient()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def post(number):
+            async with semaphore:
+                response = await client.post('/netbox-wiki-api/async/model_change_trigger/',
+                                             make_payload(number, pages), content_type='application/json',
+                                             authorization='Token benchmark')
+                assert response.status_code in (200, 201), response.content
+
+        for number in range(pages):
+            await post(number)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(post(number) for number in range(requests)))
+        return requests / (time.perf_counter() - started)
+
+    return asyncio.run(main())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200, help="Number of webhooks per run.")
+    parser.add_argument('--concurrency', type=int, default=20, help="Concurrent requests.")
+    parser.add_argument('--pages', type=int, default=100, help="Number of distinct pages updated by webhooks.")
+    parser.add_argument('--latency', type=float, default=0.05, help="Seconds added to each Confluence response.")
+    arguments = parser.parse_args()
+
+    server = FakeConfluence(arguments.latency).serve()
+    with tempfile.TemporaryDirectory() as directory:
+        setup_django('http://127.0.0.1:{}'.format(server.server_address[1]), os.path.join(directory, 'db.sqlite3'),
+                     arguments.concurrency)
+        create_fields(arguments.pages)
+
+        # Create pages and warm up caches, so all runs update existing pages.
+        run_sync(arguments.pages, 1, arguments.pages)
+
+        results = [
+            ('sync, 1 thread', run_sync(arguments.requests, 1, arguments.pages)),
+            ('sync, {} threads'.format(arguments.concurrency),
+             run_sync(arguments.requests, arguments.concurrency, arguments.pages)),
+            ('async, {} concurrent'.format(arguments.concurrency),
+             run_async(arguments.requests, arguments.concurrency, arguments.pages)),
+        ]
+    server.shutdown()
+
+    print("Confluence latency: {:.0f} ms, {} requests, {} pages.".format(arguments.latency * 1000,
+                                                                         arguments.requests, arguments.pages))
+    for name, rate in results:
+        print("{:<24} {:>8.1f} req/s".format(name, rate))
+
+
+if __name__ == '__main__':
+    main()
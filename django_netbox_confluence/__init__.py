@@ -0,0 +1 @@
+default_app_config = 'django_netbox_confluence.apps.NetBoxWikiConfig'
@@ -1,6 +1,7 @@
-from django.contrib import admin
+from django.contrib import admin, messages
 
-from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence import dead_letters
+from django_netbox_confluence.models import DeadLetter, NetBoxConfluenceField, WebhookDelivery, WebhookJob
 
 
 class NetBoxConfluenceFieldAdmin(admin.ModelAdmin):
@@ -8,3 +9,45 @@ class NetBoxConfluenceFieldAdmin(admin.ModelAdmin):
 
 
 admin.site.register(NetBoxConfluenceField, NetBoxConfluenceFieldAdmin)
+
+
+class WebhookJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model_name', 'page_title', 'status', 'result', 'attempts', 'available_at', 'updated_at')
+    list_filter = ('status', 'result', 'model_name')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+admin.site.register(WebhookJob, WebhookJobAdmin)
+
+
+class DeadLetterAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model_name', 'page_title', 'source', 'status', 'attempts', 'error', 'created_at',
+                    'updated_at')
+    list_filter = ('status', 'source', 'model_name', 'created_at')
+    search_fields = ('page_title', 'error', 'payload')
+    readonly_fields = ('replayed_at', 'created_at', 'updated_at')
+    actions = ('replay', 'requeue')
+
+    def replay(self, request, queryset):
+        replayed, failed, stale = dead_letters.replay(queryset.filter(status=DeadLetter.STATUS_DEAD).order_by('id'))
+        self.message_user(request, "{} dead letter(s) replayed, {} failed, {} stale.".format(replayed, failed, stale),
+                          messages.WARNING if failed else messages.SUCCESS)
+    replay.short_description = "Replay selected dead letters now"
+
+    def requeue(self, request, queryset):
+        queued, failed, stale = dead_letters.requeue(queryset.filter(status=DeadLetter.STATUS_DEAD).order_by('id'))
+        self.message_user(request, "{} dead letter(s) queued, {} failed, {} stale.".format(queued, failed, stale),
+                          messages.WARNING if failed else messages.SUCCESS)
+    requeue.short_description = "Put selected dead letters to the queue"
+
+
+admin.site.register(DeadLetter, DeadLetterAdmin)
+
+
+class WebhookDeliveryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'model_name', 'object_id', 'last_updated', 'seen_at')
+    list_filter = ('model_name',)
+    search_fields = ('object_id',)
+
+
+admin.site.register(WebhookDelivery, WebhookDeliveryAdmin)
@@ -0,0 +1,264 @@
+import asyncio
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+from django.conf import settings
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.updater.exceptioins import AdmissionRejectedException
+
+
+class AdmissionController(object):
+    """
+    Limits number of updates the webhook endpoint runs at the same time, in total and per page. Update which can't be
+    admitted waits for a free slot for a bounded time and is rejected after that, so the process doesn't pile up
+    requests fighting over the same pages. In-flight and waiting updates are reported by gauges.
+    """
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    # Seconds between admission attempts of async requests, which can't wait for the condition.
+    ASYNC_POLL_INTERVAL = 0.01
+
+    def __init__(self, max_in_flight=None, max_per_page=None, wait=10, retry_after=5):
+        """
+        Init.
+
+        :type max_in_flight: int|None
+        :param max_in_flight: Maximum number of updates in flight. None - no limit.
+
+        :type max_per_page: int|None
+        :param max_per_page: Maximum number of updates of the same page in flight. None - no limit.
+
+        :type wait: float
+        :param wait: Seconds to wait for a free slot before the update is rejected.
+
+        :type retry_after: float
+        :param retry_after: Seconds after which rejected update should be sent again.
+        """
+        self.max_in_flight = max_in_flight
+        self.max_per_page = max_per_page
+        self.wait = wait
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.waiting = 0
+        # Number of in-flight updates by page title. Pages without updates are removed.
+        self.pages = dict()
+        self.condition = threading.Condition()
+        if self.max_in_flight:
+            metrics.set_gauge('dnc_admission_limit', self.max_in_flight)
+        self.report()
+
+    @classmethod
+    def get_shared(cls):
+        """
+        Get controller of the process configured by `DNC_ADMISSION_*` settings.
+
+        :rtype: AdmissionController|None
+        :returns: Controller or None if neither limit is set.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                max_in_flight = getattr(settings, 'DNC_ADMISSION_MAX_IN_FLIGHT', None)
+                max_per_page = getattr(settings, 'DNC_ADMISSION_MAX_PER_PAGE', None)
+                if not max_in_flight and not max_per_page:
+                    return None
+                cls._shared = cls(max_in_flight=max_in_flight,
+                                  max_per_page=max_per_page,
+                                  wait=getattr(settings, 'DNC_ADMISSION_WAIT', 10),
+                                  retry_after=getattr(settings, 'DNC_ADMISSION_RETRY_AFTER', 5))
+            return cls._shared
+
+    def report(self):
+        """
+        Set gauges of current load. Should be called under the condition.
+
+        :rtype: void
+        :returns: void
+        """
+        metrics.set_gauge('dnc_admission_in_flight', self.in_flight)
+        metrics.set_gauge('dnc_admission_waiting', self.waiting)
+        if self.max_in_flight:
+            metrics.set_gauge('dnc_admission_saturation', self.in_flight / self.max_in_flight)
+
+    def get_blocking_limit(self, page_title):
+        """
+        Check which limit doesn't let the update in. Should be called under the condition.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :rtype: str|None
+        :returns: `global` or `page`. None if the update can be admitted.
+        """
+        if self.max_in_flight and self.in_flight >= self.max_in_flight:
+            return 'global'
+        if self.max_per_page and self.pages.get(page_title, 0) >= self.max_per_page:
+            return 'page'
+        return None
+
+    def try_enter(self, page_title):
+        """
+        Take a slot if the limits let the update in. Should be called under the condition.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :rtype: str|None
+        :returns: Blocking limit, see `get_blocking_limit`. None if the slot is taken.
+        """
+        limit = self.get_blocking_limit(page_title)
+        if limit is None:
+            self.in_flight += 1
+            self.pages[page_title] = self.pages.get(page_title, 0) + 1
+            self.report()
+        return limit
+
+    def reject(self, page_title, limit):
+        """
+        Make exception of the update which wasn't admitted in time.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :type limit: str
+        :param limit: Blocking limit.
+
+        :rtype: AdmissionRejectedException
+        :returns: Exception to raise.
+        """
+        metrics.increment('dnc_admission_rejected_total', limit=limit)
+        if limit == 'global':
+            message = "{} updates are in flight.".format(self.in_flight)
+        else:
+            message = "{} updates of page `{}` are in flight.".format(self.pages.get(page_title, 0), page_title)
+        return AdmissionRejectedException(message, retry_after=self.retry_after)
+
+    def enter(self, page_title):
+        """
+        Take a slot, wait for it up to `wait` seconds.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :raises: AdmissionRejectedException
+
+        :rtype: void
+        :returns: void
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.wait
+        with self.condition:
+            limit = self.try_enter(page_title)
+            if limit is not None:
+                self.waiting += 1
+                self.report()
+                try:
+                    while limit is not None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self.reject(page_title, limit)
+                        self.condition.wait(remaining)
+                        limit = self.try_enter(page_title)
+                finally:
+                    self.waiting -= 1
+                    self.report()
+        metrics.observe('dnc_admission_wait_seconds', time.monotonic() - started_at)
+
+    async def aenter(self, page_title):
+        """
+        Same as `enter` but doesn't block the event loop while waiting.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :raises: AdmissionRejectedException
+
+        :rtype: void
+        :returns: void
+        """
+        started_at = time.monotonic()
+        deadline = started_at + self.wait
+        with self.condition:
+            limit = self.try_enter(page_title)
+            if limit is None:
+                metrics.observe('dnc_admission_wait_seconds', 0)
+                return
+            self.waiting += 1
+            self.report()
+        try:
+            while limit is not None:
+                if time.monotonic() >= deadline:
+                    with self.condition:
+                        raise self.reject(page_title, limit)
+                await asyncio.sleep(self.ASYNC_POLL_INTERVAL)
+                with self.condition:
+                    limit = self.try_enter(page_title)
+        finally:
+            with self.condition:
+                self.waiting -= 1
+                self.report()
+        metrics.observe('dnc_admission_wait_seconds', time.monotonic() - started_at)
+
+    def leave(self, page_title):
+        """
+        Free the slot of finished update and wake up waiting ones.
+
+        :type page_title: str
+        :param page_title: Title of the updated page.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.condition:
+            self.in_flight -= 1
+            count = self.pages.get(page_title, 0) - 1
+            if count > 0:
+                self.pages[page_title] = count
+            else:
+                self.pages.pop(page_title, None)
+            self.report()
+            self.condition.notify_all()
+
+
+@contextmanager
+def admit(page_title):
+    """
+    Context manager running the update of the page in an admitted slot. Does nothing if admission control is disabled.
+
+    :type page_title: str
+    :param page_title: Title of the updated page.
+
+    :raises: AdmissionRejectedException
+    """
+    controller = AdmissionController.get_shared()
+    if controller is None:
+        yield
+        return
+    controller.enter(page_title)
+    try:
+        yield
+    finally:
+        controller.leave(page_title)
+
+
+@asynccontextmanager
+async def aadmit(page_title):
+    """
+    Same as `admit` but doesn't block the event loop while waiting for the slot.
+
+    :type page_title: str
+    :param page_title: Title of the updated page.
+
+    :raises: AdmissionRejectedException
+    """
+    controller = AdmissionController.get_shared()
+    if controller is None:
+        yield
+        return
+    await controller.aenter(page_title)
+    try:
+        yield
+    finally:
+        controller.leave(page_title)
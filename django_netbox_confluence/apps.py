@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class NetBoxWikiConfig(AppConfig):
     name = 'django_netbox_confluence'
+
+    def ready(self):
+        # Connect signal receivers.
+        from django_netbox_confluence import signals  # noqa: F401
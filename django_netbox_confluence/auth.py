@@ -1,3 +1,5 @@
+import asyncio
+
 from django.http.response import JsonResponse
 from django.conf import settings
 
@@ -10,7 +12,11 @@ def authentication_required(method):
     :rtype: function
     :return: Wrapped function/decorator.
     """
-    def wrapper(self, request):
+    def check(request):
+        """
+        :rtype: JsonResponse|None
+        :return: Error response if the request is not authenticated.
+        """
         try:
             token = settings.DNC_WEBHOOK_TOKEN
         except AttributeError:
@@ -24,6 +30,21 @@ def authentication_required(method):
                 "message": "Unauthorized access.",
                 "error": "Wrong atuthorization token. Please check your NetBox admin settings `Additional headers:`.",
             }, status=401)
+        return None
+
+    if asyncio.iscoroutinefunction(method):
+        async def async_wrapper(self, request):
+            error_response = check(request)
+            if error_response is not None:
+                return error_response
+            return await method(self, request)
+
+        return async_wrapper
+
+    def wrapper(self, request):
+        error_response = check(request)
+        if error_response is not None:
+            return error_response
         return method(self, request)
 
     return wrapper
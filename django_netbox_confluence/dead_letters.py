@@ -0,0 +1,257 @@
+import json
+import logging
+from collections import OrderedDict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from django_netbox_confluence import deliveries, jobs, metrics
+from django_netbox_confluence.models import DeadLetter
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_enabled():
+    """
+    Check whether failed events should be kept.
+
+    :rtype: bool
+    :returns: Value of `DNC_DEAD_LETTERS_ENABLED` setting.
+    """
+    return getattr(settings, 'DNC_DEAD_LETTERS_ENABLED', True)
+
+
+def format_error(error):
+    """
+    Format exception the same way as `last_error` of the failed job.
+
+    :type error: Exception
+    :param error: Raised exception.
+
+    :rtype: str
+    :returns: Error description.
+    """
+    return "{}: {}".format(type(error).__name__, error)
+
+
+def store(data, error, source, attempts=1, page_title=None):
+    """
+    Keep failed event, so it can be replayed later.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :type error: Exception
+    :param error: Reason of the failure.
+
+    :type source: str
+    :param source: One of `DeadLetter.SOURCE_*`.
+
+    :type attempts: int
+    :param attempts: Number of failed attempts.
+
+    :type page_title: str|None
+    :param page_title: Title of the page. Generated from the payload if not given.
+
+    :rtype: DeadLetter|None
+    :returns: Stored dead letter. None if dead letters are disabled.
+    """
+    if not is_enabled():
+        return None
+    if page_title is None:
+        try:
+            page_title = WikiPageUpdater.generate_page_name(data['model'], data)
+        except WikiUpdateException:
+            page_title = ''
+    metrics.increment('dnc_dead_letters_total', source=source, model=data['model'])
+    return DeadLetter.objects.create(model_name=data['model'],
+                                     page_title=page_title,
+                                     payload=json.dumps(data),
+                                     source=source,
+                                     attempts=attempts,
+                                     error=format_error(error))
+
+
+def split_stale(letters):
+    """
+    Separate dead letters of the objects changed by newer delivered events. Replaying them would replace newer values
+    on the page with older ones.
+
+    :type letters: iterable
+    :param letters: Dead letters ordered from the oldest to the newest.
+
+    :rtype: tuple(list, list)
+    :returns: Dead letters which can be replayed and stale ones.
+    """
+    fresh, stale = list(), list()
+    for letter in letters:
+        try:
+            is_stale = deliveries.is_stale(json.loads(letter.payload))
+        except (ValueError, KeyError, TypeError, AttributeError):
+            # Broken payload fails on its own when it is replayed.
+            is_stale = False
+        (stale if is_stale else fresh).append(letter)
+    return fresh, stale
+
+
+def mark_stale(letters):
+    """
+    Mark dead letters as stale, they are not replayed anymore.
+
+    :type letters: list
+    :param letters: Dead letters.
+
+    :rtype: void
+    :returns: void
+    """
+    (DeadLetter.objects
+     .filter(pk__in=[letter.pk for letter in letters])
+     .update(status=DeadLetter.STATUS_STALE, error="Newer event of the object was delivered.",
+             updated_at=timezone.now()))
+
+
+def group_by_page(letters):
+    """
+    Build field chains of the dead letters and group them by page. Page title is generated again, as sharding may have
+    been changed since the failure.
+
+    :type letters: iterable
+    :param letters: Dead letters ordered from the oldest to the newest.
+
+    :rtype: tuple(OrderedDict, list)
+    :returns: Mapping of page title to list of (dead letter, updater, field chain) tuples and list of
+    (dead letter, exception) tuples of the letters whose field chain can't be built.
+    """
+    updaters = list()
+    invalid = list()
+    for letter in letters:
+        try:
+            updaters.append((letter, WikiPageUpdater(json.loads(letter.payload))))
+        except Exception as e:
+            invalid.append((letter, e))
+
+    # Related objects of all dead letters are loaded together.
+    WikiPageUpdater.prefetch_related([updater for _, updater in updaters])
+    pages = OrderedDict()
+    for letter, updater in updaters:
+        try:
+            field_chain = updater.get_field_chain()
+        except Exception as e:
+            invalid.append((letter, e))
+            continue
+        pages.setdefault(updater.page_title, list()).append((letter, updater, field_chain))
+    return pages, invalid
+
+
+def write_page(updates):
+    """
+    Write merged fields of the dead letters of the same page. Doesn't touch the database, so it can be run in threads.
+
+    :type updates: list
+    :param updates: List of (dead letter, updater, field chain) tuples of the page.
+
+    :raises: WikiUpdateException
+
+    :rtype: bool
+    :returns: Whether the page was written.
+    """
+    updater = updates[-1][1]
+    return updater.write(WikiPageUpdater.merge_field_chains([field_chain for _, _, field_chain in updates]))
+
+
+def mark_replayed(letters):
+    """
+    Mark dead letters as successfully replayed.
+
+    :type letters: list
+    :param letters: Dead letters.
+
+    :rtype: void
+    :returns: void
+    """
+    now = timezone.now()
+    (DeadLetter.objects
+     .filter(pk__in=[letter.pk for letter in letters])
+     .update(status=DeadLetter.STATUS_REPLAYED, replayed_at=now, error='', updated_at=now))
+
+
+def mark_failed(letters, error):
+    """
+    Save failed replay of the dead letters.
+
+    :type letters: list
+    :param letters: Dead letters.
+
+    :type error: Exception
+    :param error: Reason of the failure.
+
+    :rtype: void
+    :returns: void
+    """
+    (DeadLetter.objects
+     .filter(pk__in=[letter.pk for letter in letters])
+     .update(attempts=F('attempts') + 1, error=format_error(error), updated_at=timezone.now()))
+
+
+def replay(letters):
+    """
+    Write dead letters to the Wiki page by page with one fetch and one save per page.
+
+    :type letters: iterable
+    :param letters: Dead letters ordered from the oldest to the newest.
+
+    :rtype: tuple(int, int, int)
+    :returns: Number of replayed, failed and stale dead letters.
+    """
+    letters, stale = split_stale(letters)
+    mark_stale(stale)
+    pages, invalid = group_by_page(letters)
+    failed = len(invalid)
+    for letter, error in invalid:
+        mark_failed([letter], error)
+
+    replayed = 0
+    for updates in pages.values():
+        page_letters = [letter for letter, _, _ in updates]
+        try:
+            write_page(updates)
+        except Exception as e:
+            logger.exception("Replay of dead letters %s failed.", [letter.pk for letter in page_letters])
+            mark_failed(page_letters, e)
+            failed += len(page_letters)
+            continue
+        mark_replayed(page_letters)
+        replayed += len(page_letters)
+    return replayed, failed, len(stale)
+
+
+def requeue(letters):
+    """
+    Put dead letters back to the processing queue. Queued letters are marked as replayed, if the job fails again a new
+    dead letter is stored.
+
+    :type letters: iterable
+    :param letters: Dead letters ordered from the oldest to the newest.
+
+    :rtype: tuple(int, int, int)
+    :returns: Number of queued, failed and stale dead letters.
+    """
+    letters, stale = split_stale(letters)
+    queued, failed = list(), 0
+    with transaction.atomic():
+        mark_stale(stale)
+        for letter in letters:
+            try:
+                jobs.enqueue(json.loads(letter.payload))
+            except (ValueError, WikiUpdateException) as e:
+                mark_failed([letter], e)
+                failed += 1
+                continue
+            queued.append(letter)
+        mark_replayed(queued)
+    return len(queued), failed, len(stale)
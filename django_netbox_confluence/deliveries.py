@@ -0,0 +1,244 @@
+import hashlib
+import json
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.models import WebhookDelivery
+
+
+RESULT_DUPLICATE = 'duplicate'
+RESULT_STALE = 'stale'
+
+# Seconds between deletions of forgotten deliveries by the process.
+PURGE_INTERVAL = 60
+# Attempts to record the delivery when concurrent deliveries of the same object keep changing the record.
+RECORD_ATTEMPTS = 3
+
+_lock = threading.Lock()
+_purged_at = [None]
+
+
+def is_enabled():
+    """
+    Check whether repeated and out-of-order deliveries should be dropped.
+
+    :rtype: bool
+    :returns: Value of `DNC_DEDUP_ENABLED` setting.
+    """
+    return getattr(settings, 'DNC_DEDUP_ENABLED', True)
+
+
+def get_retention():
+    """
+    Get seconds the delivery is remembered for.
+
+    :rtype: float
+    :returns: Value of `DNC_DEDUP_RETENTION` setting.
+    """
+    return getattr(settings, 'DNC_DEDUP_RETENTION', 3600)
+
+
+def get_object_id(data):
+    """
+    Get id of the changed object.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: str|None
+    :returns: Object id or None if the payload has no id, then the event isn't checked.
+    """
+    object_id = data['data'].get('id')
+    return None if object_id is None else str(object_id)
+
+
+def make_hash(data):
+    """
+    Hash the event type and the object data. Delivery time and request id are not hashed, so repeated deliveries of the
+    same change have the same hash.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: str
+    :returns: Hex SHA-256 digest.
+    """
+    content = json.dumps([data.get('event'), data['data']], sort_keys=True, default=str)
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+def get_last_updated(data):
+    """
+    Get `last_updated` time of the object.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: datetime.datetime|None
+    :returns: Time or None if it is missing or can't be parsed, then the event order isn't checked.
+    """
+    value = data['data'].get('last_updated')
+    if type(value) is not str:
+        return None
+    try:
+        last_updated = parse_datetime(value)
+    except ValueError:
+        return None
+    if last_updated is None:
+        return None
+    if timezone.is_naive(last_updated):
+        last_updated = timezone.make_aware(last_updated, timezone.utc)
+    if not settings.USE_TZ:
+        last_updated = timezone.make_naive(last_updated, timezone.utc)
+    return last_updated
+
+
+def get_drop_reason(delivery, payload_hash, last_updated):
+    """
+    Compare the event with the last accepted delivery of the object.
+
+    :type delivery: WebhookDelivery
+    :param delivery: Remembered delivery.
+
+    :type payload_hash: str
+    :param payload_hash: Hash of the event.
+
+    :type last_updated: datetime.datetime|None
+    :param last_updated: `last_updated` of the object in the event.
+
+    :rtype: str|None
+    :returns: `duplicate` or `stale`. None if the event should be written.
+    """
+    if delivery.payload_hash == payload_hash:
+        return RESULT_DUPLICATE
+    if last_updated is not None and delivery.last_updated is not None and last_updated < delivery.last_updated:
+        return RESULT_STALE
+    return None
+
+
+def purge(now):
+    """
+    Delete deliveries older than the retention window. Runs at most once per `PURGE_INTERVAL` in the process.
+
+    :type now: datetime.datetime
+    :param now: Current time.
+
+    :rtype: void
+    :returns: void
+    """
+    with _lock:
+        if _purged_at[0] is not None and time.monotonic() - _purged_at[0] < PURGE_INTERVAL:
+            return
+        _purged_at[0] = time.monotonic()
+    WebhookDelivery.objects.filter(seen_at__lt=now - timedelta(seconds=get_retention())).delete()
+
+
+def check(data):
+    """
+    Remember the delivery of the event or tell why it should be dropped. Events of the same object whose payload was
+    already accepted within the retention window are duplicates. Events whose object `last_updated` is older than the
+    accepted one are stale, writing them would replace newer values on the page.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: str|None
+    :returns: `duplicate` or `stale`. None if the event should be written.
+    """
+    if not is_enabled():
+        return None
+    object_id = get_object_id(data)
+    if object_id is None:
+        return None
+
+    model_name = data['model']
+    payload_hash = make_hash(data)
+    last_updated = get_last_updated(data)
+    now = timezone.now()
+    purge(now)
+    remembered_after = now - timedelta(seconds=get_retention())
+
+    for _ in range(RECORD_ATTEMPTS):
+        delivery = WebhookDelivery.objects.filter(model_name=model_name, object_id=object_id).first()
+        if delivery is None:
+            try:
+                with transaction.atomic():
+                    WebhookDelivery.objects.create(model_name=model_name, object_id=object_id,
+                                                   payload_hash=payload_hash, last_updated=last_updated, seen_at=now)
+                return None
+            except IntegrityError:
+                # Concurrent delivery of the object was recorded first.
+                continue
+
+        if delivery.seen_at >= remembered_after:
+            reason = get_drop_reason(delivery, payload_hash, last_updated)
+            if reason is not None:
+                metrics.increment('dnc_webhooks_deduplicated_total', model=model_name, reason=reason)
+                return reason
+
+        # Conditional update works as compare-and-swap, concurrent delivery which changed the record is checked again.
+        updated = (WebhookDelivery.objects
+                   .filter(pk=delivery.pk, payload_hash=delivery.payload_hash, seen_at=delivery.seen_at)
+                   .update(payload_hash=payload_hash, last_updated=last_updated or delivery.last_updated, seen_at=now,
+                           previous_payload_hash=delivery.payload_hash, previous_last_updated=delivery.last_updated))
+        if updated:
+            return None
+    return None
+
+
+def is_stale(data):
+    """
+    Check whether a newer event of the object was delivered since the event, e.g. before the dead letter of the event
+    is replayed. Remembered deliveries are compared regardless of the retention window until they are purged.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: bool
+    :returns: True if the object `last_updated` of the event is older than the delivered one.
+    """
+    if not is_enabled():
+        return False
+    object_id = get_object_id(data)
+    last_updated = get_last_updated(data)
+    if object_id is None or last_updated is None:
+        return False
+    delivery = WebhookDelivery.objects.filter(model_name=data['model'], object_id=object_id).first()
+    return delivery is not None and get_drop_reason(delivery, None, last_updated) == RESULT_STALE
+
+
+def forget(data):
+    """
+    Forget the delivery of the event which failed, so it isn't dropped when it is delivered again. The delivery
+    accepted before it is remembered again, so older events of the object are still dropped. Nothing is forgotten if
+    another event of the object was accepted since.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :rtype: void
+    :returns: void
+    """
+    if not is_enabled():
+        return
+    object_id = get_object_id(data)
+    if object_id is None:
+        return
+    deliveries = WebhookDelivery.objects.filter(model_name=data['model'], object_id=object_id,
+                                                payload_hash=make_hash(data))
+    # Conditional update works as compare-and-swap, delivery accepted concurrently isn't rolled back.
+    rolled_back = (deliveries
+                   .exclude(previous_payload_hash='')
+                   .update(payload_hash=F('previous_payload_hash'), last_updated=F('previous_last_updated'),
+                           previous_payload_hash='', previous_last_updated=None))
+    if not rolled_back:
+        # The first remembered delivery of the object.
+        deliveries.filter(previous_payload_hash='').delete()
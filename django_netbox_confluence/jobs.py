@@ -0,0 +1,280 @@
+import json
+import logging
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import F, Q, Max, Min
+from django.utils import timezone
+
+from django_netbox_confluence import dead_letters, deliveries, metrics
+from django_netbox_confluence.models import DeadLetter, PageLock, WebhookJob
+from django_netbox_confluence.updater.exceptioins import ConfluenceUnavailableException
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue(data):
+    """
+    Put webhook payload into the queue.
+
+    :type data: dict
+    :param data: Validated webhook body.
+
+    :raises: WikiUpdateException
+
+    :rtype: WebhookJob
+    :returns: Newly created job.
+    """
+    return WebhookJob.objects.create(model_name=data['model'],
+                                     page_title=WikiPageUpdater.generate_page_name(data['model'], data),
+                                     payload=json.dumps(data))
+
+
+def claim_batch(visibility_timeout, coalesce_window=0, coalesce_max_wait=30, batch_size=500):
+    """
+    Take all available jobs of the next ready page and lock them for the current worker.
+    Job is available if it is pending and its retry time has come, or if it is being processed by a worker whose
+    visibility timeout is expired(worker has died or hanged).
+    Page is ready when no new jobs arrived for it during the coalesce window, or when its oldest job waits longer than
+    the coalesce max wait. Pages which are being processed by another worker are skipped, the page stays locked until
+    its batch is released by `release`.
+
+    :type visibility_timeout: int
+    :param visibility_timeout: Seconds during which the jobs are invisible for other workers.
+
+    :type coalesce_window: float
+    :param coalesce_window: Seconds of silence after the last job of the page before the page is processed.
+
+    :type coalesce_max_wait: float
+    :param coalesce_max_wait: Seconds after which the page is processed even if new jobs keep coming.
+
+    :type batch_size: int
+    :param batch_size: Maximum number of jobs claimed at once.
+
+    :rtype: list
+    :returns: Claimed jobs of the same page ordered from the oldest to the newest. Empty if nothing is ready.
+    """
+    now = timezone.now()
+    available = (Q(status=WebhookJob.STATUS_PENDING, available_at__lte=now) |
+                 Q(status=WebhookJob.STATUS_PROCESSING, locked_until__lt=now))
+    busy_pages = (WebhookJob.objects
+                  .filter(status=WebhookJob.STATUS_PROCESSING, locked_until__gte=now)
+                  .values('page_title'))
+    pages = (WebhookJob.objects
+             .filter(available)
+             .exclude(page_title__in=busy_pages)
+             .values('page_title')
+             .annotate(newest=Max('created_at'), oldest=Min('created_at'))
+             .filter(Q(newest__lte=now - timedelta(seconds=coalesce_window)) |
+                     Q(oldest__lte=now - timedelta(seconds=coalesce_max_wait)))
+             .order_by('oldest')[:10])
+
+    for page in pages:
+        token = uuid.uuid4().hex
+        # Busy pages above are only a cheap filter, another worker may claim the page meanwhile.
+        if not lock_page(page['page_title'], token, now, visibility_timeout):
+            continue
+        pks = list(WebhookJob.objects
+                   .filter(available, page_title=page['page_title'])
+                   .values_list('pk', flat=True)[:batch_size])
+        # Conditional update works as compare-and-swap, so each job is taken by only one of the concurrent workers.
+        claimed = (WebhookJob.objects
+                   .filter(available, pk__in=pks)
+                   .update(status=WebhookJob.STATUS_PROCESSING,
+                           lock_token=token,
+                           locked_until=now + timedelta(seconds=visibility_timeout),
+                           attempts=F('attempts') + 1,
+                           updated_at=now))
+        if claimed:
+            return list(WebhookJob.objects.filter(lock_token=token, status=WebhookJob.STATUS_PROCESSING))
+        unlock_page(page['page_title'], token)
+    return []
+
+
+def lock_page(page_title, token, now, visibility_timeout):
+    """
+    Take the lock of the page, so only one worker processes its jobs at a time. The lock expires together with the
+    visibility timeout of the jobs.
+
+    :type page_title: str
+    :param page_title: Title of the page.
+
+    :type token: str
+    :param token: Token of the jobs batch.
+
+    :type now: datetime.datetime
+    :param now: Current time.
+
+    :type visibility_timeout: int
+    :param visibility_timeout: Seconds the lock is held unless released.
+
+    :rtype: bool
+    :returns: True if the lock is taken.
+    """
+    # Single insert which ignores the row created by another worker, so no read-then-write transaction is needed.
+    PageLock.objects.bulk_create([PageLock(page_title=page_title)], ignore_conflicts=True)
+    # Conditional update of the single row works as compare-and-swap, so only one worker gets the lock.
+    return bool(PageLock.objects
+                .filter(Q(locked_until__isnull=True) | Q(locked_until__lt=now), page_title=page_title)
+                .update(lock_token=token, locked_until=now + timedelta(seconds=visibility_timeout)))
+
+
+def unlock_page(page_title, token):
+    """
+    Release the lock of the page if it is still held by the batch.
+
+    :type page_title: str
+    :param page_title: Title of the page.
+
+    :type token: str
+    :param token: Token of the jobs batch.
+
+    :rtype: void
+    :returns: void
+    """
+    PageLock.objects.filter(page_title=page_title, lock_token=token).update(lock_token='', locked_until=None)
+
+
+def release(jobs):
+    """
+    Release the page of the processed batch, so its next jobs can be claimed.
+
+    :type jobs: list
+    :param jobs: Claimed jobs of the same page.
+
+    :rtype: void
+    :returns: void
+    """
+    if jobs:
+        unlock_page(jobs[0].page_title, jobs[0].lock_token)
+
+
+def fail(job, error, max_attempts, retry_delay):
+    """
+    Save failed attempt of the job. Job is scheduled for retry or marked as failed when it is out of attempts.
+    Payload of the failed job is kept as dead letter. Attempts failed because Confluence is unavailable are not counted.
+
+    :type job: WebhookJob
+    :param job: Claimed job.
+
+    :type error: Exception
+    :param error: Reason of the failure.
+
+    :type max_attempts: int
+    :param max_attempts: After this number of failed attempts job is marked as failed.
+
+    :type retry_delay: int
+    :param retry_delay: Base delay in seconds before retry. Doubled with each attempt.
+
+    :rtype: void
+    :returns: void
+    """
+    job.last_error = "{}: {}".format(type(error).__name__, error)
+    job.locked_until = None
+    if isinstance(error, ConfluenceUnavailableException):
+        # Job itself is fine, so the attempt isn't counted and the job doesn't run out of attempts during outage.
+        job.attempts -= 1
+        job.status = WebhookJob.STATUS_PENDING
+        job.available_at = timezone.now() + timedelta(seconds=max(error.retry_after or 0, retry_delay))
+    elif job.attempts >= max_attempts:
+        job.status = WebhookJob.STATUS_FAILED
+        payload = json.loads(job.payload)
+        dead_letters.store(payload, error, DeadLetter.SOURCE_QUEUE, attempts=job.attempts, page_title=job.page_title)
+        # NetBox may deliver the event again, so it isn't dropped as duplicate.
+        deliveries.forget(payload)
+    else:
+        job.status = WebhookJob.STATUS_PENDING
+        job.available_at = timezone.now() + timedelta(seconds=retry_delay * 2 ** (job.attempts - 1))
+    job.save(update_fields=['status', 'attempts', 'available_at', 'locked_until', 'last_error', 'updated_at'])
+
+
+def process(jobs, max_attempts, retry_delay):
+    """
+    Apply claimed jobs of the same page with one page fetch and one page save, and save the outcome.
+    Jobs whose payload can't be turned into a field chain fail alone, the rest are still applied.
+
+    :type jobs: list
+    :param jobs: Claimed jobs ordered from the oldest to the newest.
+
+    :type max_attempts: int
+    :param max_attempts: After this number of failed attempts job is marked as failed.
+
+    :type retry_delay: int
+    :param retry_delay: Base delay in seconds before retry. Doubled with each attempt.
+
+    :rtype: tuple(list, list)
+    :returns: Succeeded and failed jobs.
+    """
+    updaters = list()
+    field_chains = list()
+    applicable, failed = list(), list()
+    for job in jobs:
+        try:
+            updaters.append((job, WikiPageUpdater(json.loads(job.payload))))
+        except Exception as e:
+            logger.exception("Job %s failed on attempt %s.", job.pk, job.attempts)
+            fail(job, e, max_attempts, retry_delay)
+            failed.append(job)
+
+    # Related objects of all jobs are loaded together.
+    WikiPageUpdater.prefetch_related([updater for _, updater in updaters])
+    for job, updater in updaters:
+        try:
+            field_chains.append(updater.get_field_chain())
+        except Exception as e:
+            logger.exception("Job %s failed on attempt %s.", job.pk, job.attempts)
+            fail(job, e, max_attempts, retry_delay)
+            failed.append(job)
+        else:
+            applicable.append(job)
+
+    if not applicable:
+        return applicable, failed
+
+    try:
+        # All jobs are of the same page, so the last updater can write merged chain for all of them.
+        written = updater.write(WikiPageUpdater.merge_field_chains(field_chains))
+    except Exception as e:
+        logger.exception("Jobs %s failed.", [job.pk for job in applicable])
+        # Newest first, so deliveries of the jobs out of attempts are forgotten in reverse order they were accepted.
+        for job in reversed(applicable):
+            fail(job, e, max_attempts, retry_delay)
+        return list(), failed + applicable
+
+    now = timezone.now()
+    for job in applicable:
+        metrics.observe('dnc_job_latency_seconds', (now - job.created_at).total_seconds(), model=job.model_name)
+
+    (WebhookJob.objects
+     .filter(pk__in=[job.pk for job in applicable])
+     .update(status=WebhookJob.STATUS_DONE,
+             result=WebhookJob.RESULT_WRITTEN if written else WebhookJob.RESULT_SKIPPED,
+             locked_until=None,
+             last_error='',
+             updated_at=now))
+    return applicable, failed
+
+
+def get_queue_settings():
+    """
+    Get worker configuration from settings.
+
+    :rtype: dict
+    :returns: Worker options with defaults applied.
+    """
+    return {
+        'concurrency': getattr(settings, 'DNC_WORKER_CONCURRENCY', 1),
+        'visibility_timeout': getattr(settings, 'DNC_JOB_VISIBILITY_TIMEOUT', 300),
+        'max_attempts': getattr(settings, 'DNC_JOB_MAX_ATTEMPTS', 5),
+        'retry_delay': getattr(settings, 'DNC_JOB_RETRY_DELAY', 10),
+        'poll_interval': getattr(settings, 'DNC_WORKER_POLL_INTERVAL', 1.0),
+        'coalesce_window': getattr(settings, 'DNC_COALESCE_WINDOW', 0),
+        'coalesce_max_wait': getattr(settings, 'DNC_COALESCE_MAX_WAIT', 30),
+        'batch_size': getattr(settings, 'DNC_COALESCE_BATCH_SIZE', 500),
+        'warm_page_cache': getattr(settings, 'DNC_PAGE_CACHE_WARM', False),
+        'metrics_port': getattr(settings, 'DNC_WORKER_METRICS_PORT', None),
+        'metrics_address': getattr(settings, 'DNC_WORKER_METRICS_ADDRESS', ''),
+    }
@@ -0,0 +1,76 @@
+import io
+import pstats
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_netbox_confluence import profiling
+
+
+class Command(BaseCommand):
+    help = "Aggregate request profiles written by the profiling hook and show the hottest functions."
+
+    SORT_KEYS = {
+        'cumulative': pstats.SortKey.CUMULATIVE,
+        'tottime': pstats.SortKey.TIME,
+        'calls': pstats.SortKey.CALLS,
+    }
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', dest='directory', default=None,
+                            help="Directory of the profiles. Defaults to `DNC_PROFILE_DIR`.")
+        parser.add_argument('--model', action='append', dest='models', default=None,
+                            help="Aggregate profiles of the model only. Can be repeated.")
+        parser.add_argument('--page', help="Aggregate profiles of the pages whose title contains the text only.")
+        parser.add_argument('--min-size', type=int, default=None,
+                            help="Aggregate profiles of payloads of at least the given bytes only.")
+        parser.add_argument('--last', type=int, default=None, help="Aggregate the given number of newest profiles.")
+        parser.add_argument('--sort', choices=sorted(self.SORT_KEYS), default='tottime',
+                            help="Order of the functions: own time, time including callees or number of calls.")
+        parser.add_argument('--top', type=int, default=30, help="Number of functions to show.")
+
+    def get_profiles(self, options):
+        """
+        Get profiles matching the filters, from the oldest to the newest.
+
+        :type options: dict
+        :param options: Command options.
+
+        :rtype: list
+        :returns: List of (path, tags) tuples.
+        """
+        profiles = profiling.list_profiles(options['directory'] or profiling.get_directory())
+        if options['models']:
+            models = {profiling.UNSAFE_RE.sub('_', model_name) for model_name in options['models']}
+            profiles = [profile for profile in profiles if profile[1]['model'] in models]
+        if options['page']:
+            page = profiling.UNSAFE_RE.sub('_', options['page'])
+            profiles = [profile for profile in profiles if page in profile[1]['page']]
+        if options['min_size']:
+            profiles = [profile for profile in profiles if profile[1]['size'] >= options['min_size']]
+        if options['last']:
+            profiles = profiles[-options['last']:]
+        return profiles
+
+    def handle(self, *args, **options):
+        profiles = self.get_profiles(options)
+        if not profiles:
+            raise CommandError("No profiles found.")
+
+        output = io.StringIO()
+        stats = pstats.Stats(stream=output)
+        failed = 0
+        for path, _ in profiles:
+            try:
+                stats.add(path)
+            except (OSError, EOFError, ValueError, TypeError) as e:
+                # Profile may be written or rotated by the web process right now.
+                failed += 1
+                self.stderr.write("{}: skipped: {}".format(path, e))
+
+        models = sorted({tags['model'] for _, tags in profiles})
+        self.stdout.write("{} profile(s) of {} from {} to {}.".format(
+            len(profiles) - failed, ", ".join(models), profiles[0][1]['time'], profiles[-1][1]['time']))
+        # Files are already summarized above, so pstats doesn't list them.
+        stats.files = []
+        stats.strip_dirs().sort_stats(self.SORT_KEYS[options['sort']]).print_stats(options['top'])
+        self.stdout.write(output.getvalue())
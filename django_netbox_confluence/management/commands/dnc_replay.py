@@ -0,0 +1,167 @@
+import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from django_netbox_confluence import dead_letters
+from django_netbox_confluence.models import DeadLetter
+from django_netbox_confluence.throttling import TokenBucket
+
+
+class Command(BaseCommand):
+    help = ("Replay failed webhook events kept as dead letters. Events of the same page are written together with "
+            "one page fetch and one page save, pages are written in parallel.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models', default=None,
+                            help="Replay events of the model only. Can be repeated.")
+        parser.add_argument('--page', action='append', dest='pages', default=None,
+                            help="Replay events of the page only. Can be repeated.")
+        parser.add_argument('--source', choices=[source for source, _ in DeadLetter.SOURCE_CHOICES],
+                            help="Replay events failed in the given place only.")
+        parser.add_argument('--error', help="Replay events whose error contains the text only.")
+        parser.add_argument('--since', type=self.parse_datetime, help="Replay events failed after the time only.")
+        parser.add_argument('--until', type=self.parse_datetime, help="Replay events failed before the time only.")
+        parser.add_argument('--limit', type=int, default=None, help="Maximum number of events to replay.")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Number of pages written in parallel.")
+        parser.add_argument('--rate', type=float, default=5,
+                            help="Maximum number of page writes per second. 0 - no limit.")
+        parser.add_argument('--queue', action='store_true',
+                            help="Put the events to the processing queue instead of writing them right away.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only show which events would be replayed.")
+
+    @staticmethod
+    def parse_datetime(value):
+        """
+        Parse date and time option. Time without zone is taken in current timezone, date only - as its midnight.
+
+        :type value: str
+        :param value: ISO 8601 date and time, e.g. `2020-04-01 10:00` or `2020-04-01`.
+
+        :raises: ValueError
+
+        :rtype: datetime.datetime
+        :returns: Aware date and time.
+        """
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            if date is None:
+                raise ValueError("Wrong date and time `{}`.".format(value))
+            parsed = datetime.datetime.combine(date, datetime.time())
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def get_queryset(self, options):
+        """
+        Get dead letters matching the filters, from the oldest to the newest.
+
+        :type options: dict
+        :param options: Command options.
+
+        :rtype: django.db.models.QuerySet
+        :returns: Dead letters.
+        """
+        queryset = DeadLetter.objects.filter(status=DeadLetter.STATUS_DEAD)
+        if options['models']:
+            queryset = queryset.filter(model_name__in=options['models'])
+        if options['pages']:
+            queryset = queryset.filter(page_title__in=options['pages'])
+        if options['source']:
+            queryset = queryset.filter(source=options['source'])
+        if options['error']:
+            queryset = queryset.filter(error__icontains=options['error'])
+        if options['since']:
+            queryset = queryset.filter(created_at__gte=options['since'])
+        if options['until']:
+            queryset = queryset.filter(created_at__lt=options['until'])
+        queryset = queryset.order_by('id')
+        if options['limit']:
+            queryset = queryset[:options['limit']]
+        return queryset
+
+    def handle(self, *args, **options):
+        letters = list(self.get_queryset(options))
+        if not letters:
+            self.stdout.write("No dead letters to replay.")
+            return
+
+        # Objects of stale dead letters were changed by newer events, so their values are older than the page ones.
+        letters, stale = dead_letters.split_stale(letters)
+        for letter in stale:
+            self.stderr.write("Dead letter {}: stale, newer event of the object was delivered.".format(letter.pk))
+        if not options['dry_run']:
+            dead_letters.mark_stale(stale)
+        if not letters:
+            self.stdout.write("No dead letters to replay.")
+            return
+
+        if options['queue']:
+            if options['dry_run']:
+                self.stdout.write("{} dead letter(s) would be queued.".format(len(letters)))
+                return
+            queued, failed, _ = dead_letters.requeue(letters)
+            self.stdout.write("{} dead letter(s) queued.".format(queued))
+            if failed:
+                raise CommandError("{} dead letter(s) failed.".format(failed))
+            return
+
+        # Field chains are built here, as fields configuration may be read from database.
+        pages, invalid = dead_letters.group_by_page(letters)
+        self.stdout.write("{} dead letter(s) of {} page(s) to replay.".format(len(letters) - len(invalid),
+                                                                             len(pages)))
+        for letter, error in invalid:
+            self.stderr.write("Dead letter {}: can't be replayed: {}".format(letter.pk, error))
+        if options['dry_run']:
+            for title, updates in pages.items():
+                self.stdout.write("{}: {} dead letter(s) would be replayed.".format(title, len(updates)))
+            return
+        for letter, error in invalid:
+            dead_letters.mark_failed([letter], error)
+
+        bucket = TokenBucket(options['rate'])
+        failed = len(invalid)
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+            futures = {executor.submit(self.write_page, bucket, updates): (title, updates)
+                       for title, updates in pages.items()}
+            # Outcome is saved by the main thread, so worker threads don't need database connections.
+            for number, future in enumerate(as_completed(futures), 1):
+                title, updates = futures[future]
+                page_letters = [letter for letter, _, _ in updates]
+                try:
+                    written = future.result()
+                except Exception as e:
+                    failed += len(page_letters)
+                    dead_letters.mark_failed(page_letters, e)
+                    self.stderr.write("[{}/{}] {}: failed: {}".format(number, len(futures), title, e))
+                    continue
+                dead_letters.mark_replayed(page_letters)
+                self.stdout.write("[{}/{}] {}: {} dead letter(s) replayed, {}".format(
+                    number, len(futures), title, len(page_letters), "written" if written else "up to date"))
+
+        if failed:
+            raise CommandError("{} dead letter(s) failed. Run the command again to retry them.".format(failed))
+
+    @staticmethod
+    def write_page(bucket, updates):
+        """
+        Write merged fields of all dead letters of the page.
+
+        :type bucket: TokenBucket
+        :param bucket: Rate limiter of page writes.
+
+        :type updates: list
+        :param updates: List of (dead letter, updater, field chain) tuples of the page.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written.
+        """
+        bucket.acquire()
+        return dead_letters.write_page(updates)
@@ -0,0 +1,160 @@
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence.updater import sharding
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+from django_netbox_confluence.updater.linked_fields import TextLinkedField
+from django_netbox_confluence.updater.targets import get_targets
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+class Command(BaseCommand):
+    help = ("Move excerpts of existing pages from one page sharding layout to another. "
+            "Run it after `DNC_PAGE_SHARDING` is changed.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='source', required=True, choices=sorted(sharding.STRATEGIES),
+                            help="Sharding the pages were written with.")
+        parser.add_argument('--to', dest='target', default=None, choices=sorted(sharding.STRATEGIES),
+                            help="Sharding to move the excerpts to. Defaults to the configured one.")
+        parser.add_argument('--model', action='append', dest='models', default=None,
+                            help="Model to move. Can be repeated. Defaults to all configured models.")
+        parser.add_argument('--target', action='append', dest='targets', default=None,
+                            help="Confluence target to reshard. Can be repeated. Defaults to all configured targets.")
+        parser.add_argument('--delete-source', action='store_true',
+                            help="Delete source pages which are not used by the new layout.")
+        parser.add_argument('--dry-run', action='store_true',
+                            help="Only show which pages would be written.")
+
+    def handle(self, *args, **options):
+        models = options['models'] or list(NetBoxConfluenceField.objects
+                                           .order_by('model_name')
+                                           .values_list('model_name', flat=True)
+                                           .distinct())
+        try:
+            target_names = options['targets'] or list(get_targets())
+        except WikiUpdateException as e:
+            raise CommandError(str(e))
+
+        failed = 0
+        for target_name in target_names:
+            if len(target_names) > 1:
+                self.stdout.write("Target `{}`:".format(target_name))
+            failed += self.reshard_target(target_name, models, options)
+
+        if failed:
+            raise CommandError("{} page(s) failed. Run the command again to retry them.".format(failed))
+
+    def reshard_target(self, target_name, models, options):
+        """
+        Move excerpts of the pages of one Confluence target.
+
+        :type target_name: str
+        :param target_name: Name of the Confluence target.
+
+        :type models: list
+        :param models: Names of the models to move.
+
+        :type options: dict
+        :param options: Command options.
+
+        :raises: CommandError
+
+        :rtype: int
+        :returns: Number of pages which failed.
+        """
+        try:
+            adapter = WikiPageUpdater.get_confluence_adapter(target_name)
+            titles = [page['title'] for page in adapter.iter_pages()]
+        except WikiUpdateException as e:
+            raise CommandError(str(e))
+
+        failed = 0
+        for model_name in models:
+            source = sharding.get_strategy(model_name, options['source'])
+            target = sharding.get_strategy(model_name, options['target'])
+            if source.name == target.name:
+                self.stdout.write("{}: source and target sharding are the same, skipped.".format(model_name))
+                continue
+
+            try:
+                source_titles, targets = self.collect_excerpts(adapter, source, target, titles)
+            except WikiUpdateException as e:
+                raise CommandError(str(e))
+            self.stdout.write("{}: {} source page(s), {} target page(s).".format(model_name, len(source_titles),
+                                                                               len(targets)))
+
+            for title, fields in targets.items():
+                if options['dry_run']:
+                    self.stdout.write("{}: {} excerpt(s) would be written.".format(title, len(fields)))
+                    continue
+                try:
+                    page_id, page_content = adapter.get_page_or_create(title)
+                    if WikiPageUpdater.apply_field_chain(page_content, fields):
+                        adapter.update_page_content(page_id, title, page_content)
+                except WikiUpdateException as e:
+                    failed += 1
+                    self.stderr.write("{}: failed: {}".format(title, e))
+                    continue
+                self.stdout.write("{}: {} excerpt(s) written.".format(title, len(fields)))
+
+            if options['delete_source'] and not options['dry_run'] and not failed:
+                for title, page_id in source_titles.items():
+                    if title in targets:
+                        continue
+                    try:
+                        adapter.delete_page(page_id, title)
+                    except WikiUpdateException as e:
+                        failed += 1
+                        self.stderr.write("{}: failed to delete: {}".format(title, e))
+                        continue
+                    self.stdout.write("{}: deleted.".format(title))
+
+        return failed
+
+    def collect_excerpts(self, adapter, source, target, titles):
+        """
+        Read excerpts of the source pages and group them by target page.
+
+        :type adapter: ConfluenceAdapter
+        :param adapter: Confluence adapter.
+
+        :type source: SinglePageSharding
+        :param source: Sharding the pages were written with.
+
+        :type target: SinglePageSharding
+        :param target: Sharding to move the excerpts to.
+
+        :type titles: list
+        :param titles: Titles of all pages of the space.
+
+        :raises: WikiUpdateException
+
+        :rtype: tuple(OrderedDict, OrderedDict)
+        :returns: Mapping of source page title to page id and mapping of target page title to list of LinkedFields.
+        """
+        source_titles = OrderedDict()
+        targets = OrderedDict()
+        field_names = ["{}{}".format("custom_" if is_custom else "", field_name)
+                       for field_name, is_custom in (NetBoxConfluenceField.objects
+                                                     .filter(model_name=source.model_name)
+                                                     .values_list('field_name', 'is_custom_field'))]
+        for title in titles:
+            page_key = source.parse_page_title(title)
+            if page_key is None:
+                continue
+            page_id, page_content = adapter.get_page_or_create(title)
+            source_titles[title] = page_id
+
+            for excerpt_name, paragraphs in page_content.excerpts.items():
+                key, field_name = source.parse_excerpt_name(page_key, excerpt_name, field_names)
+                if key is None and target.per_object:
+                    # Single page keeps the value of the last changed object only, objects can't be told apart.
+                    raise WikiUpdateException("Excerpts of `{}` page don't belong to particular objects. "
+                                              "Use `dnc_resync` command to fill the pages.".format(title))
+                field = TextLinkedField(field_name, paragraphs[0].text)
+                field.excerpt_name = target.get_excerpt_name(key, field_name)
+                targets.setdefault(target.get_page_title(key), list()).append(field)
+        return source_titles, targets
@@ -0,0 +1,169 @@
+import json
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from django.core.management.base import BaseCommand, CommandError
+
+from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence.netbox_client import NetBoxClient, NetBoxClientException
+from django_netbox_confluence.throttling import TokenBucket
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+class Command(BaseCommand):
+    help = "Read all objects of configured models from NetBox and write their fields to Confluence pages."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', action='append', dest='models', default=None,
+                            help="Model to resync. Can be repeated. Defaults to all configured models.")
+        parser.add_argument('--concurrency', type=int, default=4,
+                            help="Number of pages written in parallel.")
+        parser.add_argument('--rate', type=float, default=5,
+                            help="Maximum number of page writes per second. 0 - no limit.")
+        parser.add_argument('--page-size', type=int, default=1000,
+                            help="Number of objects read from NetBox per request.")
+        parser.add_argument('--checkpoint',
+                            help="File where written pages are recorded. Pages listed in it are skipped, "
+                                 "so an interrupted resync can be resumed.")
+
+    def handle(self, *args, **options):
+        models = options['models'] or list(NetBoxConfluenceField.objects
+                                           .order_by('model_name')
+                                           .values_list('model_name', flat=True)
+                                           .distinct())
+        done = self.load_checkpoint(options['checkpoint'])
+        self.checkpoint_lock = threading.Lock()
+
+        try:
+            pages = self.collect_pages(NetBoxClient.from_settings(), models, options['page_size'])
+        except NetBoxClientException as e:
+            raise CommandError(str(e))
+
+        pending = OrderedDict((title, updates) for title, updates in pages.items() if title not in done)
+        self.stdout.write("{} page(s) to write, {} already done.".format(len(pending), len(pages) - len(pending)))
+
+        bucket = TokenBucket(options['rate'])
+        failed = 0
+        with ThreadPoolExecutor(max_workers=max(1, options['concurrency'])) as executor:
+            futures = {executor.submit(self.write_page, bucket, updates): title
+                       for title, updates in pending.items()}
+            for number, future in enumerate(as_completed(futures), 1):
+                title = futures[future]
+                try:
+                    written = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write("[{}/{}] {}: failed: {}".format(number, len(futures), title, e))
+                    continue
+                self.save_checkpoint(options['checkpoint'], done, title)
+                self.stdout.write("[{}/{}] {}: {}".format(number, len(futures), title,
+                                                          "written" if written else "up to date"))
+
+        if failed:
+            raise CommandError("{} page(s) failed. Run the command again to retry them.".format(failed))
+
+    def collect_pages(self, client, models, page_size):
+        """
+        Read objects from NetBox and group their field chains by target page.
+
+        :type client: NetBoxClient
+        :param client: NetBox client.
+
+        :type models: list
+        :param models: Model names.
+
+        :type page_size: int
+        :param page_size: Number of objects read from NetBox per request.
+
+        :raises: NetBoxClientException
+
+        :rtype: OrderedDict
+        :returns: Mapping of page title to list of (updater, field chain) tuples.
+        """
+        pages = OrderedDict()
+        for model_name in models:
+            count = 0
+            updaters = list()
+            for obj in client.iter_objects(model_name, page_size=page_size):
+                # Objects of the REST API have the same format as `data` of the webhook payload.
+                try:
+                    updaters.append(WikiPageUpdater({'model': model_name, 'data': obj}))
+                except WikiUpdateException as e:
+                    self.stderr.write("{} #{}: skipped: {}".format(model_name, obj.get('id'), e))
+
+            # Related objects of all objects of the model are loaded together.
+            WikiPageUpdater.prefetch_related(updaters)
+            for updater in updaters:
+                try:
+                    field_chain = updater.get_field_chain()
+                except WikiUpdateException as e:
+                    self.stderr.write("{} #{}: skipped: {}".format(model_name, updater.data['data'].get('id'), e))
+                    continue
+                pages.setdefault(updater.page_title, list()).append((updater, field_chain))
+                count += 1
+            self.stdout.write("{}: {} object(s) read.".format(model_name, count))
+        return pages
+
+    @staticmethod
+    def write_page(bucket, updates):
+        """
+        Write merged fields of all objects of the page.
+
+        :type bucket: TokenBucket
+        :param bucket: Rate limiter of page writes.
+
+        :type updates: list
+        :param updates: List of (updater, field chain) tuples of the page.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written.
+        """
+        bucket.acquire()
+        updater = updates[-1][0]
+        return updater.write(WikiPageUpdater.merge_field_chains([field_chain for _, field_chain in updates]))
+
+    @staticmethod
+    def load_checkpoint(path):
+        """
+        Load titles of already written pages.
+
+        :type path: str|None
+        :param path: Checkpoint file path.
+
+        :rtype: set
+        :returns: Page titles.
+        """
+        if not path or not os.path.exists(path):
+            return set()
+        with open(path) as checkpoint:
+            return set(json.load(checkpoint))
+
+    def save_checkpoint(self, path, done, page_title):
+        """
+        Record written page in the checkpoint file.
+
+        :type path: str|None
+        :param path: Checkpoint file path.
+
+        :type done: set
+        :param done: Titles of already written pages.
+
+        :type page_title: str
+        :param page_title: Title of the written page.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.checkpoint_lock:
+            done.add(page_title)
+            if not path:
+                return
+            # Write to temporary file first so interruption doesn't leave broken checkpoint.
+            with open(path + '.tmp', 'w') as checkpoint:
+                json.dump(sorted(done), checkpoint)
+            os.replace(path + '.tmp', path)
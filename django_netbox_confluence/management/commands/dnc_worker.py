@@ -0,0 +1,96 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from django_netbox_confluence import jobs, metrics, profiling
+from django_netbox_confluence.updater import targets
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+class Command(BaseCommand):
+    help = "Process queued NetBox webhooks and update Confluence pages."
+
+    def add_arguments(self, parser):
+        defaults = jobs.get_queue_settings()
+        parser.add_argument('--concurrency', type=int, default=defaults['concurrency'],
+                            help="Number of jobs processed in parallel.")
+        parser.add_argument('--visibility-timeout', type=int, default=defaults['visibility_timeout'],
+                            help="Seconds after which a job locked by a dead worker becomes available again.")
+        parser.add_argument('--max-attempts', type=int, default=defaults['max_attempts'],
+                            help="Number of attempts before the job is marked as failed.")
+        parser.add_argument('--retry-delay', type=int, default=defaults['retry_delay'],
+                            help="Base delay in seconds before a failed job is retried.")
+        parser.add_argument('--poll-interval', type=float, default=defaults['poll_interval'],
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--coalesce-window', type=float, default=defaults['coalesce_window'],
+                            help="Seconds without new jobs for the page before its jobs are applied together.")
+        parser.add_argument('--coalesce-max-wait', type=float, default=defaults['coalesce_max_wait'],
+                            help="Seconds after which page jobs are applied even if new ones keep coming.")
+        parser.add_argument('--batch-size', type=int, default=defaults['batch_size'],
+                            help="Maximum number of jobs of the same page applied together.")
+        parser.add_argument('--warm-page-cache', action='store_true', default=defaults['warm_page_cache'],
+                            help="List all pages of the target spaces on start so pages are fetched by id from the start.")
+        parser.add_argument('--metrics-port', type=int, default=defaults['metrics_port'],
+                            help="Port of HTTP server exposing metrics of the worker at `/metrics`.")
+        parser.add_argument('--metrics-address', default=defaults['metrics_address'],
+                            help="Address of the metrics server. Defaults to all interfaces.")
+        parser.add_argument('--once', action='store_true',
+                            help="Drain the queue and exit instead of waiting for new jobs.")
+
+    def handle(self, *args, **options):
+        self.stop_event = threading.Event()
+        concurrency = max(1, options['concurrency'])
+        if options['warm_page_cache']:
+            for name in targets.get_targets():
+                count = WikiPageUpdater.get_confluence_adapter(name).warm_page_cache()
+                self.stdout.write("Page cache of `{}` target is warmed up with {} page(s).".format(name, count))
+        if options['metrics_port'] and metrics.is_enabled():
+            # Pages are written by the worker, so its metrics are scraped from the worker itself.
+            metrics.serve(options['metrics_port'], options['metrics_address'])
+            self.stdout.write("Serving metrics on port {}.".format(options['metrics_port']))
+        self.stdout.write("Starting {} worker(s).".format(concurrency))
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.work, options) for _ in range(concurrency)]
+            try:
+                for future in futures:
+                    future.result()
+            except KeyboardInterrupt:
+                self.stop_event.set()
+
+    def work(self, options):
+        """
+        Worker loop. Claims jobs page by page until stopped(or until the queue is empty if `--once` is given).
+
+        :type options: dict
+        :param options: Command options.
+
+        :rtype: void
+        :returns: void
+        """
+        # There is no point to wait for more jobs when draining the queue.
+        coalesce_window = 0 if options['once'] else options['coalesce_window']
+        try:
+            while not self.stop_event.is_set():
+                batch = jobs.claim_batch(options['visibility_timeout'], coalesce_window,
+                                         options['coalesce_max_wait'], options['batch_size'])
+                if not batch:
+                    if options['once']:
+                        return
+                    self.stop_event.wait(options['poll_interval'])
+                    continue
+
+                try:
+                    succeeded, failed = profiling.run_batch(jobs.process, batch, options['max_attempts'],
+                                                            options['retry_delay'])
+                finally:
+                    jobs.release(batch)
+                for job in succeeded:
+                    self.stdout.write("Job {} done.".format(job.pk))
+                for job in failed:
+                    self.stderr.write("Job {} failed: {}".format(job.pk, job.last_error))
+        finally:
+            # Each thread has its own connection which should be closed explicitly.
+            connection.close()
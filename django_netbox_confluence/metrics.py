@@ -0,0 +1,378 @@
+import asyncio
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+from django.conf import settings
+
+
+# Upper bounds of histogram buckets in seconds.
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_gauges = dict()
+# Mapping of (name, labels) to [bucket counts, sum, count].
+_histograms = dict()
+# Labels added to all metrics recorded in the current context(thread or task), e.g. model of the webhook.
+_context_labels = ContextVar('dnc_metric_labels', default=())
+
+
+def is_enabled():
+    """
+    Check whether metrics are collected.
+
+    :rtype: bool
+    :returns: Value of `DNC_METRICS_ENABLED` setting.
+    """
+    return getattr(settings, 'DNC_METRICS_ENABLED', True)
+
+
+def make_key(name, labels):
+    """
+    Make storage key of the metric. Context labels are added, explicitly given labels take precedence.
+
+    :type name: str
+    :param name: Name of the metric.
+
+    :type labels: dict
+    :param labels: Labels of the metric.
+
+    :rtype: tuple
+    :returns: (name, ((label, value), ...)) tuple.
+    """
+    context_labels = _context_labels.get()
+    if context_labels:
+        labels = dict(context_labels, **labels)
+    return name, tuple(sorted(labels.items()))
+
+
+def increment(name, amount=1, **labels):
+    """
+    Increment counter.
+
+    :type name: str
+    :param name: Name of the counter.
+
+    :type amount: int|float
+    :param amount: Value added to the counter.
+
+    :param labels: Labels of the counter, e.g. model name.
+
+    :rtype: void
+    :returns: void
+    """
+    if not is_enabled():
+        return
+    key = make_key(name, labels)
+    with _lock:
+        _counters[key] += amount
+
+
+def get_counters():
+    """
+    Get current values of all counters.
+
+    :rtype: dict
+    :returns: Mapping of (name, ((label, value), ...)) to counter value.
+    """
+    with _lock:
+        return dict(_counters)
+
+
+def set_gauge(name, value, **labels):
+    """
+    Set current value of gauge. Gauges are set even if metrics are disabled, as they are set rarely and hold state.
+
+    :type name: str
+    :param name: Name of the gauge.
+
+    :type value: int|float
+    :param value: New value.
+
+    :param labels: Labels of the gauge.
+
+    :rtype: void
+    :returns: void
+    """
+    key = (name, tuple(sorted(labels.items())))
+    with _lock:
+        _gauges[key] = value
+
+
+def get_gauges():
+    """
+    Get current values of all gauges.
+
+    :rtype: dict
+    :returns: Mapping of (name, ((label, value), ...)) to gauge value.
+    """
+    with _lock:
+        return dict(_gauges)
+
+
+def observe(name, value, **labels):
+    """
+    Record value in histogram.
+
+    :type name: str
+    :param name: Name of the histogram.
+
+    :type value: float
+    :param value: Observed value, e.g. duration in seconds.
+
+    :param labels: Labels of the histogram.
+
+    :rtype: void
+    :returns: void
+    """
+    if not is_enabled():
+        return
+    key = make_key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [[0] * len(DEFAULT_BUCKETS), 0.0, 0]
+        for index, bound in enumerate(DEFAULT_BUCKETS):
+            if value <= bound:
+                histogram[0][index] += 1
+                break
+        histogram[1] += value
+        histogram[2] += 1
+
+
+def get_histograms():
+    """
+    Get current state of all histograms.
+
+    :rtype: dict
+    :returns: Mapping of (name, ((label, value), ...)) to (bucket counts, sum, count). Bucket counts aren't cumulative.
+    """
+    with _lock:
+        return {key: (list(counts), total, count) for key, (counts, total, count) in _histograms.items()}
+
+
+class Timer(object):
+    """
+    Context manager recording duration of the block in histogram. `outcome` label is set to `ok` or to `error` if the
+    block raised exception, unless it is given explicitly. Labels can be changed inside the block.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+        self.started_at = None
+
+    def __enter__(self):
+        self.started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.labels.setdefault('outcome', 'ok' if exc_type is None else 'error')
+        observe(self.name, time.perf_counter() - self.started_at, **self.labels)
+        return False
+
+
+class NullTimer(object):
+    """
+    Timer used when metrics are disabled.
+    """
+
+    def __init__(self):
+        self.labels = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.labels.clear()
+        return False
+
+
+_null_timer = NullTimer()
+
+
+def timer(name, **labels):
+    """
+    Make context manager recording duration of the block.
+
+    :type name: str
+    :param name: Name of the histogram.
+
+    :param labels: Labels of the histogram.
+
+    :rtype: Timer|NullTimer
+    :returns: Context manager.
+    """
+    if not is_enabled():
+        return _null_timer
+    return Timer(name, **labels)
+
+
+def timed_view(name):
+    """
+    Decorator of view method recording duration of the request in histogram with `view` and `status` labels.
+
+    :type name: str
+    :param name: Name of the histogram.
+
+    :rtype: function
+    :return: Decorator.
+    """
+    def decorator(method):
+        if asyncio.iscoroutinefunction(method):
+            async def async_wrapper(self, request, *args, **kwargs):
+                with timer(name, view=type(self).__name__) as view_timer:
+                    response = await method(self, request, *args, **kwargs)
+                    view_timer.labels['status'] = response.status_code
+                return response
+
+            return async_wrapper
+
+        def wrapper(self, request, *args, **kwargs):
+            with timer(name, view=type(self).__name__) as view_timer:
+                response = method(self, request, *args, **kwargs)
+                view_timer.labels['status'] = response.status_code
+            return response
+
+        return wrapper
+
+    return decorator
+
+
+@contextmanager
+def labels(**values):
+    """
+    Context manager adding labels to all metrics recorded inside the block in the current thread or task.
+
+    :param values: Labels, e.g. model name.
+    """
+    token = _context_labels.set(tuple(dict(_context_labels.get(), **values).items()))
+    try:
+        yield
+    finally:
+        _context_labels.reset(token)
+
+
+def format_labels(labels, extra=()):
+    """
+    Format labels in Prometheus text format.
+
+    :type labels: tuple
+    :param labels: ((label, value), ...) tuple.
+
+    :type extra: tuple
+    :param extra: Additional labels, e.g. `le` of histogram bucket.
+
+    :rtype: str
+    :returns: `{label="value",...}` or empty string if there are no labels.
+    """
+    pairs = tuple(labels) + tuple(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(label, str(value).replace('\\', r'\\').replace('"', r'\"')
+                                                                  .replace('\n', r'\n'))
+                          for label, value in pairs) + '}'
+
+
+def sort_key(item):
+    """
+    Sort key of (key, value) item of metrics. Keeps all series of the metric together as Prometheus expects.
+    """
+    (name, metric_labels), _ = item
+    return name, str(metric_labels)
+
+
+def render_prometheus():
+    """
+    Render all metrics in Prometheus text exposition format.
+
+    :rtype: str
+    :returns: Metrics text.
+    """
+    lines = list()
+    for metric_type, values in (('counter', get_counters()), ('gauge', get_gauges())):
+        typed = set()
+        for (name, metric_labels), value in sorted(values.items(), key=sort_key):
+            if name not in typed:
+                lines.append('# TYPE {} {}'.format(name, metric_type))
+                typed.add(name)
+            lines.append('{}{} {}'.format(name, format_labels(metric_labels), value))
+
+    typed = set()
+    for (name, metric_labels), (counts, total, count) in sorted(get_histograms().items(), key=sort_key):
+        if name not in typed:
+            lines.append('# TYPE {} histogram'.format(name))
+            typed.add(name)
+        cumulative = 0
+        for bound, bucket_count in zip(DEFAULT_BUCKETS, counts):
+            cumulative += bucket_count
+            lines.append('{}_bucket{} {}'.format(name, format_labels(metric_labels, (('le', bound),)), cumulative))
+        lines.append('{}_bucket{} {}'.format(name, format_labels(metric_labels, (('le', '+Inf'),)), count))
+        lines.append('{}_sum{} {}'.format(name, format_labels(metric_labels), total))
+        lines.append('{}_count{} {}'.format(name, format_labels(metric_labels), count))
+    return '\n'.join(lines) + '\n'
+
+
+def is_authorized(authorization):
+    """
+    Check authorization of the scraper.
+
+    :type authorization: str|None
+    :param authorization: Value of `Authorization` header.
+
+    :rtype: bool
+    :returns: True if `DNC_METRICS_TOKEN` isn't set or the header has it.
+    """
+    token = getattr(settings, 'DNC_METRICS_TOKEN', None)
+    return not token or authorization == "Token {}".format(token)
+
+
+class MetricsRequestHandler(BaseHTTPRequestHandler):
+    """
+    Serves metrics of the process at `/metrics` for processes without web server, e.g. `dnc_worker`.
+    """
+
+    def do_GET(self):
+        if self.path.split('?')[0].rstrip('/') != '/metrics' or not is_enabled():
+            self.send_error(404)
+            return
+        if not is_authorized(self.headers.get('Authorization')):
+            self.send_error(401)
+            return
+        body = render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # Scrapes are not logged.
+        pass
+
+
+class MetricsServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def serve(port, address=''):
+    """
+    Start HTTP server exposing metrics of the process in a background thread.
+
+    :type port: int
+    :param port: Port to listen on.
+
+    :type address: str
+    :param address: Address to listen on. Empty - all interfaces.
+
+    :rtype: MetricsServer
+    :returns: Started server, `shutdown` stops it.
+    """
+    server = MetricsServer((address, port), MetricsRequestHandler)
+    threading.Thread(target=server.serve_forever, name='dnc-metrics', daemon=True).start()
+    return server
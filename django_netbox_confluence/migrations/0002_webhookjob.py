@@ -0,0 +1,32 @@
+# Generated by Django 3.0.3 on 2026-10-17 22:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(help_text='Model Name', max_length=255, verbose_name='Model Name')),
+                ('payload', models.TextField(help_text='Webhook payload as JSON.', verbose_name='Payload')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('done', 'Done'), ('failed', 'Failed')], db_index=True, default='pending', max_length=16, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Attempts')),
+                ('available_at', models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text="The job won't be picked up by workers before this time.", verbose_name='Available At')),
+                ('locked_until', models.DateTimeField(blank=True, help_text='Visibility timeout of the worker which is processing the job.', null=True, verbose_name='Locked Until')),
+                ('last_error', models.TextField(blank=True, default='', verbose_name='Last Error')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
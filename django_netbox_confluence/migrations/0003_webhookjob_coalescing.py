@@ -0,0 +1,23 @@
+# Generated by Django 3.0.3 on 2026-10-17 22:38
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0002_webhookjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookjob',
+            name='lock_token',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Identifies the batch of jobs claimed together by a worker.', max_length=32, verbose_name='Lock Token'),
+        ),
+        migrations.AddField(
+            model_name='webhookjob',
+            name='page_title',
+            field=models.CharField(blank=True, db_index=True, default='', help_text='Wiki page which will be updated. Jobs of the same page are coalesced.', max_length=255, verbose_name='Page Title'),
+        ),
+    ]
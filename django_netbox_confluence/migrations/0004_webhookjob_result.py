@@ -0,0 +1,18 @@
+# Generated by Django 3.0.3 on 2026-10-17 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0003_webhookjob_coalescing'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookjob',
+            name='result',
+            field=models.CharField(blank=True, default='', help_text='`written` if the page was saved, `skipped` if the page had the same values.', max_length=16, verbose_name='Result'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0004_webhookjob_result'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DeadLetter',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(db_index=True, help_text='Model Name', max_length=255, verbose_name='Model Name')),
+                ('page_title', models.CharField(blank=True, db_index=True, default='', help_text='Wiki page which should have been updated.', max_length=255, verbose_name='Page Title')),
+                ('payload', models.TextField(help_text='Webhook payload as JSON.', verbose_name='Payload')),
+                ('source', models.CharField(choices=[('webhook', 'Webhook'), ('batch', 'Batch'), ('queue', 'Queue')], default='webhook', help_text='Where the event has failed.', max_length=16, verbose_name='Source')),
+                ('status', models.CharField(choices=[('dead', 'Dead'), ('replayed', 'Replayed')], db_index=True, default='dead', max_length=16, verbose_name='Status')),
+                ('attempts', models.PositiveIntegerField(default=1, help_text='Failed attempts including the failed replays.', verbose_name='Attempts')),
+                ('error', models.TextField(blank=True, default='', help_text='Error of the last attempt.', verbose_name='Error')),
+                ('replayed_at', models.DateTimeField(blank=True, null=True, verbose_name='Replayed At')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Created At')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Updated At')),
+            ],
+            options={
+                'ordering': ('id',),
+            },
+        ),
+    ]
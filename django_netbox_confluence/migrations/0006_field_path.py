@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:26
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0005_deadletter'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='netboxconfluencefield',
+            name='field_name',
+            field=models.CharField(help_text='Field name or path of the nested value, e.g. `site.region.name`, `tags[0].name`.', max_length=255, verbose_name='Field'),
+        ),
+        migrations.AlterField(
+            model_name='netboxconfluencefield',
+            name='field_type',
+            field=models.CharField(choices=[('TextLinkedField', 'Text Linked Field'), ('StatusLinkedField', 'Drop down field.'), ('RelatedObjectLinkedField', 'Related object field')], help_text='Field Type', max_length=255, verbose_name='Type'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0006_field_path'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='netboxconfluencefield',
+            name='targets',
+            field=models.CharField(blank=True, default='', help_text='Comma separated names of Confluence targets the field is written to. Blank - targets of the model route.', max_length=255, verbose_name='Targets'),
+        ),
+    ]
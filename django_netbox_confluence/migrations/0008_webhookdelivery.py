@@ -0,0 +1,27 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0007_field_targets'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WebhookDelivery',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('model_name', models.CharField(help_text='Model Name', max_length=255, verbose_name='Model Name')),
+                ('object_id', models.CharField(help_text='Id of NetBox object.', max_length=64, verbose_name='Object Id')),
+                ('payload_hash', models.CharField(help_text='SHA-256 of the event type and object data.', max_length=64, verbose_name='Payload Hash')),
+                ('last_updated', models.DateTimeField(blank=True, help_text='`last_updated` of the object in the accepted event.', null=True, verbose_name='Last Updated')),
+                ('seen_at', models.DateTimeField(db_index=True, help_text='When the event was accepted. Older records are forgotten.', verbose_name='Seen At')),
+            ],
+            options={
+                'unique_together': {('model_name', 'object_id')},
+            },
+        ),
+    ]
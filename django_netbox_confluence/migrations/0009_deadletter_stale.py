@@ -0,0 +1,18 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0008_webhookdelivery'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='deadletter',
+            name='status',
+            field=models.CharField(choices=[('dead', 'Dead'), ('replayed', 'Replayed'), ('stale', 'Stale')], db_index=True, default='dead', max_length=16, verbose_name='Status'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.1.14 on 2026-10-17 23:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0009_deadletter_stale'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PageLock',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('page_title', models.CharField(max_length=255, unique=True, verbose_name='Page Title')),
+                ('lock_token', models.CharField(blank=True, default='', help_text='Token of the jobs batch holding the lock.', max_length=32, verbose_name='Lock Token')),
+                ('locked_until', models.DateTimeField(blank=True, help_text="The lock is free after this time even if it wasn't released.", null=True, verbose_name='Locked Until')),
+            ],
+        ),
+    ]
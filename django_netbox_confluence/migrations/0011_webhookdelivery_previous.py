@@ -0,0 +1,23 @@
+# Generated by Django 3.1.14 on 2026-10-18 00:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_netbox_confluence', '0010_pagelock'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='webhookdelivery',
+            name='previous_last_updated',
+            field=models.DateTimeField(blank=True, help_text='`last_updated` of the event accepted before.', null=True, verbose_name='Previous Last Updated'),
+        ),
+        migrations.AddField(
+            model_name='webhookdelivery',
+            name='previous_payload_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the event accepted before, restored when the accepted event fails.', max_length=64, verbose_name='Previous Payload Hash'),
+        ),
+    ]
@@ -1,5 +1,10 @@
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
+from django_netbox_confluence.updater import field_paths
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
 from django_netbox_confluence.updater.linked_fields import ABCLinkedFieldMeta
+from django_netbox_confluence.updater.targets import get_target, parse_names
 
 
 class NetBoxConfluenceField(models.Model):
@@ -12,11 +17,31 @@ class NetBoxConfluenceField(models.Model):
     field_type = models.CharField(max_length=255, verbose_name='Type', choices=TYPE_CHOICES, help_text="Field Type")
     is_custom_field = models.BooleanField(verbose_name='Is Custom Field', help_text="Is the field `custom field`?",
                                           default=False)
-    field_name = models.CharField(max_length=255, verbose_name='Field')
+    field_name = models.CharField(max_length=255, verbose_name='Field',
+                                  help_text="Field name or path of the nested value, e.g. `site.region.name`, "
+                                            "`tags[0].name`.")
+    targets = models.CharField(max_length=255, verbose_name='Targets', blank=True, default='',
+                               help_text="Comma separated names of Confluence targets the field is written to. "
+                                         "Blank - targets of the model route.")
 
     class Meta:
         unique_together = ('model_name', 'field_name', 'is_custom_field')
 
+    def clean(self):
+        try:
+            field_paths.compile_path(self.field_name)
+        except WikiUpdateException as e:
+            raise ValidationError({'field_name': str(e)})
+        if '-' in self.field_name:
+            # Excerpts of `bucket` page sharding are named `<key>-<field>`.
+            raise ValidationError({'field_name': "Field name can't have dashes, they separate object keys from field "
+                                                 "names in excerpt names."})
+        try:
+            for name in parse_names(self.targets):
+                get_target(name)
+        except WikiUpdateException as e:
+            raise ValidationError({'targets': str(e)})
+
     def __str__(self):
         return "{model} > {custom}{field} ({type})".format(model=self.model_name,
                                                            custom=("custom_" if self.is_custom_field else ""),
@@ -26,3 +51,129 @@ class NetBoxConfluenceField(models.Model):
     @property
     def field_type_class(self):
         return ABCLinkedFieldMeta.linked_field_classes[self.field_type]
+
+
+class WebhookJob(models.Model):
+    """
+    Webhook payload queued for processing by `dnc_worker` management command.
+    """
+    STATUS_PENDING = 'pending'
+    STATUS_PROCESSING = 'processing'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = (
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_PROCESSING, 'Processing'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    )
+    RESULT_WRITTEN = 'written'
+    RESULT_SKIPPED = 'skipped'
+    model_name = models.CharField(max_length=255, verbose_name='Model Name', help_text="Model Name")
+    page_title = models.CharField(max_length=255, verbose_name='Page Title', blank=True, default='', db_index=True,
+                                  help_text="Wiki page which will be updated. Jobs of the same page are coalesced.")
+    payload = models.TextField(verbose_name='Payload', help_text="Webhook payload as JSON.")
+    status = models.CharField(max_length=16, verbose_name='Status', choices=STATUS_CHOICES, default=STATUS_PENDING,
+                              db_index=True)
+    attempts = models.PositiveIntegerField(verbose_name='Attempts', default=0)
+    available_at = models.DateTimeField(verbose_name='Available At', default=timezone.now, db_index=True,
+                                        help_text="The job won't be picked up by workers before this time.")
+    locked_until = models.DateTimeField(verbose_name='Locked Until', null=True, blank=True,
+                                        help_text="Visibility timeout of the worker which is processing the job.")
+    lock_token = models.CharField(max_length=32, verbose_name='Lock Token', blank=True, default='', db_index=True,
+                                  help_text="Identifies the batch of jobs claimed together by a worker.")
+    last_error = models.TextField(verbose_name='Last Error', blank=True, default='')
+    result = models.CharField(max_length=16, verbose_name='Result', blank=True, default='',
+                              help_text="`written` if the page was saved, `skipped` if the page had the same values.")
+    created_at = models.DateTimeField(verbose_name='Created At', auto_now_add=True)
+    updated_at = models.DateTimeField(verbose_name='Updated At', auto_now=True)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return "#{id} {model} ({status})".format(id=self.pk, model=self.model_name, status=self.status)
+
+
+class PageLock(models.Model):
+    """
+    Lock of the page whose jobs are being processed by a worker, so jobs of the same page are never written by two
+    workers at the same time.
+    """
+    page_title = models.CharField(max_length=255, verbose_name='Page Title', unique=True)
+    lock_token = models.CharField(max_length=32, verbose_name='Lock Token', blank=True, default='',
+                                  help_text="Token of the jobs batch holding the lock.")
+    locked_until = models.DateTimeField(verbose_name='Locked Until', null=True, blank=True,
+                                        help_text="The lock is free after this time even if it wasn't released.")
+
+    def __str__(self):
+        return self.page_title
+
+
+class DeadLetter(models.Model):
+    """
+    Webhook event which couldn't be written to the Wiki. Kept until it is replayed from Django admin or by `dnc_replay`
+    management command.
+    """
+    SOURCE_WEBHOOK = 'webhook'
+    SOURCE_BATCH = 'batch'
+    SOURCE_QUEUE = 'queue'
+    SOURCE_CHOICES = (
+        (SOURCE_WEBHOOK, 'Webhook'),
+        (SOURCE_BATCH, 'Batch'),
+        (SOURCE_QUEUE, 'Queue'),
+    )
+    STATUS_DEAD = 'dead'
+    STATUS_REPLAYED = 'replayed'
+    STATUS_STALE = 'stale'
+    STATUS_CHOICES = (
+        (STATUS_DEAD, 'Dead'),
+        (STATUS_REPLAYED, 'Replayed'),
+        (STATUS_STALE, 'Stale'),
+    )
+    model_name = models.CharField(max_length=255, verbose_name='Model Name', help_text="Model Name", db_index=True)
+    page_title = models.CharField(max_length=255, verbose_name='Page Title', blank=True, default='', db_index=True,
+                                  help_text="Wiki page which should have been updated.")
+    payload = models.TextField(verbose_name='Payload', help_text="Webhook payload as JSON.")
+    source = models.CharField(max_length=16, verbose_name='Source', choices=SOURCE_CHOICES, default=SOURCE_WEBHOOK,
+                              help_text="Where the event has failed.")
+    status = models.CharField(max_length=16, verbose_name='Status', choices=STATUS_CHOICES, default=STATUS_DEAD,
+                              db_index=True)
+    attempts = models.PositiveIntegerField(verbose_name='Attempts', default=1,
+                                           help_text="Failed attempts including the failed replays.")
+    error = models.TextField(verbose_name='Error', blank=True, default='', help_text="Error of the last attempt.")
+    replayed_at = models.DateTimeField(verbose_name='Replayed At', null=True, blank=True)
+    created_at = models.DateTimeField(verbose_name='Created At', auto_now_add=True, db_index=True)
+    updated_at = models.DateTimeField(verbose_name='Updated At', auto_now=True)
+
+    class Meta:
+        ordering = ('id',)
+
+    def __str__(self):
+        return "#{id} {model} ({status})".format(id=self.pk, model=self.model_name, status=self.status)
+
+
+class WebhookDelivery(models.Model):
+    """
+    The last accepted webhook event of NetBox object. Used to drop repeated deliveries of the same change and events
+    older than the accepted one.
+    """
+    model_name = models.CharField(max_length=255, verbose_name='Model Name', help_text="Model Name")
+    object_id = models.CharField(max_length=64, verbose_name='Object Id', help_text="Id of NetBox object.")
+    payload_hash = models.CharField(max_length=64, verbose_name='Payload Hash',
+                                    help_text="SHA-256 of the event type and object data.")
+    last_updated = models.DateTimeField(verbose_name='Last Updated', null=True, blank=True,
+                                        help_text="`last_updated` of the object in the accepted event.")
+    seen_at = models.DateTimeField(verbose_name='Seen At', db_index=True,
+                                   help_text="When the event was accepted. Older records are forgotten.")
+    previous_payload_hash = models.CharField(max_length=64, verbose_name='Previous Payload Hash', blank=True,
+                                             default='', help_text="Hash of the event accepted before, restored when "
+                                                                   "the accepted event fails.")
+    previous_last_updated = models.DateTimeField(verbose_name='Previous Last Updated', null=True, blank=True,
+                                                 help_text="`last_updated` of the event accepted before.")
+
+    class Meta:
+        unique_together = (('model_name', 'object_id'),)
+
+    def __str__(self):
+        return "{model} #{object_id}".format(model=self.model_name, object_id=self.object_id)
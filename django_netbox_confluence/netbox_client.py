@@ -0,0 +1,119 @@
+import requests
+from django.conf import settings
+
+from django_netbox_confluence.updater.exceptioins import DjangoNetboxConfluenceException
+
+
+class NetBoxClientException(DjangoNetboxConfluenceException):
+    """
+    Exception class for NetBox REST API errors.
+    """
+
+
+class NetBoxClient(object):
+    """
+    Minimal NetBox REST API client. Used to read objects without waiting for webhooks.
+    """
+
+    def __init__(self, url, token, timeout=60):
+        """
+        Init.
+
+        :type url: str
+        :param url: NetBox url, e.g. `http://localhost:8000`.
+
+        :type token: str
+        :param token: NetBox API token.
+
+        :type timeout: int
+        :param timeout: Request timeout in seconds.
+        """
+        self.url = url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': 'Token {}'.format(token),
+            'Accept': 'application/json',
+        })
+
+    @classmethod
+    def from_settings(cls):
+        """
+        Create client configured by `DNC_NETBOX_CREDENTIALS` setting.
+
+        :raises: NetBoxClientException
+
+        :rtype: NetBoxClient
+        :returns: Client object.
+        """
+        try:
+            url = settings.DNC_NETBOX_CREDENTIALS['url']
+            token = settings.DNC_NETBOX_CREDENTIALS['token']
+        except (AttributeError, KeyError) as e:
+            raise NetBoxClientException("{}: Please check configuration in settings file.".format(e))
+        return cls(url, token, timeout=getattr(settings, 'DNC_NETBOX_TIMEOUT', 60))
+
+    @staticmethod
+    def get_endpoint(model_name):
+        """
+        Get API endpoint of the model from `DNC_NETBOX_ENDPOINTS` setting.
+
+        :type model_name: str
+        :param model_name: Model name as it comes in webhook payload, e.g. `device`.
+
+        :raises: NetBoxClientException
+
+        :rtype: str
+        :returns: Endpoint path relative to `/api/`, e.g. `dcim/devices`.
+        """
+        try:
+            return settings.DNC_NETBOX_ENDPOINTS[model_name].strip('/')
+        except (AttributeError, KeyError):
+            raise NetBoxClientException("No API endpoint for `{}` model in `DNC_NETBOX_ENDPOINTS` setting."
+                                        .format(model_name))
+
+    def get(self, url, params=None):
+        """
+        Make GET request.
+
+        :type url: str
+        :param url: Absolute url.
+
+        :type params: dict|None
+        :param params: Query parameters.
+
+        :raises: NetBoxClientException
+
+        :rtype: dict
+        :returns: Response data.
+        """
+        try:
+            response = self.session.get(url, params=params, timeout=self.timeout)
+            response.raise_for_status()
+            return response.json()
+        except (requests.RequestException, ValueError) as e:
+            raise NetBoxClientException("NetBox request `{}` failed: {}".format(url, e))
+
+    def iter_objects(self, model_name, page_size=1000):
+        """
+        Iterate over all objects of the model, following pagination links.
+
+        :type model_name: str
+        :param model_name: Model name as it comes in webhook payload.
+
+        :type page_size: int
+        :param page_size: Number of objects per request.
+
+        :raises: NetBoxClientException
+
+        :rtype: generator
+        :returns: Objects in the same format as `data` of webhook payload.
+        """
+        url = "{}/api/{}/".format(self.url, self.get_endpoint(model_name))
+        params = {'limit': page_size}
+        while url:
+            data = self.get(url, params=params)
+            for obj in data.get('results', []):
+                yield obj
+            # `next` link already contains query parameters.
+            url, params = data.get('next'), None
@@ -0,0 +1,356 @@
+import asyncio
+import cProfile
+import datetime
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import threading
+
+from django.conf import settings
+from django.core.signing import BadSignature, TimestampSigner
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+logger = logging.getLogger(__name__)
+
+# Header asking to profile the request. Value is signed by `make_header_value`.
+HEADER = 'X-DNC-Profile'
+SIGNER_SALT = 'django_netbox_confluence.profiling'
+FILE_SUFFIX = '.prof'
+# Characters allowed in tags of the file name, `-` separates the tags.
+UNSAFE_RE = re.compile(r'[^A-Za-z0-9_.]+')
+
+# Python profiler can profile one call at a time, requests coming meanwhile are not profiled.
+_lock = threading.Lock()
+
+
+def get_directory():
+    """
+    Get directory of the profiles.
+
+    :rtype: str
+    :returns: Value of `DNC_PROFILE_DIR` setting.
+    """
+    return getattr(settings, 'DNC_PROFILE_DIR', None) or os.path.join(tempfile.gettempdir(), 'dnc-profiles')
+
+
+def get_signer():
+    """
+    Get signer of the profiling header.
+
+    :rtype: TimestampSigner|None
+    :returns: Signer or None if `DNC_PROFILE_SECRET` is not set, then the header is ignored.
+    """
+    secret = getattr(settings, 'DNC_PROFILE_SECRET', None)
+    if not secret:
+        return None
+    return TimestampSigner(key=secret, salt=SIGNER_SALT)
+
+
+def make_header_value():
+    """
+    Make value of the profiling header. It expires after `DNC_PROFILE_HEADER_MAX_AGE` seconds.
+
+    :raises: ValueError
+
+    :rtype: str
+    :returns: Signed value.
+    """
+    signer = get_signer()
+    if signer is None:
+        raise ValueError("`DNC_PROFILE_SECRET` is not set.")
+    return signer.sign('profile')
+
+
+def is_requested(request):
+    """
+    Check whether the request has valid profiling header.
+
+    :type request: WSGIRequest|ASGIRequest
+    :param request: Request object.
+
+    :rtype: bool
+    :returns: True if the header is signed by `DNC_PROFILE_SECRET` and isn't expired.
+    """
+    value = request.headers.get(HEADER)
+    signer = get_signer()
+    if not value or signer is None:
+        return False
+    try:
+        signer.unsign(value, max_age=getattr(settings, 'DNC_PROFILE_HEADER_MAX_AGE', 300))
+    except BadSignature:
+        logger.warning("Profiling header with wrong or expired signature is ignored.")
+        return False
+    return True
+
+
+def is_sampled(rate):
+    """
+    Check whether the call is sampled.
+
+    :type rate: float
+    :param rate: Probability of profiling a call, 0 - never, 1 - always.
+
+    :rtype: bool
+    :returns: True with the given probability.
+    """
+    return bool(rate) and random.random() < rate
+
+
+def should_profile(request):
+    """
+    Decide whether the request is profiled: all requests if `DNC_PROFILE_ENABLED`, requests with profiling header or
+    sampled ones with `DNC_PROFILE_SAMPLE_RATE` probability.
+
+    :type request: WSGIRequest|ASGIRequest
+    :param request: Request object.
+
+    :rtype: bool
+    :returns: True if the request should be profiled.
+    """
+    if getattr(settings, 'DNC_PROFILE_ENABLED', False) or is_requested(request):
+        return True
+    return is_sampled(getattr(settings, 'DNC_PROFILE_SAMPLE_RATE', 0))
+
+
+def should_profile_batch():
+    """
+    Decide whether the batch of queued jobs is profiled by the worker: all batches if `DNC_PROFILE_ENABLED`, otherwise
+    sampled ones with `DNC_PROFILE_WORKER_SAMPLE_RATE` probability(defaults to `DNC_PROFILE_SAMPLE_RATE`).
+
+    :rtype: bool
+    :returns: True if the batch should be profiled.
+    """
+    if getattr(settings, 'DNC_PROFILE_ENABLED', False):
+        return True
+    return is_sampled(getattr(settings, 'DNC_PROFILE_WORKER_SAMPLE_RATE',
+                              getattr(settings, 'DNC_PROFILE_SAMPLE_RATE', 0)))
+
+
+def describe_request(request):
+    """
+    Get tags of the profile from the webhook body. Runs only for profiled requests, so the body is decoded again.
+
+    :type request: WSGIRequest|ASGIRequest
+    :param request: Request object.
+
+    :rtype: tuple(str, str, int)
+    :returns: Model name, page title and payload size in bytes. Batches are tagged with `batch` model and number of
+    events instead of the page.
+    """
+    model_name, page_title = 'unknown', 'unknown'
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return model_name, page_title, len(request.body)
+    if type(data) is list:
+        return 'batch', "{}-events".format(len(data)), len(request.body)
+    if type(data) is dict and type(data.get('model')) is str:
+        model_name = data['model']
+        try:
+            page_title = WikiPageUpdater.generate_page_name(model_name, data)
+        except Exception:
+            pass
+    return model_name, page_title, len(request.body)
+
+
+def describe_batch(jobs):
+    """
+    Get tags of the profile from the batch of queued jobs.
+
+    :type jobs: list
+    :param jobs: Claimed jobs of the same page.
+
+    :rtype: tuple(str, str, int)
+    :returns: Model name, page title and total payload size in bytes.
+    """
+    return jobs[0].model_name, jobs[0].page_title, sum(len(job.payload.encode('utf-8')) for job in jobs)
+
+
+def make_file_name(model_name, page_title, size):
+    """
+    Make file name of the profile tagged with the time, model, page and payload size.
+
+    :type model_name: str
+    :param model_name: Model name.
+
+    :type page_title: str
+    :param page_title: Page title.
+
+    :type size: int
+    :param size: Payload size in bytes.
+
+    :rtype: str
+    :returns: File name, e.g. `20200401100000123456-device-partials_device-1532b-42.prof`.
+    """
+    return "{}-{}-{}-{}b-{}{}".format(datetime.datetime.now().strftime('%Y%m%d%H%M%S%f'),
+                                      UNSAFE_RE.sub('_', model_name)[:64], UNSAFE_RE.sub('_', page_title)[:100],
+                                      size, os.getpid(), FILE_SUFFIX)
+
+
+def parse_file_name(file_name):
+    """
+    Get tags of the profile from its file name.
+
+    :type file_name: str
+    :param file_name: File name made by `make_file_name`.
+
+    :rtype: dict|None
+    :returns: `time`, `model`, `page` and `size` tags. None if it isn't a profile.
+    """
+    if not file_name.endswith(FILE_SUFFIX):
+        return None
+    parts = file_name[:-len(FILE_SUFFIX)].split('-')
+    if len(parts) != 5 or not parts[3].endswith('b'):
+        return None
+    try:
+        return {
+            'time': datetime.datetime.strptime(parts[0], '%Y%m%d%H%M%S%f'),
+            'model': parts[1],
+            'page': parts[2],
+            'size': int(parts[3][:-1]),
+        }
+    except ValueError:
+        return None
+
+
+def list_profiles(directory):
+    """
+    List profiles of the directory from the oldest to the newest.
+
+    :type directory: str
+    :param directory: Directory of the profiles.
+
+    :rtype: list
+    :returns: List of (path, tags) tuples.
+    """
+    try:
+        file_names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    profiles = list()
+    for file_name in file_names:
+        tags = parse_file_name(file_name)
+        if tags is not None:
+            profiles.append((os.path.join(directory, file_name), tags))
+    return sorted(profiles, key=lambda profile: profile[1]['time'])
+
+
+def rotate(directory, max_files):
+    """
+    Delete the oldest profiles so at most `max_files` are kept.
+
+    :type directory: str
+    :param directory: Directory of the profiles.
+
+    :type max_files: int
+    :param max_files: Number of profiles to keep.
+
+    :rtype: void
+    :returns: void
+    """
+    profiles = list_profiles(directory)
+    for path, _ in profiles[:max(0, len(profiles) - max_files)]:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            # Removed by another process.
+            pass
+
+
+def save(profile, describe, *args):
+    """
+    Write the profile to `DNC_PROFILE_DIR` and rotate old profiles. Errors are logged, they never fail the profiled
+    call.
+
+    :type profile: cProfile.Profile
+    :param profile: Stopped profiler.
+
+    :type describe: function
+    :param describe: Function getting model name, page title and payload size of the profiled call from the args, e.g.
+    `describe_request`.
+
+    :rtype: str|None
+    :returns: Path of the profile or None if it couldn't be written.
+    """
+    try:
+        model_name, page_title, size = describe(*args)
+        directory = get_directory()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, make_file_name(model_name, page_title, size))
+        profile.dump_stats(path)
+        rotate(directory, getattr(settings, 'DNC_PROFILE_MAX_FILES', 100))
+    except Exception:
+        logger.exception("Profile couldn't be written.")
+        return None
+    metrics.increment('dnc_profiles_total', model=model_name)
+    return path
+
+
+def profiled_view(method):
+    """
+    Decorator of view method running it under Python profiler when the request should be profiled. Only one request
+    of the process is profiled at a time. Async views are profiled with everything else the event loop runs meanwhile.
+
+    :rtype: function
+    :return: Wrapped function.
+    """
+    if asyncio.iscoroutinefunction(method):
+        async def async_wrapper(self, request, *args, **kwargs):
+            if not should_profile(request) or not _lock.acquire(blocking=False):
+                return await method(self, request, *args, **kwargs)
+            try:
+                profile = cProfile.Profile()
+                profile.enable()
+                try:
+                    response = await method(self, request, *args, **kwargs)
+                finally:
+                    profile.disable()
+                save(profile, describe_request, request)
+            finally:
+                _lock.release()
+            return response
+
+        return async_wrapper
+
+    def wrapper(self, request, *args, **kwargs):
+        if not should_profile(request) or not _lock.acquire(blocking=False):
+            return method(self, request, *args, **kwargs)
+        try:
+            profile = cProfile.Profile()
+            response = profile.runcall(method, self, request, *args, **kwargs)
+            save(profile, describe_request, request)
+        finally:
+            _lock.release()
+        return response
+
+    return wrapper
+
+
+def run_batch(function, jobs, *args, **kwargs):
+    """
+    Run the function processing the batch of queued jobs under Python profiler when the batch should be profiled.
+    Only one batch of the process is profiled at a time. Targets written by the fan-out threads aren't profiled.
+
+    :type function: function
+    :param function: Function taking the batch as the first argument, e.g. `jobs.process`.
+
+    :type jobs: list
+    :param jobs: Claimed jobs of the same page.
+
+    :returns: Result of the function.
+    """
+    if not should_profile_batch() or not _lock.acquire(blocking=False):
+        return function(jobs, *args, **kwargs)
+    try:
+        profile = cProfile.Profile()
+        result = profile.runcall(function, jobs, *args, **kwargs)
+        save(profile, describe_batch, jobs)
+    finally:
+        _lock.release()
+    return result
@@ -0,0 +1,192 @@
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.netbox_client import NetBoxClient, NetBoxClientException
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+
+
+class RelatedObjectResolver(object):
+    """
+    Loads full NetBox objects referenced by brief objects of webhook payload(e.g. `site` of the device has only id,
+    url, name and slug). Objects are kept in LRU cache with time to live, missing objects of the same endpoint are
+    loaded by one request.
+    """
+    # Cached value of the object which is not in the cache.
+    MISSING = object()
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    def __init__(self, client, max_size=10000, ttl=300, batch_size=100):
+        """
+        Init.
+
+        :type client: NetBoxClient
+        :param client: NetBox client.
+
+        :type max_size: int
+        :param max_size: Maximum number of cached objects.
+
+        :type ttl: float
+        :param ttl: Seconds to keep the object.
+
+        :type batch_size: int
+        :param batch_size: Maximum number of objects loaded by one request.
+        """
+        self.client = client
+        self.max_size = max_size
+        self.ttl = ttl
+        self.batch_size = batch_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get_shared(cls):
+        """
+        Get resolver of the process configured by `DNC_NETBOX_CREDENTIALS` and `DNC_RELATED_*` settings.
+
+        :raises: WikiUpdateException
+
+        :rtype: RelatedObjectResolver
+        :returns: Resolver object.
+        """
+        with cls._shared_lock:
+            if cls._shared is None:
+                try:
+                    client = NetBoxClient.from_settings()
+                except NetBoxClientException as e:
+                    raise WikiUpdateException(str(e))
+                cls._shared = cls(client,
+                                  max_size=getattr(settings, 'DNC_RELATED_CACHE_SIZE', 10000),
+                                  ttl=getattr(settings, 'DNC_RELATED_CACHE_TTL', 300),
+                                  batch_size=getattr(settings, 'DNC_RELATED_BATCH_SIZE', 100))
+            return cls._shared
+
+    @staticmethod
+    def make_key(reference):
+        """
+        Make cache key of the referenced object.
+
+        :type reference: dict
+        :param reference: Brief object with `id` and `url`.
+
+        :rtype: tuple(str, str)|None
+        :returns: API endpoint relative to `/api/`(e.g. `dcim/sites`) and id. None if it is not a reference.
+        """
+        if type(reference) is not dict or not reference.get('id') or type(reference.get('url')) is not str:
+            return None
+        _, separator, path = reference['url'].partition('/api/')
+        endpoint = path.strip('/').rpartition('/')[0]
+        if not separator or not endpoint:
+            return None
+        return endpoint, str(reference['id'])
+
+    def get_cached(self, key):
+        """
+        Get object from the cache.
+
+        :type key: tuple
+        :param key: Cache key.
+
+        :rtype: dict|None|object
+        :returns: Object, None if it isn't found in NetBox or `MISSING` if it isn't cached or expired.
+        """
+        with self._lock:
+            entry = self._cache.get(key)
+            if entry is None:
+                return self.MISSING
+            expires, obj = entry
+            if expires < time.monotonic():
+                del self._cache[key]
+                return self.MISSING
+            self._cache.move_to_end(key)
+            return obj
+
+    def store(self, key, obj):
+        """
+        Put object to the cache, the least recently used objects are dropped when the cache is full.
+
+        :type key: tuple
+        :param key: Cache key.
+
+        :type obj: dict|None
+        :param obj: Object. None if it isn't found in NetBox, so it isn't requested again until expired.
+
+        :rtype: void
+        :returns: void
+        """
+        with self._lock:
+            self._cache[key] = (time.monotonic() + self.ttl, obj)
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.max_size:
+                self._cache.popitem(last=False)
+
+    def resolve(self, references):
+        """
+        Get full objects of the references. Missing objects are loaded by endpoint, in batches.
+
+        :type references: iterable
+        :param references: Brief objects.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :returns: Mapping of cache key to object. Objects not found in NetBox are not in it.
+        """
+        found = dict()
+        missing = OrderedDict()
+        for reference in references:
+            key = self.make_key(reference)
+            if key is None or key in found:
+                continue
+            obj = self.get_cached(key)
+            if obj is not self.MISSING:
+                if obj is not None:
+                    found[key] = obj
+                continue
+            missing.setdefault(key[0], set()).add(key[1])
+
+        for endpoint, ids in missing.items():
+            ids = sorted(ids)
+            for start in range(0, len(ids), self.batch_size):
+                batch = ids[start:start + self.batch_size]
+                try:
+                    with metrics.timer('dnc_stage_duration_seconds', stage='related'):
+                        data = self.client.get("{}/api/{}/".format(self.client.url, endpoint),
+                                               params={'id': batch, 'limit': len(batch)})
+                except NetBoxClientException as e:
+                    raise WikiUpdateException(str(e))
+                results = data.get('results', [])
+                metrics.increment('dnc_related_objects_loaded_total', len(results), endpoint=endpoint)
+                for obj in results:
+                    key = (endpoint, str(obj.get('id')))
+                    self.store(key, obj)
+                    found[key] = obj
+                for object_id in batch:
+                    if (endpoint, object_id) not in found:
+                        self.store((endpoint, object_id), None)
+        return found
+
+    def get(self, reference):
+        """
+        Get full object of the reference.
+
+        :type reference: dict
+        :param reference: Brief object.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict|None
+        :returns: Object. None if it is not a reference.
+        """
+        key = self.make_key(reference)
+        if key is None:
+            return None
+        obj = self.resolve([reference]).get(key)
+        if obj is None:
+            raise WikiUpdateException("Related object `{}` is not found in NetBox.".format(reference['url']))
+        return obj
@@ -0,0 +1,14 @@
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence.updater import field_plans
+
+
+@receiver(post_save, sender=NetBoxConfluenceField)
+@receiver(post_delete, sender=NetBoxConfluenceField)
+def invalidate_field_plans(sender, **kwargs):
+    """
+    Drop cached field plans when fields configuration is changed.
+    """
+    field_plans.invalidate()
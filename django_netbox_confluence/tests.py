@@ -1,3 +1,1573 @@
-from django.test import TestCase
+import asyncio
+import copy
+import cProfile
+import json
+import os
+import pstats
+import tempfile
+import threading
+import uuid
+import zlib
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from io import StringIO
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
 
-# Create your tests here.
+import httpx
+from asgiref.sync import async_to_sync
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.template.loader import render_to_string
+from django.test import (AsyncClient, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase,
+                         override_settings)
+from django.utils import timezone
+from lxml import etree
+
+from django_netbox_confluence import dead_letters, deliveries, jobs, metrics, profiling
+from django_netbox_confluence.admission import AdmissionController
+from django_netbox_confluence.models import (DeadLetter, NetBoxConfluenceField, PageLock, WebhookDelivery,
+                                             WebhookJob)
+from django_netbox_confluence.netbox_client import NetBoxClient, NetBoxClientException
+from django_netbox_confluence.throttling import AdaptiveTokenBucket
+from django_netbox_confluence.updater import field_paths, field_plans, sharding, targets
+from django_netbox_confluence.updater.async_confluence_adapter import AsyncConfluenceAdapter
+from django_netbox_confluence.updater.confluence_adapter import ConfluenceAdapter
+from django_netbox_confluence.updater.exceptioins import (AdmissionRejectedException, ConfluenceUnavailableException,
+                                                           PageConflictException, WikiUpdateException)
+from django_netbox_confluence.updater.linked_fields import ABCLinkedFieldMeta, TextLinkedField
+from django_netbox_confluence.updater.page_document import PageDocument
+from django_netbox_confluence.updater.resilience import CircuitBreaker, ConfluenceGuard, RetryPolicy
+from django_netbox_confluence.updater.storage_codec import StorageCodec
+from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater
+
+
+def make_event(object_id=1, name='router', status='active', model='device', **extra):
+    """
+    Make webhook body of the changed object.
+    """
+    data = {'id': object_id, 'name': name, 'status': {'value': status, 'label': status.title()}, 'custom_fields': {}}
+    data.update(extra)
+    return {'event': 'updated', 'model': model, 'data': data}
+
+
+class ConfluenceStandIn(object):
+    """
+    In-memory Confluence space with the adapter methods used by the updater and the management commands.
+    """
+
+    def __init__(self):
+        self.pages = OrderedDict()
+        self.saves = list()
+        # Raised by the next page fetch when set.
+        self.error = None
+
+    def get_page_or_create(self, page_title):
+        if self.error is not None:
+            raise self.error
+        self.pages.setdefault(page_title, '')
+        return page_title, ConfluenceAdapter.parse_storage(self.pages[page_title])
+
+    def update_page_content(self, page_id, page_title, body):
+        self.pages[page_title] = ConfluenceAdapter.serialize_page(body)
+        self.saves.append(page_title)
+
+    def iter_pages(self):
+        return [{'id': title, 'title': title} for title in list(self.pages)]
+
+    def delete_page(self, page_id, page_title):
+        del self.pages[page_title]
+
+    def get_values(self, page_title):
+        document = ConfluenceAdapter.parse_storage(self.pages[page_title])
+        return {name: paragraphs[0].text for name, paragraphs in document.excerpts.items()}
+
+
+class ConfluenceClientStandIn(object):
+    """
+    In-memory Confluence REST client used in place of `atlassian.Confluence`, so the adapter itself is tested.
+    Saves of outdated versions are rejected like by Confluence: the response doesn't have page id.
+    """
+
+    def __init__(self):
+        self.pages = OrderedDict()
+        self.calls = list()
+
+    def get_space(self, space_key):
+        self.calls.append(('get_space', space_key))
+        return {'key': space_key}
+
+    def find(self, title):
+        return next((page for page in self.pages.values() if page['title'] == title), None)
+
+    def get_page_by_title(self, title, space, expand=None):
+        self.calls.append(('get_page_by_title', title))
+        page = self.find(title)
+        return copy.deepcopy(page) if page is not None else None
+
+    def get_page_by_id(self, page_id, expand=None):
+        self.calls.append(('get_page_by_id', page_id))
+        if page_id not in self.pages:
+            return {'statusCode': 404, 'message': 'No content found with id: {}'.format(page_id)}
+        return copy.deepcopy(self.pages[page_id])
+
+    def create_page(self, space, title, body):
+        self.calls.append(('create_page', title))
+        page_id = str(len(self.pages) + 1)
+        self.pages[page_id] = {'id': page_id, 'title': title, 'version': {'number': 1},
+                               'body': {'storage': {'value': body}}}
+        return copy.deepcopy(self.pages[page_id])
+
+    def put(self, path, data):
+        self.calls.append(('put', data['version']['number']))
+        page = self.pages[path.rpartition('/')[2]]
+        if data['version']['number'] != page['version']['number'] + 1:
+            return {'statusCode': 409, 'message': 'Version must be incremented on update. Current version is: {}'
+                    .format(page['version']['number'])}
+        return self.save(page['id'], data['body']['storage']['value'])
+
+    def update_existing_page(self, page_id, title, body):
+        self.calls.append(('update_existing_page', page_id))
+        return self.save(page_id, body)
+
+    def save(self, page_id, body):
+        page = self.pages[page_id]
+        page['version']['number'] += 1
+        page['body']['storage']['value'] = body
+        return copy.deepcopy(page)
+
+    async def handle_request(self, request):
+        """
+        Answer REST API request of the async adapter, used as `httpx.MockTransport` handler.
+        """
+        # Let other tasks run like during network call.
+        await asyncio.sleep(0)
+        method, path = request.method, request.url.path.strip('/').split('/')[2:]
+        if path[0] == 'space':
+            return httpx.Response(200, json=self.get_space(path[1]))
+        if path == ['content'] and method == 'GET':
+            page = self.get_page_by_title(request.url.params['title'], request.url.params['spaceKey'])
+            return httpx.Response(200, json={'results': [page] if page is not None else []})
+        if path == ['content'] and method == 'POST':
+            return httpx.Response(200, json=self.create_page(None, json.loads(request.content)['title'], ''))
+        if path[2:] == ['history']:
+            return httpx.Response(200, json={'lastUpdated': self.pages[path[1]]['version']})
+        if method == 'PUT':
+            data = self.put(request.url.path, json.loads(request.content))
+            return httpx.Response(409 if 'statusCode' in data else 200, json=data)
+        data = self.get_page_by_id(path[1])
+        return httpx.Response(data.get('statusCode', 200), json=data)
+
+    def edit(self, title, text):
+        """
+        Change the page like a Confluence user does.
+        """
+        page = self.find(title)
+        self.save(page['id'], page['body']['storage']['value'] + '<p>{}</p>'.format(text))
+
+    def get_values(self, title):
+        document = ConfluenceAdapter.parse_storage(self.find(title)['body']['storage']['value'])
+        return {name: paragraphs[0].text for name, paragraphs in document.excerpts.items()}
+
+
+class ConfluenceStandInMixin(object):
+    """
+    Configures device fields and writes them to the Confluence stand-in.
+    """
+    FIELDS = (
+        ('name', 'TextLinkedField'),
+        ('status', 'StatusLinkedField'),
+    )
+
+    def setUp(self):
+        for field_name, field_type in self.FIELDS:
+            NetBoxConfluenceField.objects.create(model_name='device', field_name=field_name, field_type=field_type)
+        # Plans are cached by the process, rolled back fields shouldn't leak into other tests.
+        self.addCleanup(field_plans.invalidate)
+        self.confluence = ConfluenceStandIn()
+        patcher = mock.patch.object(ConfluenceAdapter, 'get_shared', return_value=self.confluence)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class ConfluenceTestCase(ConfluenceStandInMixin, TestCase):
+    """
+    Base of the tests writing configured device fields to the Confluence stand-in.
+    """
+
+
+class StorageCodecTestCase(SimpleTestCase):
+    """
+    Codec output should be byte for byte the same as of the template based parsing and serialization.
+    """
+    PAGES = [
+        '',
+        '<p>Plain text</p>',
+        '<p>a&amp;b &lt;x&gt; &#160; é中\U0001f600</p>',
+        '<p>x</p><!-- comment --><?pi data?><![CDATA[<raw>]]>',
+        '<ac:structured-macro ac:name="multiexcerpt" ac:schema-version="1" ac:macro-id="1">'
+        '<ac:parameter ac:name="MultiExcerptName">name</ac:parameter>'
+        '<ac:rich-text-body><p>value</p></ac:rich-text-body></ac:structured-macro>'
+        '<ri:page ri:content-title="Other"/><at:var at:name="x"/><table><tbody><tr><td>1</td></tr></tbody></table>',
+        '  \n<p>leading and trailing whitespaces</p>\n  ',
+    ]
+
+    @staticmethod
+    def template_parse(content_xml):
+        return etree.fromstring(render_to_string('wrapper.xml', {'content': content_xml}))
+
+    @staticmethod
+    def template_serialize(root):
+        body_xml = etree.tostring(root).decode('utf-8')
+        return body_xml[body_xml.find('>') + 1:body_xml.rfind('<')]
+
+    @staticmethod
+    def template_macro(macro_id, name, value):
+        return etree.fromstring(render_to_string('multiexcerpt.xml', {
+            "macro_id": macro_id,
+            "field_name": name,
+            "field_value": value,
+        }))
+
+    def test_parse(self):
+        for content_xml in self.PAGES:
+            with self.subTest(content_xml=content_xml):
+                self.assertEqual(etree.tostring(StorageCodec.parse(content_xml)),
+                                 etree.tostring(self.template_parse(content_xml)))
+
+    def test_serialize(self):
+        for content_xml in self.PAGES:
+            with self.subTest(content_xml=content_xml):
+                root = self.template_parse(content_xml)
+                self.assertEqual(StorageCodec.serialize(root), self.template_serialize(root))
+
+    def test_limits(self):
+        deep_xml = '<p>{}x{}</p>'.format('<span>' * 300, '</span>' * 300)
+        with self.assertRaises(etree.XMLSyntaxError):
+            StorageCodec.parse(deep_xml)
+        with override_settings(DNC_STORAGE_HUGE_TREE=True):
+            self.assertEqual(len(list(StorageCodec.parse(deep_xml).iter('{*}span'))), 300)
+        # Parser is usable after the failure.
+        self.assertEqual(StorageCodec.parse('<p>x</p>')[0].text, 'x')
+
+    def test_make_excerpt_macro(self):
+        macro_id = uuid.UUID(int=1)
+        for value in ('value', '', 'Active', 42):
+            with self.subTest(value=value):
+                self.assertEqual(etree.tostring(StorageCodec.make_excerpt_macro(macro_id, 'field', value)),
+                                 etree.tostring(self.template_macro(macro_id, 'field', value)))
+
+    def test_page_with_new_macro(self):
+        macro_id = uuid.UUID(int=2)
+        for content_xml in self.PAGES:
+            with self.subTest(content_xml=content_xml):
+                expected = PageDocument(self.template_parse(content_xml))
+                expected.add_macro(self.template_macro(macro_id, 'new', 'value'))
+                page = PageDocument(StorageCodec.parse(content_xml))
+                page.add_macro(StorageCodec.make_excerpt_macro(macro_id, 'new', 'value'))
+
+                self.assertEqual(StorageCodec.serialize(page.root), self.template_serialize(expected.root))
+                self.assertEqual([paragraph.text for paragraph in page.get_paragraphs('new')], ['value'])
+
+    def test_round_trip(self):
+        for content_xml in self.PAGES:
+            with self.subTest(content_xml=content_xml):
+                self.assertEqual(StorageCodec.serialize(StorageCodec.parse(content_xml)),
+                                 self.template_serialize(self.template_parse(content_xml)))
+
+    def test_parser_is_reusable_after_error(self):
+        with self.assertRaises(etree.XMLSyntaxError):
+            StorageCodec.parse('<p>not closed')
+        with self.assertRaises(etree.XMLSyntaxError):
+            StorageCodec.parse('<p>a&nbsp;b</p>')
+        self.assertEqual(StorageCodec.serialize(StorageCodec.parse('<p>ok</p>')), '\n        <p>ok</p>\n    ')
+
+
+class JobQueueTestCase(ConfluenceTestCase):
+    """
+    Jobs of the same page are claimed together by one worker and written with one page save.
+    """
+
+    def enqueue(self, *events):
+        return [jobs.enqueue(event) for event in events]
+
+    def test_claim_coalesces_jobs_of_page(self):
+        queued = self.enqueue(make_event(1, name='a'), make_event(2, name='b'), make_event(3, name='c'))
+        batch = jobs.claim_batch(60)
+        self.assertEqual([job.pk for job in batch], [job.pk for job in queued])
+        self.assertEqual({job.status for job in batch}, {WebhookJob.STATUS_PROCESSING})
+        self.assertEqual(len({job.lock_token for job in batch}), 1)
+        self.assertEqual(jobs.claim_batch(60), [])
+
+    def test_claimed_page_is_not_claimed_again(self):
+        self.enqueue(make_event(1))
+        batch = jobs.claim_batch(60)
+        late = self.enqueue(make_event(2))
+        self.assertEqual(jobs.claim_batch(60), [])
+
+        jobs.process(batch, max_attempts=3, retry_delay=1)
+        jobs.release(batch)
+        self.assertEqual([job.pk for job in jobs.claim_batch(60)], [job.pk for job in late])
+
+    def test_page_lock_is_exclusive(self):
+        now = timezone.now()
+        self.assertTrue(jobs.lock_page('page', 'first', now, 60))
+        self.assertFalse(jobs.lock_page('page', 'second', now, 60))
+        # Lock of the dead worker expires with the visibility timeout.
+        self.assertTrue(jobs.lock_page('page', 'second', now + timedelta(seconds=61), 60))
+        # Released lock is held by another batch now, so it isn't released.
+        jobs.unlock_page('page', 'first')
+        self.assertEqual(PageLock.objects.get(page_title='page').lock_token, 'second')
+        jobs.unlock_page('page', 'second')
+        self.assertTrue(jobs.lock_page('page', 'third', now, 60))
+
+    def test_expired_jobs_are_claimed_again(self):
+        self.enqueue(make_event(1))
+        batch = jobs.claim_batch(60)
+        WebhookJob.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        PageLock.objects.update(locked_until=timezone.now() - timedelta(seconds=1))
+        claimed = jobs.claim_batch(60)
+        self.assertEqual([job.pk for job in claimed], [job.pk for job in batch])
+        self.assertEqual(claimed[0].attempts, 2)
+
+    def test_coalesce_window(self):
+        self.enqueue(make_event(1))
+        self.assertEqual(jobs.claim_batch(60, coalesce_window=60, coalesce_max_wait=60), [])
+        # Page which waits longer than the max wait is taken even if new jobs keep coming.
+        self.assertEqual(len(jobs.claim_batch(60, coalesce_window=60, coalesce_max_wait=0)), 1)
+
+    def test_process_writes_page_once(self):
+        self.enqueue(make_event(1, name='old'), make_event(1, name='new', status='offline'))
+        succeeded, failed = jobs.process(jobs.claim_batch(60), max_attempts=3, retry_delay=1)
+        self.assertEqual((len(succeeded), failed), (2, []))
+        self.assertEqual(self.confluence.saves, ['partials-device'])
+        self.assertEqual(self.confluence.get_values('partials-device'), {'name': 'new', 'status': 'Offline'})
+        self.assertEqual(set(WebhookJob.objects.values_list('status', 'result')),
+                         {(WebhookJob.STATUS_DONE, WebhookJob.RESULT_WRITTEN)})
+
+    def test_broken_job_fails_alone(self):
+        broken = make_event(2)
+        del broken['data']['name']
+        self.enqueue(make_event(1), broken)
+        with self.assertLogs('django_netbox_confluence.jobs', 'ERROR'):
+            succeeded, failed = jobs.process(jobs.claim_batch(60), max_attempts=3, retry_delay=1)
+        self.assertEqual((len(succeeded), len(failed)), (1, 1))
+        self.assertEqual(WebhookJob.objects.get(pk=failed[0].pk).status, WebhookJob.STATUS_PENDING)
+        self.assertEqual(self.confluence.get_values('partials-device')['name'], 'router')
+
+
+class NetBoxStandIn(object):
+    """
+    NetBox REST API client returning the given objects.
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.requested = list()
+
+    def iter_objects(self, model_name, page_size=1000):
+        self.requested.append(model_name)
+        return iter(self.objects.get(model_name, []))
+
+
+class ResyncCommandTestCase(ConfluenceTestCase):
+    """
+    `dnc_resync` writes fields of all NetBox objects and resumes from the checkpoint.
+    """
+
+    def resync(self, objects, *args):
+        netbox = NetBoxStandIn(objects)
+        stdout, stderr = StringIO(), StringIO()
+        with mock.patch.object(NetBoxClient, 'from_settings', return_value=netbox):
+            call_command('dnc_resync', '--rate', '0', *args, stdout=stdout, stderr=stderr)
+        return netbox, stdout.getvalue(), stderr.getvalue()
+
+    def test_resync(self):
+        objects = {'device': [make_event(1, name='a')['data'], make_event(2, name='b', status='planned')['data']]}
+        netbox, stdout, _ = self.resync(objects)
+        self.assertEqual(netbox.requested, ['device'])
+        # Single page of the model keeps values of the last object, the page is saved once.
+        self.assertEqual(self.confluence.saves, ['partials-device'])
+        self.assertEqual(self.confluence.get_values('partials-device'), {'name': 'b', 'status': 'Planned'})
+        self.assertIn("device: 2 object(s) read.", stdout)
+
+    def test_invalid_object_is_skipped(self):
+        broken = make_event(2)['data']
+        del broken['name']
+        _, _, stderr = self.resync({'device': [make_event(1)['data'], broken]})
+        self.assertIn("device #2: skipped", stderr)
+        self.assertEqual(self.confluence.get_values('partials-device')['name'], 'router')
+
+    def test_checkpoint(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        checkpoint = os.path.join(directory.name, 'resync.json')
+        objects = {'device': [make_event(1)['data']]}
+        self.resync(objects, '--checkpoint', checkpoint)
+        with open(checkpoint) as checkpoint_file:
+            self.assertEqual(json.load(checkpoint_file), ['partials-device'])
+
+        _, stdout, _ = self.resync(objects, '--checkpoint', checkpoint)
+        self.assertIn("0 page(s) to write, 1 already done.", stdout)
+        self.assertEqual(self.confluence.saves, ['partials-device'])
+
+    def test_failed_page(self):
+        self.confluence.error = WikiUpdateException("Confluence is down.")
+        with self.assertRaises(CommandError):
+            self.resync({'device': [make_event(1)['data']]})
+
+    def test_netbox_error(self):
+        with mock.patch.object(NetBoxClient, 'from_settings', side_effect=NetBoxClientException("No credentials.")):
+            with self.assertRaisesMessage(CommandError, "No credentials."):
+                call_command('dnc_resync', stdout=StringIO())
+
+
+# Response of the Confluence call made through the guard.
+Response = namedtuple('Response', ['status_code', 'headers'])
+
+
+class ResilienceTestCase(SimpleTestCase):
+    """
+    Failed Confluence calls are retried only when it is safe, and a failing Confluence isn't called at all for a while.
+    """
+
+    @staticmethod
+    def make_guard(failure_threshold=5, reset_timeout=30, max_retries=2):
+        return ConfluenceGuard('test', AdaptiveTokenBucket(0),
+                               CircuitBreaker('test', failure_threshold=failure_threshold, reset_timeout=reset_timeout),
+                               RetryPolicy(max_retries=max_retries, backoff_base=0))
+
+    def test_is_retryable(self):
+        policy = RetryPolicy()
+        self.assertTrue(policy.is_retryable('GET', 502))
+        self.assertTrue(policy.is_retryable('PUT', None))
+        self.assertTrue(policy.is_retryable('POST', 503))
+        # POST may have been processed, so it is repeated only when surely rejected.
+        self.assertFalse(policy.is_retryable('POST', 502))
+        self.assertFalse(policy.is_retryable('POST', None))
+        self.assertFalse(policy.is_retryable('GET', 404))
+
+    def test_get_delay(self):
+        policy = RetryPolicy(backoff_base=1, backoff_max=10)
+        self.assertEqual(policy.get_delay(0, retry_after=5), 5)
+        self.assertIsNone(policy.get_delay(0, retry_after=11))
+        for attempt in range(10):
+            self.assertTrue(0 <= policy.get_delay(attempt) <= min(10, 2 ** attempt))
+
+    def test_parse_retry_after(self):
+        self.assertEqual(RetryPolicy.parse_retry_after('7'), 7.0)
+        self.assertEqual(RetryPolicy.parse_retry_after('-1'), 0.0)
+        self.assertEqual(RetryPolicy.parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT'), 0.0)
+        self.assertIsNone(RetryPolicy.parse_retry_after('soon'))
+        self.assertIsNone(RetryPolicy.parse_retry_after(None))
+
+    def test_retry_until_success(self):
+        send = mock.Mock(side_effect=[Response(503, {}), Response(502, {}), Response(200, {})])
+        response = self.make_guard().call(send, 'GET', (ConnectionError,))
+        self.assertEqual((response.status_code, send.call_count), (200, 3))
+
+    def test_retry_transport_error(self):
+        send = mock.Mock(side_effect=[ConnectionError("reset"), Response(200, {})])
+        self.assertEqual(self.make_guard().call(send, 'GET', (ConnectionError,)).status_code, 200)
+
+    def test_post_is_not_retried(self):
+        send = mock.Mock(side_effect=[Response(502, {})])
+        self.assertEqual(self.make_guard().call(send, 'POST', (ConnectionError,)).status_code, 502)
+        self.assertEqual(send.call_count, 1)
+
+    def test_retries_run_out(self):
+        send = mock.Mock(return_value=Response(503, {}))
+        with self.assertRaises(ConfluenceUnavailableException):
+            self.make_guard(max_retries=2).call(send, 'GET', (ConnectionError,))
+        self.assertEqual(send.call_count, 3)
+
+    def test_long_retry_after_is_not_waited(self):
+        send = mock.Mock(return_value=Response(429, {'Retry-After': '120'}))
+        with self.assertRaises(ConfluenceUnavailableException) as raised:
+            self.make_guard().call(send, 'GET', (ConnectionError,))
+        self.assertEqual((raised.exception.retry_after, send.call_count), (120, 1))
+
+    def test_circuit_opens(self):
+        with self.assertLogs('django_netbox_confluence.updater.resilience', 'WARNING'):
+            guard = self.make_guard(failure_threshold=2, max_retries=5)
+            send = mock.Mock(return_value=Response(503, {}))
+            with self.assertRaises(ConfluenceUnavailableException):
+                guard.call(send, 'GET', (ConnectionError,))
+            # Retries stop as soon as the circuit is open, next calls fail without calling Confluence.
+            self.assertEqual(send.call_count, 2)
+            self.assertEqual(guard.breaker.state, CircuitBreaker.STATE_OPEN)
+            with self.assertRaises(ConfluenceUnavailableException) as raised:
+                guard.call(send, 'GET', (ConnectionError,))
+            self.assertEqual(send.call_count, 2)
+            self.assertGreater(raised.exception.retry_after, 0)
+
+    def test_half_open_circuit(self):
+        with self.assertLogs('django_netbox_confluence.updater.resilience', 'WARNING'):
+            breaker = CircuitBreaker('test', failure_threshold=1, reset_timeout=0)
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+            # Only one trial call is let through.
+            breaker.before_call()
+            self.assertEqual(breaker.state, CircuitBreaker.STATE_HALF_OPEN)
+            with self.assertRaises(ConfluenceUnavailableException):
+                breaker.before_call()
+            breaker.record_failure()
+            self.assertEqual(breaker.state, CircuitBreaker.STATE_OPEN)
+
+            breaker.before_call()
+            breaker.record_success()
+            self.assertEqual((breaker.state, breaker.failures), (CircuitBreaker.STATE_CLOSED, 0))
+            breaker.before_call()
+
+    def test_throttling_closes_circuit(self):
+        guard = self.make_guard(failure_threshold=2)
+        guard.breaker.record_failure()
+        send = mock.Mock(side_effect=[Response(429, {}), Response(200, {})])
+        guard.call(send, 'GET', (ConnectionError,))
+        self.assertEqual(guard.breaker.failures, 0)
+
+
+class ShardingTestCase(SimpleTestCase):
+    """
+    Page and excerpt names of the sharding layouts can be parsed back.
+    """
+
+    def test_single(self):
+        strategy = sharding.get_strategy('device', 'single')
+        key = strategy.get_object_key(make_event(1))
+        self.assertIsNone(key)
+        self.assertEqual(strategy.get_page_title(key), 'partials-device')
+        self.assertEqual(strategy.get_excerpt_name(key, 'name'), 'name')
+        self.assertEqual(strategy.parse_page_title('partials-device'), '')
+        self.assertIsNone(strategy.parse_page_title('partials-device-1'))
+        self.assertEqual(strategy.parse_excerpt_name('', 'name'), (None, 'name'))
+
+    def test_object(self):
+        strategy = sharding.get_strategy('device', 'object')
+        key = strategy.get_object_key(make_event(42))
+        self.assertEqual(strategy.get_page_title(key), 'partials-device-42')
+        self.assertEqual(strategy.get_excerpt_name(key, 'name'), 'name')
+        self.assertEqual(strategy.parse_page_title('partials-device-42'), '42')
+        self.assertIsNone(strategy.parse_page_title('partials-device-bucket-3'))
+        self.assertIsNone(strategy.parse_page_title('partials-site-42'))
+        self.assertEqual(strategy.parse_excerpt_name('42', 'name'), ('42', 'name'))
+
+    @override_settings(DNC_PAGE_SHARDING_KEY='name')
+    def test_object_key(self):
+        strategy = sharding.get_strategy('device', 'object')
+        # Excerpt names can't have whitespaces.
+        self.assertEqual(strategy.get_object_key(make_event(name=' core router ')), 'corerouter')
+        with self.assertRaises(WikiUpdateException):
+            strategy.get_object_key(make_event(name=' '))
+        with self.assertRaises(WikiUpdateException):
+            strategy.get_object_key({'model': 'device', 'data': {'id': 1}})
+
+    def test_bucket(self):
+        strategy = sharding.BucketPageSharding('device', buckets=4)
+        titles = {strategy.get_page_title(str(object_id)) for object_id in range(100)}
+        self.assertEqual(titles, {'partials-device-bucket-{}'.format(bucket) for bucket in range(4)})
+        # Bucket doesn't depend on the process.
+        self.assertEqual(strategy.get_page_title('42'), 'partials-device-bucket-{}'.format(zlib.crc32(b'42') % 4))
+        self.assertEqual(strategy.get_excerpt_name('42', 'name'), '42-name')
+        self.assertEqual(strategy.parse_page_title('partials-device-bucket-3'), '3')
+        self.assertIsNone(strategy.parse_page_title('partials-device-42'))
+        self.assertEqual(strategy.parse_excerpt_name('3', 'a-b-custom_rack'), ('a-b', 'custom_rack'))
+        # Configured fields are matched, so dashes of the field path don't split it.
+        self.assertEqual(strategy.parse_excerpt_name('3', 'a-b-custom_fields.rack-unit', ['name', 'rack-unit',
+                                                                                          'custom_fields.rack-unit']),
+                         ('a-b', 'custom_fields.rack-unit'))
+        self.assertEqual(strategy.parse_excerpt_name('3', 'name'), (None, 'name'))
+
+    @override_settings(DNC_PAGE_SHARDING='object', DNC_PAGE_SHARDING_MODELS={'site': 'bucket'})
+    def test_get_strategy(self):
+        self.assertEqual(sharding.get_strategy('device').name, 'object')
+        self.assertEqual(sharding.get_strategy('site').name, 'bucket')
+        with self.assertRaises(WikiUpdateException):
+            sharding.get_strategy('device', 'unknown')
+
+
+@override_settings(DNC_PAGE_SHARDING_BUCKETS=1)
+class ReshardCommandTestCase(ConfluenceTestCase):
+    """
+    `dnc_reshard` moves excerpts of existing pages to the new layout.
+    """
+
+    def setUp(self):
+        super().setUp()
+        with override_settings(DNC_PAGE_SHARDING='object'):
+            WikiPageUpdater(make_event(1, name='a')).update()
+            WikiPageUpdater(make_event(2, name='b', status='planned')).update()
+
+    def reshard(self, *args):
+        stdout = StringIO()
+        call_command('dnc_reshard', *args, stdout=stdout, stderr=StringIO())
+        return stdout.getvalue()
+
+    def test_reshard(self):
+        self.reshard('--from', 'object', '--to', 'bucket', '--delete-source')
+        self.assertEqual(list(self.confluence.pages), ['partials-device-bucket-0'])
+        self.assertEqual(self.confluence.get_values('partials-device-bucket-0'), {
+            '1-name': 'a',
+            '1-status': 'Active',
+            '2-name': 'b',
+            '2-status': 'Planned',
+        })
+
+    def test_dry_run(self):
+        stdout = self.reshard('--from', 'object', '--to', 'bucket', '--dry-run')
+        self.assertIn("partials-device-bucket-0: 4 excerpt(s) would be written.", stdout)
+        self.assertEqual(list(self.confluence.pages), ['partials-device-1', 'partials-device-2'])
+
+    def test_dashed_field(self):
+        # Field configured before dashes were rejected.
+        NetBoxConfluenceField.objects.create(model_name='device', field_name='site.rack-unit',
+                                             field_type='TextLinkedField')
+        with override_settings(DNC_PAGE_SHARDING='bucket'):
+            WikiPageUpdater(make_event(1, name='a', site={'rack-unit': 'U1'})).update()
+        self.reshard('--from', 'bucket', '--to', 'object')
+        self.assertEqual(self.confluence.get_values('partials-device-1'), {
+            'name': 'a',
+            'status': 'Active',
+            'site.rack-unit': 'U1',
+        })
+
+    def test_single_page_can_not_be_split(self):
+        self.reshard('--from', 'object', '--to', 'single', '--delete-source')
+        self.assertEqual(list(self.confluence.pages), ['partials-device'])
+        # Single page doesn't tell objects apart.
+        with self.assertRaisesMessage(CommandError, "Use `dnc_resync`"):
+            self.reshard('--from', 'single', '--to', 'object')
+
+
+class DeadLetterReplayTestCase(ConfluenceTestCase):
+    """
+    Dead letters are replayed page by page, letters of objects changed since the failure are not replayed.
+    """
+
+    def store(self, event):
+        return dead_letters.store(event, WikiUpdateException("Confluence is down."), DeadLetter.SOURCE_WEBHOOK)
+
+    def get_statuses(self):
+        return list(DeadLetter.objects.values_list('status', flat=True))
+
+    def test_replay(self):
+        self.store(make_event(1, name='old'))
+        self.store(make_event(2, name='new'))
+        self.assertEqual(dead_letters.replay(DeadLetter.objects.all()), (2, 0, 0))
+        self.assertEqual(self.confluence.saves, ['partials-device'])
+        self.assertEqual(self.confluence.get_values('partials-device')['name'], 'new')
+        self.assertEqual(self.get_statuses(), [DeadLetter.STATUS_REPLAYED] * 2)
+
+    def test_failed_replay(self):
+        self.store(make_event(1))
+        self.confluence.error = WikiUpdateException("Still down.")
+        with self.assertLogs('django_netbox_confluence.dead_letters', 'ERROR'):
+            self.assertEqual(dead_letters.replay(DeadLetter.objects.all()), (0, 1, 0))
+        letter = DeadLetter.objects.get()
+        self.assertEqual((letter.status, letter.attempts), (DeadLetter.STATUS_DEAD, 2))
+        self.assertIn("Still down.", letter.error)
+
+    def test_invalid_letter_fails_alone(self):
+        broken = make_event(2)
+        del broken['data']['name']
+        self.store(make_event(1))
+        self.store(broken)
+        self.assertEqual(dead_letters.replay(DeadLetter.objects.all()), (1, 1, 0))
+        self.assertEqual(self.get_statuses(), [DeadLetter.STATUS_REPLAYED, DeadLetter.STATUS_DEAD])
+
+    def test_stale_letter_is_not_replayed(self):
+        self.store(make_event(1, name='old', last_updated='2024-01-01T10:00:00Z'))
+        self.assertIsNone(deliveries.check(make_event(1, name='new', last_updated='2024-01-01T11:00:00Z')))
+        self.assertEqual(dead_letters.replay(DeadLetter.objects.all()), (0, 0, 1))
+        self.assertEqual(self.get_statuses(), [DeadLetter.STATUS_STALE])
+        self.assertEqual(self.confluence.saves, [])
+
+    def test_requeue(self):
+        self.store(make_event(1, last_updated='2024-01-01T10:00:00Z'))
+        self.store(make_event(2, last_updated='2024-01-01T10:00:00Z'))
+        deliveries.check(make_event(2, last_updated='2024-01-01T11:00:00Z'))
+        self.assertEqual(dead_letters.requeue(DeadLetter.objects.all()), (1, 0, 1))
+        self.assertEqual([json.loads(job.payload)['data']['id'] for job in WebhookJob.objects.all()], [1])
+        self.assertEqual(self.get_statuses(), [DeadLetter.STATUS_REPLAYED, DeadLetter.STATUS_STALE])
+
+    def test_replay_command(self):
+        self.store(make_event(1, name='a', last_updated='2024-01-01T10:00:00Z'))
+        self.store(make_event(2, name='b', last_updated='2024-01-01T10:00:00Z'))
+        deliveries.check(make_event(2, last_updated='2024-01-01T11:00:00Z'))
+        stdout, stderr = StringIO(), StringIO()
+        call_command('dnc_replay', '--rate', '0', stdout=stdout, stderr=stderr)
+        self.assertIn("stale, newer event of the object was delivered", stderr.getvalue())
+        self.assertIn("1 dead letter(s) of 1 page(s) to replay.", stdout.getvalue())
+        self.assertEqual(self.confluence.get_values('partials-device')['name'], 'a')
+        self.assertEqual(self.get_statuses(), [DeadLetter.STATUS_REPLAYED, DeadLetter.STATUS_STALE])
+
+    def test_replay_command_dry_run(self):
+        self.store(make_event(1))
+        stdout = StringIO()
+        call_command('dnc_replay', '--dry-run', stdout=stdout)
+        self.assertIn("partials-device: 1 dead letter(s) would be replayed.", stdout.getvalue())
+        self.assertEqual((self.confluence.saves, self.get_statuses()), ([], [DeadLetter.STATUS_DEAD]))
+
+
+class FieldPathsTestCase(SimpleTestCase):
+    """
+    Dotted paths of the fields take nested values of webhook `data`.
+    """
+    DATA = {
+        'name': 'router',
+        'site': {'id': 7, 'name': 'DC1', 'region': None},
+        'tags': [{'name': 'core'}, {'name': 'edge'}],
+        'custom_fields': {'rack': 'R1'},
+    }
+
+    def test_compile_path(self):
+        self.assertEqual(field_paths.compile_path('name'), ('name',))
+        self.assertEqual(field_paths.compile_path('site.region.name'), ('site', 'region', 'name'))
+        self.assertEqual(field_paths.compile_path('tags[0].name'), ('tags', 0, 'name'))
+        self.assertEqual(field_paths.compile_path('tags[-1]'), ('tags', -1))
+
+    def test_wrong_path(self):
+        for path in ('', '.name', '[0]', 'site..name', 'site name', 'tags[x]', 'site.'):
+            with self.subTest(path=path):
+                with self.assertRaises(WikiUpdateException):
+                    field_paths.compile_path(path)
+
+    def test_get_value(self):
+        for path, value in (('name', 'router'),
+                            ('site.name', 'DC1'),
+                            ('tags[1].name', 'edge'),
+                            ('tags[-1].name', 'edge'),
+                            # Objects missing on the path and short lists give empty value.
+                            ('site.region.name', None),
+                            ('tags[5].name', None)):
+            with self.subTest(path=path):
+                self.assertEqual(field_paths.make_accessor(field_paths.compile_path(path))(self.DATA), value)
+
+    def test_missing_key(self):
+        for path in ('serial', 'site.facility', 'name.first'):
+            with self.subTest(path=path):
+                with self.assertRaises(KeyError):
+                    field_paths.get_value(self.DATA, field_paths.compile_path(path))
+
+    def test_resolve(self):
+        steps = field_paths.compile_path('site.facility')
+        resolve = mock.Mock(return_value={'id': 7, 'facility': 'Building A'})
+        self.assertEqual(field_paths.get_value(self.DATA, steps, resolve), 'Building A')
+        resolve.assert_called_once_with(self.DATA['site'])
+        self.assertEqual(field_paths.get_unresolved(self.DATA, steps), self.DATA['site'])
+        self.assertIsNone(field_paths.get_unresolved(self.DATA, field_paths.compile_path('site.name')))
+        # Webhook `data` itself is never resolved.
+        with self.assertRaises(KeyError):
+            field_paths.get_value(self.DATA, field_paths.compile_path('serial'), resolve)
+
+
+class FieldPathConfigurationTestCase(ConfluenceTestCase):
+    """
+    Fields configured with paths are validated and written under their path names.
+    """
+    FIELDS = (
+        ('site.name', 'TextLinkedField'),
+        ('tags[0].name', 'TextLinkedField'),
+    )
+
+    def test_clean(self):
+        NetBoxConfluenceField(model_name='device', field_name='site.region.name', field_type='TextLinkedField').clean()
+        with self.assertRaises(ValidationError):
+            NetBoxConfluenceField(model_name='device', field_name='site..name', field_type='TextLinkedField').clean()
+        with self.assertRaises(ValidationError):
+            NetBoxConfluenceField(model_name='device', field_name='site.rack-unit',
+                                  field_type='TextLinkedField').clean()
+
+    def test_write(self):
+        event = make_event(site={'id': 7, 'name': 'DC1'}, tags=[{'name': 'core'}])
+        self.assertTrue(WikiPageUpdater(event).update())
+        self.assertEqual(self.confluence.get_values('partials-device'), {'site.name': 'DC1', 'tags[0].name': 'core'})
+
+    def test_missing_value(self):
+        with self.assertRaises(WikiUpdateException):
+            WikiPageUpdater(make_event(tags=[])).update()
+
+    def test_non_string_value(self):
+        NetBoxConfluenceField.objects.create(model_name='device', field_name='site.id', field_type='TextLinkedField')
+        tags = [{'name': 'core'}]
+        self.assertTrue(WikiPageUpdater(make_event(site={'id': 7, 'name': 'DC1'}, tags=tags)).update())
+        self.assertTrue(WikiPageUpdater(make_event(site={'id': 8, 'name': 'DC1'}, tags=tags)).update())
+        self.assertEqual(self.confluence.get_values('partials-device')['site.id'], '8')
+        # Number is compared with the text of the page.
+        self.assertFalse(WikiPageUpdater(make_event(site={'id': 8, 'name': 'DC1'}, tags=tags)).update())
+
+
+class AdmissionControllerTestCase(SimpleTestCase):
+    """
+    Updates beyond the in-flight limits are rejected after the wait.
+    """
+
+    def test_page_limit(self):
+        controller = AdmissionController(max_per_page=1, wait=0, retry_after=7)
+        controller.enter('a')
+        with self.assertRaises(AdmissionRejectedException) as raised:
+            controller.enter('a')
+        self.assertEqual(raised.exception.retry_after, 7)
+        # Other pages are not limited.
+        controller.enter('b')
+        controller.leave('a')
+        controller.enter('a')
+        self.assertEqual((controller.in_flight, controller.waiting, controller.pages), (2, 0, {'a': 1, 'b': 1}))
+
+    def test_global_limit(self):
+        controller = AdmissionController(max_in_flight=2, wait=0)
+        controller.enter('a')
+        controller.enter('b')
+        with self.assertRaises(AdmissionRejectedException):
+            controller.enter('c')
+        controller.leave('b')
+        controller.leave('a')
+        self.assertEqual((controller.in_flight, controller.pages), (0, {}))
+
+    def test_waiting_update_is_admitted(self):
+        controller = AdmissionController(max_in_flight=1, wait=5)
+        controller.enter('a')
+        timer = threading.Timer(0.05, controller.leave, ('a',))
+        timer.start()
+        self.addCleanup(timer.join)
+        controller.enter('b')
+        self.assertEqual(controller.pages, {'b': 1})
+
+    def test_async(self):
+        controller = AdmissionController(max_per_page=1, wait=0.05)
+        async_to_sync(controller.aenter)('a')
+        with self.assertRaises(AdmissionRejectedException):
+            async_to_sync(controller.aenter)('a')
+        self.assertEqual((controller.in_flight, controller.waiting), (1, 0))
+
+
+@override_settings(DNC_QUEUE_ENABLED=False, DNC_ADMISSION_MAX_PER_PAGE=1, DNC_ADMISSION_WAIT=0,
+                   DNC_ADMISSION_RETRY_AFTER=7)
+class AdmissionViewTestCase(ConfluenceTestCase):
+    """
+    Webhooks of the pages which aren't admitted get 429 without writing anything.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.addCleanup(setattr, AdmissionController, '_shared', None)
+        AdmissionController._shared = None
+        self.controller = AdmissionController.get_shared()
+        # The page is being updated by another request.
+        self.controller.enter('partials-device')
+
+    def post(self, url, body):
+        return self.client.post(url, data=body, content_type='application/json', HTTP_AUTHORIZATION='Token ')
+
+    def test_rejected(self):
+        response = self.post('/netbox-wiki-api/model_change_trigger/', json.dumps(make_event(1)))
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '7'))
+        # Shed load isn't kept or remembered, NetBox sends it again.
+        self.assertEqual((DeadLetter.objects.count(), WebhookDelivery.objects.count()), (0, 0))
+        self.assertEqual(self.confluence.saves, [])
+
+        self.controller.leave('partials-device')
+        response = self.post('/netbox-wiki-api/model_change_trigger/', json.dumps(make_event(1)))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.controller.in_flight, 0)
+
+    def test_async_rejected(self):
+        async def post():
+            return await AsyncClient().post('/netbox-wiki-api/async/model_change_trigger/',
+                                            data=json.dumps(make_event(1)), content_type='application/json',
+                                            authorization='Token ')
+
+        response = async_to_sync(post)()
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '7'))
+        self.assertEqual(WebhookDelivery.objects.count(), 0)
+
+    def test_batch_rejected(self):
+        response = self.post('/netbox-wiki-api/batch/model_change_trigger/', json.dumps([make_event(1)]))
+        result = response.json()['results'][0]
+        self.assertEqual((result['status'], result['retry_after']), (429, 7))
+        self.assertEqual((DeadLetter.objects.count(), WebhookDelivery.objects.count()), (0, 0))
+
+    @override_settings(DNC_QUEUE_ENABLED=True)
+    def test_queue_is_not_limited(self):
+        response = self.post('/netbox-wiki-api/model_change_trigger/', json.dumps(make_event(1)))
+        self.assertEqual(response.status_code, 202)
+
+
+class LookupLinkedField(TextLinkedField):
+    """
+    Field whose values are looked up with one call per chain.
+    """
+    verbose_name = "Lookup field"
+    # Values of the fields passed to each call of the batch hook.
+    lookups = list()
+
+    @classmethod
+    def provide_values(cls, fields):
+        cls.lookups.append([field.value for field in fields])
+        return ["looked up {}".format(field.value) for field in fields]
+
+
+class ProvideValuesTestCase(ConfluenceTestCase):
+    """
+    Field types with batch hook provide values of the whole chain with one call.
+    """
+    FIELDS = (
+        ('name', 'LookupLinkedField'),
+        ('serial', 'LookupLinkedField'),
+        ('status', 'StatusLinkedField'),
+    )
+
+    def setUp(self):
+        super().setUp()
+        LookupLinkedField.lookups = list()
+
+    def test_write(self):
+        self.assertTrue(WikiPageUpdater(make_event(serial='S1')).update())
+        self.assertEqual(LookupLinkedField.lookups, [['router', 'S1']])
+        self.assertEqual(self.confluence.get_values('partials-device'), {
+            'name': 'looked up router',
+            'serial': 'looked up S1',
+            'status': 'Active',
+        })
+
+    def test_batch(self):
+        jobs.enqueue(make_event(1, serial='S1'))
+        jobs.enqueue(make_event(2, name='switch', serial='S2'))
+        jobs.process(jobs.claim_batch(60), max_attempts=3, retry_delay=1)
+        # Merged chain of the batch is looked up once.
+        self.assertEqual(LookupLinkedField.lookups, [['switch', 'S2']])
+
+    def test_provided_fields_are_skipped(self):
+        fields = [LookupLinkedField('name', 'a'), LookupLinkedField('serial', 'b'), TextLinkedField('asset', 'c')]
+        fields[0].provided_value = 'kept'
+        self.assertTrue(ABCLinkedFieldMeta.has_batch_hook(fields))
+        ABCLinkedFieldMeta.provide_chain_values(fields)
+        self.assertEqual(LookupLinkedField.lookups, [['b']])
+        self.assertEqual([field.get_value() for field in fields], ['kept', 'looked up b', 'c'])
+        self.assertFalse(ABCLinkedFieldMeta.has_batch_hook(fields))
+
+    def test_wrong_number_of_values(self):
+        fields = [LookupLinkedField('name', 'a'), LookupLinkedField('serial', 'b')]
+        with mock.patch.object(LookupLinkedField, 'provide_values', classmethod(lambda cls, fields: ['one'])):
+            with self.assertRaises(WikiUpdateException):
+                ABCLinkedFieldMeta.provide_chain_values(fields)
+
+    def test_value_is_provided_once(self):
+        field = TextLinkedField('name', 'a')
+        with mock.patch.object(TextLinkedField, 'provide_value', return_value='b') as provide_value:
+            self.assertEqual((field.get_value(), field.get_value()), ('b', 'b'))
+        provide_value.assert_called_once_with()
+
+
+class DeliveryTestCase(ConfluenceTestCase):
+    """
+    Repeated and out-of-order deliveries of the object are dropped, failed ones are forgotten.
+    """
+
+    def post(self, url, body):
+        return self.client.post(url, data=json.dumps(body), content_type='application/json',
+                                HTTP_AUTHORIZATION='Token ')
+
+    def test_duplicate(self):
+        self.assertIsNone(deliveries.check(make_event(1)))
+        self.assertEqual(deliveries.check(make_event(1)), deliveries.RESULT_DUPLICATE)
+        # Other objects and other changes of the object are written.
+        self.assertIsNone(deliveries.check(make_event(2)))
+        self.assertIsNone(deliveries.check(make_event(1, name='renamed')))
+
+    def test_order(self):
+        self.assertIsNone(deliveries.check(make_event(1, name='b', last_updated='2024-01-01T11:00:00Z')))
+        self.assertEqual(deliveries.check(make_event(1, name='a', last_updated='2024-01-01T10:00:00Z')),
+                         deliveries.RESULT_STALE)
+        self.assertIsNone(deliveries.check(make_event(1, name='c', last_updated='2024-01-01T12:00:00Z')))
+        self.assertTrue(deliveries.is_stale(make_event(1, name='b', last_updated='2024-01-01T11:00:00Z')))
+        # Events without time are never stale.
+        self.assertIsNone(deliveries.check(make_event(1, name='d')))
+        self.assertEqual(WebhookDelivery.objects.get().last_updated.hour, 12)
+
+    def test_get_last_updated(self):
+        ten = datetime(2024, 1, 1, 10, tzinfo=timezone.utc)
+        for value, expected in (('2024-01-01T10:00:00Z', ten),
+                                ('2024-01-01T12:00:00+02:00', ten),
+                                # Naive time is UTC.
+                                ('2024-01-01T10:00:00', ten)):
+            with self.subTest(value=value):
+                self.assertEqual(deliveries.get_last_updated(make_event(last_updated=value)), expected)
+        for value in ('yesterday', '2024-13-01T10:00:00Z', 42, None):
+            with self.subTest(value=value):
+                self.assertIsNone(deliveries.get_last_updated(make_event(last_updated=value)))
+
+    def test_forget(self):
+        deliveries.check(make_event(1))
+        deliveries.forget(make_event(1, name='other'))
+        self.assertEqual(deliveries.check(make_event(1)), deliveries.RESULT_DUPLICATE)
+        deliveries.forget(make_event(1))
+        self.assertIsNone(deliveries.check(make_event(1)))
+
+    def test_forget_keeps_order(self):
+        self.assertIsNone(deliveries.check(make_event(1, name='b', last_updated='2024-01-01T11:00:00Z')))
+        self.assertIsNone(deliveries.check(make_event(1, name='c', last_updated='2024-01-01T12:00:00Z')))
+        # Newer event fails, the written one is remembered again.
+        deliveries.forget(make_event(1, name='c', last_updated='2024-01-01T12:00:00Z'))
+        self.assertEqual(deliveries.check(make_event(1, name='b', last_updated='2024-01-01T11:00:00Z')),
+                         deliveries.RESULT_DUPLICATE)
+        self.assertEqual(deliveries.check(make_event(1, name='a', last_updated='2024-01-01T10:00:00Z')),
+                         deliveries.RESULT_STALE)
+        self.assertIsNone(deliveries.check(make_event(1, name='c', last_updated='2024-01-01T12:00:00Z')))
+
+    def test_failed_batch_is_forgotten(self):
+        events = [make_event(1, name='b', last_updated='2024-01-01T11:00:00Z'),
+                  make_event(1, name='c', last_updated='2024-01-01T12:00:00Z')]
+        for event in events:
+            deliveries.check(event)
+            jobs.enqueue(event)
+        WebhookJob.objects.update(attempts=2)
+        self.confluence.error = WikiUpdateException("Broken.")
+        with self.assertLogs('django_netbox_confluence.jobs', 'ERROR'):
+            jobs.process(jobs.claim_batch(60), max_attempts=3, retry_delay=1)
+        # Both events failed, so neither of them is dropped when NetBox delivers it again.
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    @override_settings(DNC_DEDUP_RETENTION=0)
+    def test_retention(self):
+        deliveries.check(make_event(1))
+        self.assertIsNone(deliveries.check(make_event(1)))
+
+    @override_settings(DNC_DEDUP_ENABLED=False)
+    def test_disabled(self):
+        self.assertIsNone(deliveries.check(make_event(1)))
+        self.assertIsNone(deliveries.check(make_event(1)))
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_object_without_id(self):
+        event = make_event()
+        del event['data']['id']
+        self.assertIsNone(deliveries.check(event))
+        self.assertIsNone(deliveries.check(event))
+
+    def test_queued_duplicate(self):
+        self.assertEqual(self.post('/netbox-wiki-api/model_change_trigger/', make_event(1)).status_code, 202)
+        response = self.post('/netbox-wiki-api/model_change_trigger/', make_event(1))
+        self.assertEqual((response.status_code, response.json()['result']), (200, 'duplicate'))
+        self.assertEqual(WebhookJob.objects.count(), 1)
+
+    @override_settings(DNC_PAGE_SHARDING='object', DNC_PAGE_SHARDING_KEY='serial')
+    def test_rejected_enqueue_is_forgotten(self):
+        self.assertEqual(self.post('/netbox-wiki-api/model_change_trigger/', make_event(1)).status_code, 400)
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    @override_settings(DNC_QUEUE_ENABLED=False)
+    def test_failed_write_is_forgotten(self):
+        self.confluence.error = ConfluenceUnavailableException("Confluence is down.", retry_after=30)
+        response = self.post('/netbox-wiki-api/model_change_trigger/', make_event(1))
+        self.assertEqual((response.status_code, response['Retry-After']), (503, '30'))
+        self.assertEqual((DeadLetter.objects.count(), WebhookDelivery.objects.count()), (1, 0))
+
+        # NetBox delivers the event again when Confluence is back.
+        self.confluence.error = None
+        self.assertEqual(self.post('/netbox-wiki-api/model_change_trigger/', make_event(1)).status_code, 201)
+
+    def test_dead_lettered_job_is_forgotten(self):
+        deliveries.check(make_event(1))
+        job = jobs.enqueue(make_event(1))
+        job.attempts = 3
+        jobs.fail(job, WikiUpdateException("Broken."), max_attempts=3, retry_delay=1)
+        self.assertEqual((job.status, DeadLetter.objects.count()), (WebhookJob.STATUS_FAILED, 1))
+        self.assertFalse(WebhookDelivery.objects.exists())
+
+    def test_batch(self):
+        response = self.post('/netbox-wiki-api/batch/model_change_trigger/', [
+            make_event(1, last_updated='2024-01-01T11:00:00Z'),
+            make_event(1, last_updated='2024-01-01T11:00:00Z'),
+            make_event(1, name='old', last_updated='2024-01-01T10:00:00Z'),
+        ])
+        self.assertEqual([result['status'] for result in response.json()['results']], [202, 200, 200])
+        self.assertEqual([result.get('result') for result in response.json()['results']],
+                         [None, 'duplicate', 'stale'])
+
+
+class SnapshotDiffTestCase(ConfluenceTestCase):
+    """
+    Only fields changed between NetBox snapshots of the object are written.
+    """
+    FIELDS = ConfluenceTestCase.FIELDS + (
+        ('site.name', 'TextLinkedField'),
+    )
+    PRECHANGE = {'name': 'router', 'status': 'active', 'site': 7, 'custom_fields': {}}
+
+    def make_event(self, **postchange):
+        postchange = dict(self.PRECHANGE, **postchange)
+        event = make_event(name=postchange['name'], status=postchange['status'],
+                           site={'id': postchange['site'], 'name': 'DC1'})
+        event['snapshots'] = {'prechange': self.PRECHANGE, 'postchange': postchange}
+        return event
+
+    def get_names(self, event):
+        return [field.name for field in WikiPageUpdater(event).get_field_chain()]
+
+    def test_is_changed(self):
+        steps = field_paths.compile_path('site.region.name')
+        self.assertFalse(field_paths.is_changed({'site': 7}, {'site': 7}, steps))
+        # Related objects are ids in the snapshots, so the longest known prefix is compared.
+        self.assertTrue(field_paths.is_changed({'site': 7}, {'site': 8}, steps))
+        self.assertTrue(field_paths.is_changed({}, {}, steps))
+        self.assertTrue(field_paths.is_changed({'name': 'a'}, {'name': 'b'}, field_paths.compile_path('name')))
+
+    @override_settings(DNC_PAGE_SHARDING='object')
+    def test_changed_fields(self):
+        self.assertEqual(self.get_names(self.make_event(name='renamed')), ['name'])
+        self.assertEqual(self.get_names(self.make_event(site=8)), ['site.name'])
+        self.assertEqual(self.get_names(self.make_event(status='offline', site=8)), ['site.name', 'status'])
+
+    @override_settings(DNC_PAGE_SHARDING='object')
+    def test_unchanged_object_is_not_written(self):
+        self.assertFalse(WikiPageUpdater(self.make_event()).update())
+        self.assertEqual(self.confluence.pages, {})
+
+    def test_single_page_writes_all_fields(self):
+        # Objects share excerpts of the single page, so they should hold values of the same object.
+        self.assertEqual(self.get_names(self.make_event(name='renamed')), ['name', 'site.name', 'status'])
+        self.assertEqual(self.get_names(self.make_event()), [])
+
+    @override_settings(DNC_PAGE_SHARDING='object')
+    def test_without_snapshots(self):
+        event = self.make_event(name='renamed')
+        del event['snapshots']
+        self.assertEqual(self.get_names(event), ['name', 'site.name', 'status'])
+        event['snapshots'] = {'prechange': None, 'postchange': self.PRECHANGE}
+        self.assertEqual(self.get_names(event), ['name', 'site.name', 'status'])
+        with override_settings(DNC_SNAPSHOT_DIFF_ENABLED=False):
+            self.assertEqual(self.get_names(self.make_event()), ['name', 'site.name', 'status'])
+
+
+class QueueTestCase(ConfluenceTestCase):
+    """
+    Webhooks are queued and failed jobs are retried with backoff.
+    """
+
+    def post(self, body):
+        return self.client.post('/netbox-wiki-api/model_change_trigger/', data=json.dumps(body),
+                                content_type='application/json', HTTP_AUTHORIZATION='Token ')
+
+    def test_webhook_is_queued(self):
+        response = self.post(make_event(1))
+        job = WebhookJob.objects.get()
+        self.assertEqual((response.status_code, response.json()['job']), (202, job.pk))
+        self.assertEqual((job.status, job.page_title, json.loads(job.payload)), (WebhookJob.STATUS_PENDING,
+                                                                                  'partials-device', make_event(1)))
+        self.assertEqual(self.confluence.saves, [])
+
+    def test_retry_backoff(self):
+        job = jobs.enqueue(make_event(1))
+        for attempt, delay in ((1, 10), (2, 20), (3, 40)):
+            job.attempts = attempt
+            started_at = timezone.now()
+            jobs.fail(job, WikiUpdateException("Broken."), max_attempts=5, retry_delay=10)
+            self.assertEqual(job.status, WebhookJob.STATUS_PENDING)
+            self.assertAlmostEqual((job.available_at - started_at).total_seconds(), delay, delta=1)
+        self.assertEqual(WebhookJob.objects.get().last_error, "WikiUpdateException: Broken.")
+
+    def test_unavailable_attempt_is_not_counted(self):
+        job = jobs.enqueue(make_event(1))
+        job.attempts = 5
+        started_at = timezone.now()
+        jobs.fail(job, ConfluenceUnavailableException("Down.", retry_after=60), max_attempts=5, retry_delay=10)
+        self.assertEqual((job.status, job.attempts), (WebhookJob.STATUS_PENDING, 4))
+        self.assertAlmostEqual((job.available_at - started_at).total_seconds(), 60, delta=1)
+        self.assertFalse(DeadLetter.objects.exists())
+
+    def test_failed_write_is_retried(self):
+        jobs.enqueue(make_event(1))
+        self.confluence.error = WikiUpdateException("Broken.")
+        with self.assertLogs('django_netbox_confluence.jobs', 'ERROR'):
+            succeeded, failed = jobs.process(jobs.claim_batch(60), max_attempts=3, retry_delay=0)
+        self.assertEqual((succeeded, len(failed)), ([], 1))
+        self.assertEqual(WebhookJob.objects.get().status, WebhookJob.STATUS_PENDING)
+
+
+class WorkerCommandTestCase(ConfluenceStandInMixin, TransactionTestCase):
+    """
+    `dnc_worker` drains the queue, each page is written once.
+    """
+
+    def test_once(self):
+        for object_id in range(10):
+            jobs.enqueue(make_event(object_id, name='device {}'.format(object_id)))
+        stdout = StringIO()
+        # In-memory test database doesn't wait for locks, so the worker runs a single thread.
+        call_command('dnc_worker', '--once', '--concurrency', '1', stdout=stdout, stderr=StringIO())
+        self.assertEqual(stdout.getvalue().count(" done."), 10)
+        self.assertEqual(self.confluence.saves, ['partials-device'])
+        self.assertEqual(self.confluence.get_values('partials-device')['name'], 'device 9')
+        self.assertEqual(set(WebhookJob.objects.values_list('status', flat=True)), {WebhookJob.STATUS_DONE})
+        # Pages are released after processing.
+        self.assertEqual(list(PageLock.objects.values_list('lock_token', 'locked_until')), [('', None)])
+
+
+class ProfilingTestCase(ConfluenceTestCase):
+    """
+    Sampled requests and worker batches are profiled, profiles are rotated and aggregated by `dnc_profile_report`.
+    """
+
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        patcher = override_settings(DNC_PROFILE_DIR=self.directory)
+        patcher.enable()
+        self.addCleanup(patcher.disable)
+
+    def make_request(self, **headers):
+        return RequestFactory().post('/netbox-wiki-api/model_change_trigger/', data=json.dumps(make_event(1)),
+                                     content_type='application/json', **headers)
+
+    def test_should_profile(self):
+        self.assertFalse(profiling.should_profile(self.make_request()))
+        with override_settings(DNC_PROFILE_ENABLED=True):
+            self.assertTrue(profiling.should_profile(self.make_request()))
+
+    @override_settings(DNC_PROFILE_SECRET='secret')
+    def test_signed_header(self):
+        self.assertTrue(profiling.should_profile(self.make_request(HTTP_X_DNC_PROFILE=profiling.make_header_value())))
+        with self.assertLogs('django_netbox_confluence.profiling', 'WARNING'):
+            self.assertFalse(profiling.should_profile(self.make_request(HTTP_X_DNC_PROFILE='profile:forged')))
+        with override_settings(DNC_PROFILE_SECRET=None):
+            self.assertRaises(ValueError, profiling.make_header_value)
+
+    def test_sample_rate(self):
+        with override_settings(DNC_PROFILE_SAMPLE_RATE=0.1), mock.patch('random.random', return_value=0.05):
+            self.assertTrue(profiling.should_profile(self.make_request()))
+            # Worker falls back to the rate of the requests.
+            self.assertTrue(profiling.should_profile_batch())
+            with override_settings(DNC_PROFILE_WORKER_SAMPLE_RATE=0):
+                self.assertFalse(profiling.should_profile_batch())
+        with override_settings(DNC_PROFILE_SAMPLE_RATE=0.1), mock.patch('random.random', return_value=0.5):
+            self.assertFalse(profiling.should_profile(self.make_request()))
+
+    def test_profiled_request(self):
+        with override_settings(DNC_PROFILE_ENABLED=True):
+            response = self.client.post('/netbox-wiki-api/model_change_trigger/', data=json.dumps(make_event(1)),
+                                        content_type='application/json', HTTP_AUTHORIZATION='Token ')
+        self.assertEqual(response.status_code, 202)
+        [(_, tags)] = profiling.list_profiles(self.directory)
+        # Dashes separate the tags of the file name, so they are replaced in the page title.
+        self.assertEqual((tags['model'], tags['page'], tags['size']),
+                         ('device', 'partials_device', len(json.dumps(make_event(1)))))
+
+    @override_settings(DNC_PROFILE_WORKER_SAMPLE_RATE=1)
+    def test_profiled_batch(self):
+        queued = [jobs.enqueue(make_event(object_id)) for object_id in (1, 2)]
+        succeeded, failed = profiling.run_batch(jobs.process, jobs.claim_batch(60), max_attempts=3, retry_delay=1)
+        self.assertEqual((len(succeeded), failed), (2, []))
+        [(path, tags)] = profiling.list_profiles(self.directory)
+        self.assertEqual((tags['model'], tags['page'], tags['size']),
+                         ('device', 'partials_device', sum(len(job.payload) for job in queued)))
+        # Page is written under the profiler.
+        self.assertIn('write', {function for _, _, function in pstats.Stats(path).stats})
+
+    def test_rotation(self):
+        started_at = datetime(2020, 4, 1, 10)
+        for second in range(5):
+            with mock.patch.object(profiling, 'datetime') as mocked:
+                mocked.datetime.now.return_value = started_at + timedelta(seconds=second)
+                file_name = profiling.make_file_name('device', 'partials-device', 100)
+            open(os.path.join(self.directory, file_name), 'w').close()
+        open(os.path.join(self.directory, 'notes.txt'), 'w').close()
+        profiling.rotate(self.directory, 2)
+        self.assertEqual([tags['time'] for _, tags in profiling.list_profiles(self.directory)],
+                         [started_at + timedelta(seconds=3), started_at + timedelta(seconds=4)])
+        self.assertTrue(os.path.exists(os.path.join(self.directory, 'notes.txt')))
+
+    def test_report(self):
+        for model_name, size in (('device', 10), ('device', 2000), ('site', 10)):
+            profile = cProfile.Profile()
+            profile.runcall(WikiPageUpdater.generate_page_name, model_name, make_event(1, model=model_name))
+            profiling.save(profile, lambda: (model_name, 'partials-' + model_name, size))
+
+        stdout = StringIO()
+        call_command('dnc_profile_report', '--model', 'device', '--top', '5', stdout=stdout)
+        self.assertIn("2 profile(s) of device from", stdout.getvalue())
+        self.assertIn("generate_page_name", stdout.getvalue())
+        stdout = StringIO()
+        call_command('dnc_profile_report', '--min-size', '1000', stdout=stdout)
+        self.assertIn("1 profile(s) of device from", stdout.getvalue())
+        with self.assertRaises(CommandError):
+            call_command('dnc_profile_report', '--page', 'rack', stdout=StringIO())
+
+
+class ConfluenceClientStandInMixin(object):
+    """
+    Configures device fields and two Confluence targets whose adapters talk to Confluence client stand-ins.
+    """
+
+    def setUp(self):
+        for field_name, field_type in ConfluenceStandInMixin.FIELDS:
+            NetBoxConfluenceField.objects.create(model_name='device', field_name=field_name, field_type=field_type)
+        self.addCleanup(field_plans.invalidate)
+        self.clients = {'http://default': ConfluenceClientStandIn(), 'http://ops': ConfluenceClientStandIn()}
+        self.default = self.clients['http://default']
+        settings_override = override_settings(DNC_CONFLUENCE_TARGETS={
+            name: {'url': 'http://' + name, 'username': 'u', 'password': 'p', 'space_key': 'NETBOX'}
+            for name in ('default', 'ops')
+        }, DNC_TARGET_ROUTES={'*': ['default']})
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        make_async_client = httpx.AsyncClient
+        for patcher in (mock.patch('django_netbox_confluence.updater.confluence_adapter.Confluence',
+                                   side_effect=lambda url, **kwargs: self.clients[url]),
+                        mock.patch.object(httpx, 'AsyncClient', side_effect=lambda base_url, **kwargs: make_async_client(
+                            base_url=base_url, transport=httpx.MockTransport(
+                                self.clients[base_url.rstrip('/')].handle_request), **kwargs)),
+                        mock.patch.dict(ConfluenceAdapter.shared_adapters, clear=True),
+                        mock.patch.dict(AsyncConfluenceAdapter.shared_adapters, clear=True)):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        targets.reset()
+        self.addCleanup(targets.reset)
+
+
+class ConfluenceAdapterTestCase(ConfluenceClientStandInMixin, TestCase):
+    """
+    Adapters write pages through the Confluence client stand-in: local copies are saved with the next version and
+    conflicts make the page read again.
+    """
+
+    def get_adapter(self, target_name='default'):
+        return WikiPageUpdater.get_confluence_adapter(target_name)
+
+    def test_shadow_is_saved_with_next_version(self):
+        self.assertTrue(WikiPageUpdater(make_event(1, name='a')).update())
+        del self.default.calls[:]
+        self.assertTrue(WikiPageUpdater(make_event(1, name='b')).update())
+        # Local copy is patched, the page isn't read.
+        self.assertEqual(self.default.calls, [('put', 3)])
+        self.assertEqual(self.default.get_values('partials-device'), {'name': 'b', 'status': 'Active'})
+
+    def test_shadow_conflict(self):
+        WikiPageUpdater(make_event(1, name='a')).update()
+        self.default.edit('partials-device', 'edited by user')
+        del self.default.calls[:]
+        self.assertTrue(WikiPageUpdater(make_event(1, name='b')).update())
+        # Outdated copy is rejected, the page is read again by id and saved with the next version.
+        self.assertEqual(self.default.calls, [('put', 3), ('get_page_by_id', '1'), ('put', 4)])
+        page = self.default.find('partials-device')
+        self.assertIn('edited by user', page['body']['storage']['value'])
+        self.assertEqual(self.default.get_values('partials-device'), {'name': 'b', 'status': 'Active'})
+        adapter = self.get_adapter()
+        self.assertEqual(adapter.page_cache.get('partials-device'), ('1', 4))
+        self.assertEqual(adapter.shadow.get('partials-device')[:2], ('1', 4))
+
+    def test_conflict_invalidates_shadow(self):
+        WikiPageUpdater(make_event(1, name='a')).update()
+        adapter = self.get_adapter()
+        page_id, document = adapter.get_page_or_create('partials-device')
+        self.assertTrue(document.is_shadow)
+        self.default.edit('partials-device', 'edited by user')
+        with self.assertRaises(PageConflictException):
+            adapter.update_page_content(page_id, 'partials-device', document)
+        self.assertIsNone(adapter.shadow.get('partials-device'))
+
+    @override_settings(DNC_PAGE_SHADOW_ENABLED=False)
+    def test_save_page_falls_back_to_update(self):
+        WikiPageUpdater(make_event(1, name='a')).update()
+        adapter = self.get_adapter()
+        page_id, document = adapter.get_page_or_create('partials-device')
+        self.assertFalse(document.is_shadow)
+        # Page is changed after it is read, so the cached version is outdated.
+        self.default.edit('partials-device', 'edited by user')
+        del self.default.calls[:]
+        adapter.update_page_content(page_id, 'partials-device', document)
+        self.assertEqual(self.default.calls, [('put', 3), ('update_existing_page', '1')])
+        self.assertEqual(adapter.page_cache.get('partials-device'), ('1', 4))
+
+    @override_settings(DNC_TARGET_ROUTES={'*': ['default', 'ops']})
+    def test_fanout(self):
+        self.assertTrue(WikiPageUpdater(make_event(1, name='a')).update())
+        for url, client in self.clients.items():
+            with self.subTest(url=url):
+                self.assertEqual(client.get_values('partials-device'), {'name': 'a', 'status': 'Active'})
+        # Target which already has the values is skipped.
+        self.clients['http://ops'].edit('partials-device', 'edited by user')
+        self.assertTrue(WikiPageUpdater(make_event(1, name='b')).update())
+        self.assertFalse(WikiPageUpdater(make_event(1, name='b')).update())
+        self.assertEqual(self.clients['http://ops'].get_values('partials-device')['name'], 'b')
+
+
+@override_settings(DNC_QUEUE_ENABLED=False)
+class AsyncConfluenceAdapterTestCase(ConfluenceClientStandInMixin, TestCase):
+    """
+    Async endpoint writes pages through the non-blocking adapter.
+    """
+
+    @staticmethod
+    async def post(body):
+        return await AsyncClient().post('/netbox-wiki-api/async/model_change_trigger/', data=json.dumps(body),
+                                        content_type='application/json', authorization='Token ')
+
+    def test_write(self):
+        # Adapters are kept for the event loop, so all requests are made in the same loop like with ASGI server.
+        async def write():
+            self.assertEqual((await self.post(make_event(1, name='a'))).status_code, 201)
+            self.assertEqual(self.default.get_values('partials-device'), {'name': 'a', 'status': 'Active'})
+            self.default.edit('partials-device', 'edited by user')
+            del self.default.calls[:]
+            self.assertEqual((await self.post(make_event(1, name='b'))).status_code, 201)
+            # Local copy was outdated, so the page is read again by id.
+            self.assertEqual(self.default.calls, [('put', 3), ('get_page_by_id', '1'), ('put', 4)])
+            self.assertEqual(self.default.get_values('partials-device'), {'name': 'b', 'status': 'Active'})
+            # Another object with the same values doesn't change the shared page.
+            self.assertEqual((await self.post(make_event(2, name='b'))).json()['result'], 'skipped')
+
+        async_to_sync(write)()
+
+    @override_settings(DNC_TARGET_ROUTES={'*': ['default', 'ops']})
+    def test_fanout(self):
+        self.assertEqual(async_to_sync(self.post)(make_event(1, name='a')).status_code, 201)
+        for url, client in self.clients.items():
+            with self.subTest(url=url):
+                self.assertEqual(client.get_values('partials-device'), {'name': 'a', 'status': 'Active'})
+
+    def test_space_is_checked_once(self):
+        async def check():
+            adapter = AsyncConfluenceAdapter.get_shared(targets.get_target('default'))
+            await asyncio.gather(*[adapter.ensure_space() for _ in range(3)])
+
+        async_to_sync(check)()
+        self.assertEqual(self.default.calls, [('get_space', 'NETBOX')])
+
+    def test_adapters_of_closed_loops_are_dropped(self):
+        async def get_adapters():
+            AsyncConfluenceAdapter.get_shared(targets.get_target('default'))
+            return list(AsyncConfluenceAdapter.shared_adapters.items())
+
+        for _ in range(3):
+            # Each call runs in a new event loop which is closed afterwards.
+            self.assertEqual(len(async_to_sync(get_adapters)()), 1)
+
+    @override_settings(DNC_CONFLUENCE_CONCURRENCY=2)
+    def test_semaphores_of_closed_loops_are_dropped(self):
+        target = targets.get_target('default')
+
+        async def get_semaphores():
+            target.get_async_semaphore()
+            return list(target.async_semaphores.items())
+
+        for _ in range(3):
+            self.assertEqual(len(async_to_sync(get_semaphores)()), 1)
+
+
+class FieldPlansTestCase(ConfluenceTestCase):
+    """
+    Cached field plans are dropped when fields configuration is changed by this or another process.
+    """
+
+    def get_field_names(self, model_name='device'):
+        return sorted(plan.field_name for plan in field_plans.get_field_plans(model_name))
+
+    def test_save_and_delete(self):
+        self.assertEqual(self.get_field_names(), ['name', 'status'])
+        self.assertFalse(field_plans.is_configured('rack'))
+        field = NetBoxConfluenceField.objects.create(model_name='device', field_name='serial',
+                                                     field_type='TextLinkedField')
+        NetBoxConfluenceField.objects.create(model_name='rack', field_name='name', field_type='TextLinkedField')
+        self.assertEqual(self.get_field_names(), ['name', 'serial', 'status'])
+        self.assertTrue(field_plans.is_configured('rack'))
+
+        field.field_name = 'asset_tag'
+        field.save()
+        self.assertEqual(self.get_field_names(), ['asset_tag', 'name', 'status'])
+        field.delete()
+        self.assertEqual(self.get_field_names(), ['name', 'status'])
+
+    def test_plans_are_cached(self):
+        self.assertEqual(self.get_field_names(), ['name', 'status'])
+        # Queryset update doesn't send signals, like a change made by another process.
+        NetBoxConfluenceField.objects.filter(field_name='name').update(field_name='label')
+        self.assertEqual(self.get_field_names(), ['name', 'status'])
+        field_plans.invalidate()
+        self.assertEqual(self.get_field_names(), ['label', 'status'])
+
+    @override_settings(DNC_FIELD_CACHE_BACKEND='default')
+    def test_shared_version(self):
+        shared_cache = field_plans.get_shared_cache()
+        self.addCleanup(shared_cache.delete, field_plans.VERSION_KEY)
+        # Saved field publishes new version of the configuration to other processes.
+        field = NetBoxConfluenceField.objects.create(model_name='device', field_name='serial',
+                                                     field_type='TextLinkedField')
+        version = shared_cache.get(field_plans.VERSION_KEY)
+        self.assertIsNotNone(version)
+        self.assertEqual(self.get_field_names(), ['name', 'serial', 'status'])
+
+        # Another process changes the configuration, this process only sees the new version.
+        NetBoxConfluenceField.objects.filter(field_name='name').update(field_name='label')
+        self.assertEqual(self.get_field_names(), ['name', 'serial', 'status'])
+        shared_cache.set(field_plans.VERSION_KEY, uuid.uuid4().hex, None)
+        self.assertEqual(self.get_field_names(), ['label', 'serial', 'status'])
+
+        version = shared_cache.get(field_plans.VERSION_KEY)
+        field.delete()
+        self.assertNotEqual(shared_cache.get(field_plans.VERSION_KEY), version)
+        self.assertEqual(self.get_field_names(), ['label', 'status'])
+
+
+class MetricsTestCase(ConfluenceTestCase):
+    """
+    Metrics of the process are rendered in Prometheus text format.
+    """
+
+    def post(self, body):
+        return self.client.post('/netbox-wiki-api/model_change_trigger/', data=json.dumps(body),
+                                content_type='application/json', HTTP_AUTHORIZATION='Token ')
+
+    def get_sample(self, text, series):
+        """
+        Get value of the series from the metrics text, 0 if there is no such series.
+        """
+        for line in text.splitlines():
+            if line.startswith(series + ' '):
+                return float(line.rpartition(' ')[2])
+        return 0
+
+    def test_metrics(self):
+        series = ('dnc_webhook_duration_seconds_count{outcome="ok",status="202",view="ModelChangeTriggerView"}',
+                  'dnc_webhooks_dropped_total{model="rack"}')
+        before = self.client.get('/netbox-wiki-api/metrics/').content.decode('utf-8')
+        self.assertEqual(self.post(make_event(1)).status_code, 202)
+        self.assertEqual(self.post(make_event(1, model='rack')).status_code, 204)
+
+        response = self.client.get('/netbox-wiki-api/metrics/')
+        self.assertEqual((response.status_code, response['Content-Type']),
+                         (200, 'text/plain; version=0.0.4; charset=utf-8'))
+        text = response.content.decode('utf-8')
+        self.assertIn('# TYPE dnc_webhook_duration_seconds histogram\n', text)
+        self.assertIn('# TYPE dnc_webhooks_dropped_total counter\n', text)
+        for name in series:
+            with self.subTest(series=name):
+                self.assertEqual(self.get_sample(text, name) - self.get_sample(before, name), 1)
+
+    @override_settings(DNC_METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get('/netbox-wiki-api/metrics/').status_code, 401)
+        self.assertEqual(self.client.get('/netbox-wiki-api/metrics/', HTTP_AUTHORIZATION='Token wrong').status_code,
+                         401)
+        self.assertEqual(self.client.get('/netbox-wiki-api/metrics/', HTTP_AUTHORIZATION='Token secret').status_code,
+                         200)
+
+    @override_settings(DNC_METRICS_ENABLED=False)
+    def test_disabled(self):
+        self.assertEqual(self.client.get('/netbox-wiki-api/metrics/').status_code, 404)
+
+    @override_settings(DNC_METRICS_TOKEN='secret')
+    def test_worker_server(self):
+        server = metrics.serve(0, '127.0.0.1')
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        url = 'http://127.0.0.1:{}/metrics'.format(server.server_address[1])
+        with self.assertRaises(HTTPError) as error:
+            urlopen(url, timeout=5)
+        self.assertEqual(error.exception.code, 401)
+        with urlopen(Request(url, headers={'Authorization': 'Token secret'}), timeout=5) as response:
+            self.assertEqual(response.read().decode('utf-8'), metrics.render_prometheus())
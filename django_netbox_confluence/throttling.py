@@ -0,0 +1,143 @@
+import time
+import threading
+
+
+class TokenBucket(object):
+    """
+    Token bucket rate limiter shared by threads.
+    Tokens are refilled with constant rate up to the capacity, each call takes one token.
+    """
+
+    def __init__(self, rate, capacity=None):
+        """
+        Init.
+
+        :type rate: float
+        :param rate: Tokens added per second. Zero or None means no limit.
+
+        :type capacity: float|None
+        :param capacity: Maximum number of tokens(burst size). Defaults to the rate, but at least one.
+        """
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate or 0)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def refill(self):
+        """
+        Add tokens for the time passed since the last refill. Should be called under the lock.
+
+        :rtype: void
+        :returns: void
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self):
+        """
+        Take a token if there is one.
+
+        :rtype: float
+        :returns: Zero if the token is taken, otherwise seconds until the next token is available.
+        """
+        if not self.rate:
+            return 0
+        with self.lock:
+            self.refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """
+        Take a token, wait for it if there is none.
+
+        :rtype: void
+        :returns: void
+        """
+        while True:
+            wait = self.try_acquire()
+            if not wait:
+                return
+            time.sleep(wait)
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    """
+    Token bucket which slows down when the remote side reports throttling and speeds up back while calls succeed.
+    Rate is halved on each throttled call and increased by 1/20 of the configured rate on each successful one
+    (additive increase, multiplicative decrease). Bucket can also be blocked for a time, e.g. for Retry-After.
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=None):
+        """
+        Init.
+
+        :type rate: float
+        :param rate: Maximum tokens added per second. Zero or None means no limit.
+
+        :type capacity: float|None
+        :param capacity: Maximum number of tokens(burst size). Defaults to the rate, but at least one.
+
+        :type min_rate: float|None
+        :param min_rate: Rate is never decreased below this value. Defaults to 1/10 of the rate.
+        """
+        super().__init__(rate, capacity)
+        self.max_rate = rate
+        self.min_rate = min_rate if min_rate is not None else (rate or 0) / 10
+        self.blocked_until = 0
+
+    def try_acquire(self):
+        """
+        Take a token if there is one and the bucket isn't blocked.
+
+        :rtype: float
+        :returns: Zero if the token is taken, otherwise seconds until the next token is available.
+        """
+        with self.lock:
+            blocked = self.blocked_until - time.monotonic()
+        if blocked > 0:
+            return blocked
+        return super().try_acquire()
+
+    def block(self, seconds):
+        """
+        Don't give tokens for the given time.
+
+        :type seconds: float
+        :param seconds: Time to block for.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def decrease(self):
+        """
+        Halve the rate after a throttled call.
+
+        :rtype: void
+        :returns: void
+        """
+        if not self.max_rate:
+            return
+        with self.lock:
+            self.refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+
+    def increase(self):
+        """
+        Raise the rate back towards the configured one after a successful call.
+
+        :rtype: void
+        :returns: void
+        """
+        if not self.max_rate or self.rate >= self.max_rate:
+            return
+        with self.lock:
+            self.refill()
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
@@ -0,0 +1,335 @@
+import asyncio
+import threading
+import time
+import weakref
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache.backends.locmem import LocMemCache
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.updater.confluence_adapter import ConfluenceAdapter
+from django_netbox_confluence.updater.exceptioins import PageConflictException, WikiUpdateException
+from django_netbox_confluence.updater.page_cache import PageCache
+from django_netbox_confluence.updater.page_shadow import PageShadowStore
+from django_netbox_confluence.updater.resilience import ConfluenceGuard
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class AsyncConfluenceAdapter(object):
+    """
+    Non-blocking counterpart of ConfluenceAdapter built on `httpx`.
+    Has the same page fetch, patch and save semantics, content is parsed and patched by ConfluenceAdapter methods.
+    """
+
+    # Adapters shared within the process. Mapping of event loop to mapping of target name to adapter, as the client
+    # can't be used by several event loops. Adapters of closed loops are dropped.
+    shared_adapters = weakref.WeakKeyDictionary()
+    shared_adapters_lock = threading.Lock()
+
+    def __init__(self, url, username, password, space_key, pool_size=10, timeout=60, guard=None,
+                 cache_namespace=None):
+        if httpx is None:
+            raise WikiUpdateException("`httpx` package is required for async webhook handling. "
+                                      "Please install it: `pip install httpx`.")
+        self.client = httpx.AsyncClient(base_url=url.rstrip('/') + '/',
+                                        auth=(username, password),
+                                        timeout=timeout,
+                                        limits=httpx.Limits(max_connections=pool_size,
+                                                            max_keepalive_connections=pool_size),
+                                        headers={'Accept': 'application/json'})
+        self.guard = guard
+        self.space_key = space_key
+        self.space_checked_at = None
+        # Adapter is used by a single event loop, so the lock is never shared by loops.
+        self.space_lock = asyncio.Lock()
+        self.page_cache = PageCache(cache_namespace or space_key,
+                                    backend_alias=getattr(settings, 'DNC_PAGE_CACHE_BACKEND', None),
+                                    timeout=getattr(settings, 'DNC_PAGE_CACHE_TIMEOUT', None))
+        self.shadow = PageShadowStore.from_settings(cache_namespace or space_key)
+
+    @classmethod
+    def get_shared(cls, target):
+        """
+        Get adapter of the target shared within the process for the running event loop, create it on first call.
+        The guard is shared with the sync adapter of the target. Should be called in the event loop.
+
+        :type target: ConfluenceTarget
+        :param target: Confluence target.
+
+        :rtype: AsyncConfluenceAdapter
+        :returns: Adapter for the target Confluence space.
+        """
+        loop = asyncio.get_running_loop()
+        with cls.shared_adapters_lock:
+            # Loops of `async_to_sync` calls are closed after the call. Their adapters can't be used anymore and
+            # may keep the loop alive by references to it, so they are dropped explicitly.
+            for closed_loop in [other for other in cls.shared_adapters if other.is_closed()]:
+                del cls.shared_adapters[closed_loop]
+            adapters = cls.shared_adapters.setdefault(loop, dict())
+            if target.name not in adapters:
+                adapters[target.name] = cls(target.url, target.username, target.password, target.space_key,
+                                            pool_size=target.pool_size, timeout=target.timeout,
+                                            guard=ConfluenceGuard.get_shared(target),
+                                            cache_namespace=target.cache_namespace)
+            return adapters[target.name]
+
+    @staticmethod
+    async def call_store(method, *args):
+        """
+        Call method of the page cache or the shadow store. Shared Django cache backends(memcached, redis, database) make
+        blocking calls, so they are run in a thread. Process memory and local memory cache are called directly.
+
+        :type method: callable
+        :param method: Bound method of PageCache or PageShadowStore.
+
+        :param args: Arguments of the method.
+
+        :returns: Result of the method.
+        """
+        backend = method.__self__.backend
+        if backend is None or isinstance(backend, LocMemCache):
+            return method(*args)
+        return await sync_to_async(method)(*args)
+
+    async def request(self, method, path, params=None, data=None):
+        """
+        Make request to Confluence REST API.
+
+        :type method: str
+        :param method: HTTP method.
+
+        :type path: str
+        :param path: Path relative to Confluence url.
+
+        :type params: dict|None
+        :param params: Query parameters.
+
+        :type data: dict|None
+        :param data: JSON body.
+
+        :raises: WikiUpdateException, ConfluenceUnavailableException
+
+        :rtype: tuple(int, dict|None)
+        :returns: Status code and response data.
+        """
+        try:
+            if self.guard is None:
+                response = await self.client.request(method, path, params=params, json=data)
+            else:
+                response = await self.guard.acall(lambda: self.client.request(method, path, params=params, json=data),
+                                                  method, (httpx.TransportError,))
+        except httpx.HTTPError as e:
+            raise WikiUpdateException("Confluence request `{} {}` failed: {}".format(method, path, e))
+
+        try:
+            return response.status_code, response.json() if response.content else None
+        except ValueError:
+            return response.status_code, None
+
+    async def ensure_space(self):
+        """
+        Make sure the space exists. Confluence is asked only once per `DNC_SPACE_CACHE_TTL` seconds(once per process
+        if the setting is None).
+
+        :rtype: void
+        :returns: void
+        """
+        ttl = getattr(settings, 'DNC_SPACE_CACHE_TTL', 3600)
+        async with self.space_lock:
+            if self.space_checked_at is not None and (ttl is None or time.monotonic() - self.space_checked_at < ttl):
+                return
+            await self.get_space_or_create()
+            self.space_checked_at = time.monotonic()
+
+    async def get_space_or_create(self):
+        """
+        Check whether space exists or not. If it doesn't, then create the space.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :return: Space data.
+        """
+        status, space = await self.request('GET', 'rest/api/space/{}'.format(self.space_key))
+        if status == 404:
+            status, space = await self.request('POST', 'rest/api/space', data={'key': self.space_key,
+                                                                               'name': self.space_key})
+        if type(space) is not dict or status >= 400:
+            raise WikiUpdateException("Can't retrieve valid information about Confluence space."
+                                      " Please check configurations. Data: {}".format(space))
+        return space
+
+    async def get_page_or_create(self, page_title):
+        """
+        Get page content, if no such page then create it. Fresh local copy of the page is used instead of reading it.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be retrieved.
+
+        :raises: WikiUpdateException
+
+        :rtype: tuple(int, PageDocument)
+        :returns: Tuple where first element is the id of the page. The second is the parsed content data.
+        """
+        await self.ensure_space()
+        if self.shadow is not None:
+            shadow = await self.call_store(self.shadow.get, page_title)
+            metrics.increment('dnc_page_shadow_total', result='hit' if shadow is not None else 'miss')
+            if shadow is not None:
+                page_id, version, content_xml = shadow
+                document = ConfluenceAdapter.parse_storage(content_xml)
+                document.version = version
+                document.is_shadow = True
+                return page_id, document
+
+        data = await self.get_page_data(page_title)
+        document = ConfluenceAdapter.parse_page(data)
+        document.version = data.get('version', {}).get('number')
+        if self.shadow is not None:
+            await self.call_store(self.shadow.set, page_title, data['id'], document.version,
+                                  data['body']['storage']['value'])
+        return data['id'], document
+
+    async def get_page_data(self, page_title):
+        """
+        Get page data with body and version. The page is fetched by cached id when it is known, otherwise it is
+        searched by title and created if there is no such page.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be retrieved.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :returns: Page data.
+        """
+        data = None
+        cached = await self.call_store(self.page_cache.get, page_title)
+        if cached is not None:
+            status, data = await self.request('GET', 'rest/api/content/{}'.format(cached[0]),
+                                              params={'expand': 'body.storage,version'})
+            if status != 200 or type(data) is not dict or data.get('title') != page_title:
+                # Page was deleted(404) or renamed.
+                await self.call_store(self.page_cache.invalidate, page_title)
+                data = None
+
+        if data is None:
+            status, found = await self.request('GET', 'rest/api/content', params={
+                'spaceKey': self.space_key,
+                'title': page_title,
+                'expand': 'body.storage,version',
+                'limit': 1,
+            })
+            results = found.get('results') if status == 200 and type(found) is dict else None
+            data = results[0] if results else None
+
+        if data is None:
+            # No such page exist. Then create such page.
+            data = await self.create_page(page_title)
+
+        await self.call_store(self.page_cache.set, page_title, data['id'], data.get('version', {}).get('number'))
+        return data
+
+    async def create_page(self, page_title):
+        """
+        Create new page.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be created.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :return: Data of newly created page.
+        """
+        status, data = await self.request('POST', 'rest/api/content/', data={
+            'type': 'page',
+            'title': page_title,
+            'space': {'key': self.space_key},
+            'body': {'storage': {'value': '', 'representation': 'storage'}},
+        })
+        if type(data) is not dict or 'id' not in data:
+            raise WikiUpdateException("Page `{}` could not be created. Response data: {}".format(page_title, data))
+        return data
+
+    async def update_page_content(self, page_id, page_title, body):
+        """
+        Update existing page with new body.
+
+        :type page_id: int
+        :param page_id: Page id which should be modified.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be modified.
+
+        :type body: PageDocument
+        :param body: Page content data.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :returns: Data of newly updated page.
+        """
+        content_xml = ConfluenceAdapter.serialize_page(body)
+
+        data = None
+        cached = await self.call_store(self.page_cache.get, page_title)
+        if body.is_shadow:
+            # The copy may be outdated, so the page is saved only if nobody has changed it since.
+            status, data = await self.request('PUT', 'rest/api/content/{}'.format(page_id),
+                                              data=ConfluenceAdapter.make_page_update(page_id, page_title,
+                                                                                      content_xml, body.version + 1))
+            if type(data) is not dict or 'id' not in data:
+                metrics.increment('dnc_page_shadow_total', result='conflict')
+                # Page id is still known, so the page is read again by id.
+                await self.call_store(self.shadow.invalidate, page_title)
+                raise PageConflictException("Page `{}` was changed since version {}. Response data: {}".format(
+                    page_title, body.version, data))
+        elif cached is not None and cached[0] == page_id and cached[1] is not None:
+            # Version is known, so the page is saved right away without asking its history.
+            status, data = await self.request('PUT', 'rest/api/content/{}'.format(page_id),
+                                              data=ConfluenceAdapter.make_page_update(page_id, page_title,
+                                                                                      content_xml, cached[1] + 1))
+            if type(data) is not dict or 'id' not in data:
+                # Version conflict or the page is gone.
+                await self.call_store(self.page_cache.invalidate, page_title)
+                data = None
+
+        if data is None:
+            status, history = await self.request('GET', 'rest/api/content/{}/history'.format(page_id))
+            try:
+                version = history['lastUpdated']['number']
+            except (KeyError, TypeError):
+                raise WikiUpdateException("Page `{}` could not be updated. Response data: {}".format(page_title,
+                                                                                                     history))
+            status, data = await self.request('PUT', 'rest/api/content/{}'.format(page_id),
+                                              data=ConfluenceAdapter.make_page_update(page_id, page_title,
+                                                                                      content_xml, version + 1))
+        if type(data) is not dict or 'id' not in data:
+            await self.forget_page(page_title)
+            raise WikiUpdateException("Page `{}` could not be updated. Response data: {}".format(page_title, data))
+
+        await self.call_store(self.page_cache.set, page_title, data['id'], data.get('version', {}).get('number'))
+        if self.shadow is not None:
+            await self.call_store(self.shadow.set, page_title, data['id'], data.get('version', {}).get('number'),
+                                  content_xml)
+        return data
+
+    async def forget_page(self, page_title):
+        """
+        Forget cached id, version and local copy of the page, so it is read from Confluence next time.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        await self.call_store(self.page_cache.invalidate, page_title)
+        if self.shadow is not None:
+            await self.call_store(self.shadow.invalidate, page_title)
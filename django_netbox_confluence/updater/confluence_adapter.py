@@ -1,10 +1,19 @@
+import time
 import uuid
+import threading
 
-from lxml import etree
+import requests
 from atlassian import Confluence
+from django.conf import settings
+from requests.adapters import HTTPAdapter
 
-from django_netbox_confluence.updater.exceptioins import WikiUpdateException
-from django.template.loader import render_to_string
+from django_netbox_confluence import metrics
+from django_netbox_confluence.updater.exceptioins import PageConflictException, WikiUpdateException
+from django_netbox_confluence.updater.page_cache import PageCache
+from django_netbox_confluence.updater.page_document import PageDocument
+from django_netbox_confluence.updater.page_shadow import PageShadowStore
+from django_netbox_confluence.updater.resilience import ConfluenceGuard, ResilientSession
+from django_netbox_confluence.updater.storage_codec import StorageCodec
 
 
 class ConfluenceAdapter(object):
@@ -20,10 +29,75 @@ class ConfluenceAdapter(object):
         "at": "http://atlassian.com/template",
     }
 
-    def __init__(self, url, username, password, space_key):
-        self.confluence = Confluence(url=url, username=username, password=password)
+    # Adapters shared by all threads of the process. Keyed by target name.
+    shared_adapters = dict()
+    shared_adapters_lock = threading.Lock()
+
+    def __init__(self, url, username, password, space_key, session=None, timeout=60, cache_namespace=None):
+        self.confluence = Confluence(url=url, username=username, password=password, session=session, timeout=timeout)
         self.space_key = space_key
-        self.get_space_or_create()
+        self.space_checked_at = None
+        self.space_lock = threading.Lock()
+        self.page_cache = PageCache(cache_namespace or space_key,
+                                    backend_alias=getattr(settings, 'DNC_PAGE_CACHE_BACKEND', None),
+                                    timeout=getattr(settings, 'DNC_PAGE_CACHE_TIMEOUT', None))
+        self.shadow = PageShadowStore.from_settings(cache_namespace or space_key)
+        self.ensure_space()
+
+    @classmethod
+    def get_shared(cls, target):
+        """
+        Get adapter of the target shared within the process, create it on first call.
+        Shared adapter keeps keep-alive connections in its pool, so connections are reused between webhooks.
+
+        :type target: ConfluenceTarget
+        :param target: Confluence target.
+
+        :rtype: ConfluenceAdapter
+        :returns: Adapter for the target Confluence space.
+        """
+        with cls.shared_adapters_lock:
+            if target.name not in cls.shared_adapters:
+                session = cls.create_session(target.pool_size, guard=ConfluenceGuard.get_shared(target))
+                cls.shared_adapters[target.name] = cls(target.url, target.username, target.password, target.space_key,
+                                                       session=session, timeout=target.timeout,
+                                                       cache_namespace=target.cache_namespace)
+            return cls.shared_adapters[target.name]
+
+    @staticmethod
+    def create_session(pool_size, guard=None):
+        """
+        Create HTTP session with connection pool of the given size.
+
+        :type pool_size: int
+        :param pool_size: Maximum number of kept connections per host.
+
+        :type guard: ConfluenceGuard|None
+        :param guard: Rate limiter, retries and circuit breaker applied to all requests of the session.
+
+        :rtype: requests.Session
+        :return: Session object.
+        """
+        session = ResilientSession(guard) if guard is not None else requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def ensure_space(self):
+        """
+        Make sure the space exists. Confluence is asked only once per `DNC_SPACE_CACHE_TTL` seconds(once per process
+        if the setting is None).
+
+        :rtype: void
+        :returns: void
+        """
+        ttl = getattr(settings, 'DNC_SPACE_CACHE_TTL', 3600)
+        with self.space_lock:
+            if self.space_checked_at is not None and (ttl is None or time.monotonic() - self.space_checked_at < ttl):
+                return
+            self.get_space_or_create()
+            self.space_checked_at = time.monotonic()
 
     def get_space_or_create(self):
         """
@@ -43,32 +117,212 @@ class ConfluenceAdapter(object):
 
     def get_page_or_create(self, page_title):
         """
-        Get page content, if no such page then create it.
+        Get page content, if no such page then create it. Fresh local copy of the page is used instead of reading it.
 
         :type page_title: str
         :param page_title: Title of the page which should be retrieved.
 
         :raises: WikiUpdateException
 
-        :rtype: tuple(int, lxml.etree._Element)
+        :rtype: tuple(int, PageDocument)
         :returns: Tuple where first element is the id of the page. The second is the parsed content data.
         """
-        data = self.confluence.get_page_by_title(title=page_title,
-                                                 space=self.space_key,
-                                                 expand="body.storage,version")
-        if not data:
-            # No such page exist. Then create such page.
-            data = self.create_page(page_title)
+        self.ensure_space()
+        shadow = self.get_shadow(page_title)
+        if shadow is not None:
+            return shadow
+        data = self.get_page_data(page_title)
+        return data['id'], self.read_page(page_title, data)
+
+    def get_shadow(self, page_title):
+        """
+        Get fresh local copy of the page.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :raises: WikiUpdateException
+
+        :rtype: tuple(str, PageDocument)|None
+        :returns: Page id and parsed content or None if there is no fresh copy.
+        """
+        if self.shadow is None:
+            return None
+        shadow = self.shadow.get(page_title)
+        metrics.increment('dnc_page_shadow_total', result='hit' if shadow is not None else 'miss')
+        if shadow is None:
+            return None
+        page_id, version, content_xml = shadow
+        document = self.parse_storage(content_xml)
+        document.version = version
+        document.is_shadow = True
+        return page_id, document
+
+    def read_page(self, page_title, data):
+        """
+        Parse page data read from Confluence and keep its local copy.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :type data: dict
+        :param data: Page data with `body.storage` and `version` expanded.
+
+        :raises: WikiUpdateException
+
+        :rtype: PageDocument
+        :returns: Parsed content data.
+        """
+        document = self.parse_page(data)
+        document.version = data.get('version', {}).get('number')
+        if self.shadow is not None:
+            self.shadow.set(page_title, data['id'], document.version, data['body']['storage']['value'])
+        return document
 
+    @classmethod
+    def parse_page(cls, data):
+        """
+        Parse storage format body of the page.
+
+        :type data: dict
+        :param data: Page data with `body.storage` expanded.
+
+        :raises: WikiUpdateException
+
+        :rtype: PageDocument
+        :returns: Parsed content data.
+        """
         try:
             content_xml = data['body']['storage']['value']
         except KeyError:
             raise WikiUpdateException("Can't get partial-devices page content.")
+        return cls.parse_storage(content_xml)
 
-        body_xml = render_to_string('wrapper.xml', {
-            'content': content_xml
-        })
-        return data['id'], etree.fromstring(body_xml)
+    @classmethod
+    def parse_storage(cls, content_xml):
+        """
+        Parse storage format body.
+
+        :type content_xml: str
+        :param content_xml: Storage format body.
+
+        :rtype: PageDocument
+        :returns: Parsed content data.
+        """
+        with metrics.timer('dnc_stage_duration_seconds', stage='page_parse'):
+            return PageDocument(StorageCodec.parse(content_xml))
+
+    @classmethod
+    def serialize_page(cls, body):
+        """
+        Serialize page content back to storage format.
+
+        :type body: PageDocument
+        :param body: Page content data.
+
+        :rtype: str
+        :returns: Storage format body.
+        """
+        with metrics.timer('dnc_stage_duration_seconds', stage='serialize'):
+            return StorageCodec.serialize(body.root)
+
+    @staticmethod
+    def make_page_update(page_id, page_title, content_xml, version):
+        """
+        Make request body of page update.
+
+        :type page_id: str
+        :param page_id: Page id which should be modified.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be modified.
+
+        :type content_xml: str
+        :param content_xml: Storage format body.
+
+        :type version: int
+        :param version: New version number of the page.
+
+        :rtype: dict
+        :returns: Request body.
+        """
+        return {
+            'id': page_id,
+            'type': 'page',
+            'title': page_title,
+            'body': {'storage': {'value': content_xml, 'representation': 'storage'}},
+            'version': {'number': version, 'minorEdit': False},
+        }
+
+    def get_page_data(self, page_title):
+        """
+        Get page data with body and version. The page is fetched by cached id when it is known, otherwise it is
+        searched by title and created if there is no such page.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be retrieved.
+
+        :raises: WikiUpdateException
+
+        :rtype: dict
+        :returns: Page data.
+        """
+        data = None
+        cached = self.page_cache.get(page_title)
+        if cached is not None:
+            data = self.confluence.get_page_by_id(cached[0], expand="body.storage,version")
+            if type(data) is not dict or 'id' not in data or data.get('title') != page_title:
+                # Page was deleted(404) or renamed.
+                self.page_cache.invalidate(page_title)
+                data = None
+
+        if data is None:
+            data = self.confluence.get_page_by_title(title=page_title,
+                                                     space=self.space_key,
+                                                     expand="body.storage,version")
+        if not data:
+            # No such page exist. Then create such page.
+            data = self.create_page(page_title)
+
+        self.page_cache.set(page_title, data['id'], data.get('version', {}).get('number'))
+        return data
+
+    def iter_pages(self, limit=100):
+        """
+        Iterate over all pages of the space using paginated space listing. Pages come without body.
+
+        :type limit: int
+        :param limit: Page size of the listing.
+
+        :rtype: generator
+        :returns: Page data with version expanded.
+        """
+        self.ensure_space()
+        start = 0
+        while True:
+            pages = self.confluence.get_all_pages_from_space(self.space_key, start=start, limit=limit,
+                                                             expand="version") or []
+            for page in pages:
+                yield page
+            start += len(pages)
+            if len(pages) < limit:
+                return
+
+    def warm_page_cache(self, limit=100):
+        """
+        Fill page cache with all pages of the space.
+
+        :type limit: int
+        :param limit: Page size of the listing.
+
+        :rtype: int
+        :returns: Number of cached pages.
+        """
+        count = 0
+        for page in self.iter_pages(limit=limit):
+            self.page_cache.set(page['title'], page['id'], page.get('version', {}).get('number'))
+            count += 1
+        return count
 
     def create_page(self, page_title):
         """
@@ -97,7 +351,7 @@ class ConfluenceAdapter(object):
         :type page_title: str
         :param page_title: Title of the page which should be modified.
 
-        :type body: lxml.etree._Element
+        :type body: PageDocument
         :param body: Page content data.
 
         :raises: WikiUpdateException
@@ -105,61 +359,162 @@ class ConfluenceAdapter(object):
         :rtype: dict
         :returns: Data of newly updated page.
         """
-        # Get raw xml.
-        body_xml = etree.tostring(body).decode('utf-8')
+        content_xml = self.serialize_page(body)
+
+        if body.is_shadow:
+            # The copy may be outdated, so the page is saved only if nobody has changed it since.
+            data = self.confluence.put('rest/api/content/{}'.format(page_id),
+                                       data=self.make_page_update(page_id, page_title, content_xml, body.version + 1))
+            if not data or 'id' not in data:
+                metrics.increment('dnc_page_shadow_total', result='conflict')
+                # Page id is still known, so the page is read again by id.
+                self.shadow.invalidate(page_title)
+                raise PageConflictException("Page `{}` was changed since version {}. Response data: {}".format(
+                    page_title, body.version, data))
+        else:
+            data = self.save_page(page_id, page_title, content_xml)
+
+        self.page_cache.set(page_title, data['id'], data.get('version', {}).get('number'))
+        if self.shadow is not None:
+            self.shadow.set(page_title, data['id'], data.get('version', {}).get('number'), content_xml)
+        return data
+
+    def save_page(self, page_id, page_title, content_xml):
+        """
+        Save page read from Confluence.
+
+        :type page_id: int
+        :param page_id: Page id which should be modified.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be modified.
+
+        :type content_xml: str
+        :param content_xml: Storage format body.
 
-        # <xml xmlns:******> <p></p>***<ac:structured-macro>***</ac:structured-macro> </xml>
-        #                  ^                                                        ^
-        # Take the content starting right after `>` of the opening xml tag and till `<` of xml closing tag.
-        content_xml = body_xml[body_xml.find('>') + 1:body_xml.rfind('<')]
+        :raises: WikiUpdateException
 
-        data = self.confluence.update_existing_page(page_id, page_title, content_xml)
+        :rtype: dict
+        :returns: Data of newly updated page.
+        """
+        data = None
+        cached = self.page_cache.get(page_title)
+        if cached is not None and cached[0] == page_id and cached[1] is not None:
+            # Version is known, so the page is saved right away without asking its history.
+            data = self.confluence.put('rest/api/content/{}'.format(page_id),
+                                       data=self.make_page_update(page_id, page_title, content_xml, cached[1] + 1))
+            if not data or 'id' not in data:
+                # Version conflict or the page is gone.
+                self.page_cache.invalidate(page_title)
+                data = None
+
+        if data is None:
+            data = self.confluence.update_existing_page(page_id, page_title, content_xml)
         if not data or 'id' not in data:
+            self.forget_page(page_title)
             raise WikiUpdateException("Page `{}` could not be updated. Response data: {}".format(page_title, data))
         return data
 
+    def forget_page(self, page_title):
+        """
+        Forget cached id, version and local copy of the page, so it is read from Confluence next time.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        self.page_cache.invalidate(page_title)
+        if self.shadow is not None:
+            self.shadow.invalidate(page_title)
+
+    def delete_page(self, page_id, page_title):
+        """
+        Delete the page(move it to the trash of the space).
+
+        :type page_id: str
+        :param page_id: Page id which should be deleted.
+
+        :type page_title: str
+        :param page_title: Title of the page which should be deleted.
+
+        :raises: WikiUpdateException
+
+        :rtype: void
+        :returns: void
+        """
+        self.forget_page(page_title)
+        data = self.confluence.remove_page(page_id)
+        if type(data) is dict and data.get('statusCode', 200) >= 400:
+            raise WikiUpdateException("Page `{}` could not be deleted. Response data: {}".format(page_title, data))
+
     @classmethod
-    def get_field_element(cls, element, field):
+    def get_field_element(cls, page_content, field):
         """
-        Get element from tree by field name.
+        Get elements which hold the value of the field.
 
-        :rtype: lxml.etree._Element
-        :returns: Element data.
+        :type page_content: PageDocument
+        :param page_content: Wiki page content.
+
+        :type field: AbstractLinkedField
+        :param field: Field which elements should be found.
+
+        :rtype: list
+        :returns: List of `p` elements of the field MultiExcerpt macros.
+        """
+        return page_content.get_paragraphs(field.excerpt_name)
+
+    @classmethod
+    def is_field_up_to_date(cls, page_content, field):
+        """
+        Check whether the page already contains the value of the field.
+
+        :type page_content: PageDocument
+        :param page_content: Wiki page content.
+
+        :type field: AbstractLinkedField
+        :param field: Field which should be checked.
+
+        :rtype: bool
+        :returns: True if the field exists on the page and all its elements hold the field value.
         """
-        return element.xpath('//ac:structured-macro/ac:parameter'
-                             '[@ac:name="MultiExcerptName" and translate(normalize-space(text()), " ", "")="{}"]'
-                                '/following-sibling::ac:rich-text-body/*[local-name()="p"]'.format(field.name),
-                             namespaces=cls.NAMESPACES)
+        field_elements = cls.get_field_element(page_content, field)
+        if not field_elements:
+            return False
+
+        value = field.get_value()
+        value = '' if value is None else str(value)
+        return all((field_element.text or '') == value for field_element in field_elements)
 
     @classmethod
     def update_content_for_field(cls, page_content, field):
         """
         Update content for field.
 
-        :type page_content: lxml.etree._Element
+        :type page_content: PageDocument
         :param page_content: Wiki page content.
 
         :type field: AbstractLinkedField
         :param field: Field for which the page_content should be updated.
 
-        :rtype: lxml.etree._Element
+        :rtype: PageDocument
         :returns: Page content data.
         """
         field_elements = cls.get_field_element(page_content, field)
         if not field_elements:
             # If element does not exist then create it.
-            macro_id = uuid.uuid4()
-            data = render_to_string('multiexcerpt.xml', {
-                "macro_id": macro_id,
-                "field_name": field.name,
-                "field_value": field.provide_value()
-            })
-            element = etree.fromstring(data)
-            page_content.insert(-1, element)
+            with metrics.timer('dnc_stage_duration_seconds', stage='render'):
+                element = StorageCodec.make_excerpt_macro(uuid.uuid4(), field.excerpt_name,
+                                                           field.get_value())
+            page_content.add_macro(element)
             # Can leave without this return, but `Explicit is better than implicit.` (C) Python Zen.
             return page_content
 
+        # Values are compared as text by `is_field_up_to_date`, and lxml accepts text only.
+        value = field.get_value()
+        value = None if value is None else str(value)
         for field_element in field_elements:
-            field_element.text = field.provide_value()
+            field_element.text = value
 
         return page_content
@@ -8,3 +8,31 @@ class WikiUpdateException(DjangoNetboxConfluenceException):
     """
     Exception class for WikiPageUpdater exceptions.
     """
+
+
+class ConfluenceUnavailableException(WikiUpdateException):
+    """
+    Confluence can't take requests now: it is throttling, down or the circuit breaker is open.
+    The same update may succeed later.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class PageConflictException(WikiUpdateException):
+    """
+    Page was saved based on its local copy, but it has been changed in Confluence since then.
+    The page should be read from Confluence and patched again.
+    """
+
+
+class AdmissionRejectedException(DjangoNetboxConfluenceException):
+    """
+    Too many updates are in flight, the webhook isn't admitted. It should be sent again later.
+    """
+
+    def __init__(self, message, retry_after=None):
+        super().__init__(message)
+        self.retry_after = retry_after
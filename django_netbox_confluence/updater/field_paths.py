@@ -0,0 +1,148 @@
+import re
+from functools import partial
+from operator import itemgetter
+
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+
+
+# `name`, `.name` or `[index]`.
+STEP_RE = re.compile(r'(?:^|\.)([^.\[\]\s]+)|\[(-?\d+)\]')
+
+
+def compile_path(path):
+    """
+    Compile dotted path of the field into steps, e.g. `site.region.name` -> ('site', 'region', 'name'),
+    `tags[0].name` -> ('tags', 0, 'name').
+
+    :type path: str
+    :param path: Path of the value in webhook `data`.
+
+    :raises: WikiUpdateException
+
+    :rtype: tuple
+    :returns: Keys(str) and indexes(int) of the path.
+    """
+    steps = list()
+    position = 0
+    while position < len(path):
+        match = STEP_RE.match(path, position)
+        # `^` matches at the start of the path only, so later names have to be separated by dot.
+        if match is None:
+            raise WikiUpdateException("Wrong field path `{}` at position {}.".format(path, position))
+        steps.append(match.group(1) if match.group(1) is not None else int(match.group(2)))
+        position = match.end()
+    if not steps or type(steps[0]) is int or path.startswith('.'):
+        raise WikiUpdateException("Field path `{}` should start with the field name.".format(path))
+    return tuple(steps)
+
+
+def get_value(data, steps, resolve=None):
+    """
+    Take value of the path. Value is None if any object on the path is None(e.g. device without rack) or the list is
+    shorter than the index.
+
+    :type data: dict
+    :param data: Webhook `data`.
+
+    :type steps: tuple
+    :param steps: Compiled path.
+
+    :type resolve: callable|None
+    :param resolve: Called with the nested object which has no next key. Returns full object(e.g. brief object of
+    webhook payload loaded from NetBox) or None if the object can't be resolved.
+
+    :raises: KeyError, WikiUpdateException
+
+    :rtype: object
+    :returns: Value of the path.
+    """
+    value = data
+    for number, step in enumerate(steps):
+        if value is None:
+            return None
+        try:
+            value = value[step]
+        except IndexError:
+            return None
+        except KeyError:
+            # Webhook `data` itself is full object, only nested ones are resolved.
+            resolved = resolve(value) if resolve is not None and number else None
+            if resolved is None:
+                raise
+            value = resolved[step]
+        except TypeError:
+            raise KeyError(step)
+    return value
+
+
+def get_unresolved(data, steps):
+    """
+    Find nested object of the path which doesn't have the next key, so it should be resolved.
+
+    :type data: dict
+    :param data: Webhook `data`.
+
+    :type steps: tuple
+    :param steps: Compiled path.
+
+    :rtype: dict|None
+    :returns: Nested object or None if the path can be taken without resolving.
+    """
+    unresolved = list()
+
+    def collect(value):
+        unresolved.append(value)
+        return None
+
+    try:
+        get_value(data, steps, collect)
+    except KeyError:
+        pass
+    return unresolved[0] if unresolved else None
+
+
+def make_accessor(steps, resolve=None):
+    """
+    Make function which takes value of the path from webhook `data`.
+
+    :type steps: tuple
+    :param steps: Compiled path.
+
+    :type resolve: callable|None
+    :param resolve: Resolver of nested objects, see `get_value`.
+
+    :rtype: callable
+    :returns: Function of webhook `data`.
+    """
+    if len(steps) == 1 and resolve is None:
+        # Most fields are top level keys.
+        return itemgetter(steps[0])
+    return partial(get_value, steps=steps, resolve=resolve)
+
+
+def is_changed(prechange, postchange, steps):
+    """
+    Compare value of the path in NetBox snapshots of the object before and after the change. Snapshots keep related
+    objects as ids and choices as values, so when the whole path isn't in the snapshots its longest prefix which is
+    (e.g. `site` id for `site.region.name`) is compared.
+
+    :type prechange: dict
+    :param prechange: Snapshot before the change.
+
+    :type postchange: dict
+    :param postchange: Snapshot after the change.
+
+    :type steps: tuple
+    :param steps: Compiled path.
+
+    :rtype: bool
+    :returns: True if the value has changed or the snapshots can't tell.
+    """
+    for length in range(len(steps), 0, -1):
+        try:
+            before = get_value(prechange, steps[:length])
+            after = get_value(postchange, steps[:length])
+        except KeyError:
+            continue
+        return before != after
+    return True
@@ -0,0 +1,164 @@
+import uuid
+import threading
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import caches
+
+from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence.updater import field_paths, targets
+
+
+# Precompiled configuration of the field: everything needed to build AbstractLinkedField without database access.
+# `steps` is compiled path of the value in webhook `data`, `accessor` takes the value from it.
+# `targets` are names of Confluence targets of the field, empty - targets of the model route.
+FieldPlan = namedtuple('FieldPlan', ['field_name', 'is_custom', 'field_class', 'label', 'steps', 'accessor',
+                                     'targets'])
+
+VERSION_KEY = "dnc:field-plans:version"
+
+_lock = threading.Lock()
+_plans = dict()
+# Names of models which have configured fields. None until loaded.
+_models = [None]
+_version = [None]
+# Incremented on each invalidation, so plans loaded concurrently with the invalidation are not kept.
+_generation = [0]
+
+
+def get_shared_cache():
+    """
+    Get Django cache used to share configuration version between processes.
+
+    :rtype: django.core.cache.backends.base.BaseCache|None
+    :returns: Cache configured by `DNC_FIELD_CACHE_BACKEND` or None if not configured.
+    """
+    alias = getattr(settings, 'DNC_FIELD_CACHE_BACKEND', None)
+    return caches[alias] if alias else None
+
+
+def check_version():
+    """
+    Forget cached configuration of this process if another process has changed it.
+
+    :rtype: void
+    :returns: void
+    """
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        version = shared_cache.get(VERSION_KEY)
+        with _lock:
+            if version != _version[0]:
+                _clear()
+                _version[0] = version
+
+
+def _clear():
+    """
+    Forget cached configuration. Should be called under the lock.
+
+    :rtype: void
+    :returns: void
+    """
+    _plans.clear()
+    _models[0] = None
+    _generation[0] += 1
+
+
+def make_plan(field):
+    """
+    Compile configured field.
+
+    :type field: NetBoxConfluenceField
+    :param field: Configured field.
+
+    :raises: WikiUpdateException
+
+    :rtype: FieldPlan
+    :returns: Field plan.
+    """
+    steps = field_paths.compile_path(field.field_name)
+    if field.is_custom_field:
+        steps = ('custom_fields',) + steps
+    field_class = field.field_type_class
+    return FieldPlan(field.field_name, field.is_custom_field, field_class, str(field), steps,
+                     field_class.make_accessor(steps), targets.parse_names(field.targets))
+
+
+def get_field_plans(model_name):
+    """
+    Get field plans of the model. Plans are loaded from database on first call and kept until configuration changes.
+
+    :type model_name: str
+    :param model_name: NetBox model name.
+
+    :raises: WikiUpdateException
+
+    :rtype: list
+    :returns: List of FieldPlan.
+    """
+    check_version()
+    with _lock:
+        plans = _plans.get(model_name)
+        generation = _generation[0]
+    if plans is not None:
+        return plans
+
+    plans = [make_plan(field) for field in NetBoxConfluenceField.objects.filter(model_name=model_name)]
+    with _lock:
+        if generation == _generation[0]:
+            _plans[model_name] = plans
+    return plans
+
+
+def get_configured_models():
+    """
+    Get names of models which have at least one configured field. Loaded from database on first call and kept until
+    configuration changes.
+
+    :rtype: frozenset
+    :returns: Model names.
+    """
+    check_version()
+    with _lock:
+        models = _models[0]
+        generation = _generation[0]
+    if models is not None:
+        return models
+
+    models = frozenset(NetBoxConfluenceField.objects.values_list('model_name', flat=True).distinct())
+    with _lock:
+        if generation == _generation[0]:
+            _models[0] = models
+    return models
+
+
+def is_configured(model_name):
+    """
+    Check whether the model has configured fields, so its changes should be written to the Wiki.
+
+    :type model_name: str
+    :param model_name: NetBox model name.
+
+    :rtype: bool
+    :returns: True if at least one field of the model is configured.
+    """
+    return model_name in get_configured_models()
+
+
+def invalidate():
+    """
+    Forget all cached plans in this process and, if shared cache is configured, in other processes.
+
+    :rtype: void
+    :returns: void
+    """
+    with _lock:
+        _clear()
+
+    shared_cache = get_shared_cache()
+    if shared_cache is not None:
+        version = uuid.uuid4().hex
+        shared_cache.set(VERSION_KEY, version, None)
+        with _lock:
+            _version[0] = version
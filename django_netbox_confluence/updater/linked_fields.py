@@ -1,7 +1,13 @@
 from abc import ABCMeta, abstractmethod
+from collections import OrderedDict
 
+from django_netbox_confluence.related_objects import RelatedObjectResolver
+from django_netbox_confluence.updater import field_paths
 from django_netbox_confluence.updater.exceptioins import WikiUpdateException
 
+# Marks field whose value is not provided yet.
+NOT_PROVIDED = object()
+
 
 class ABCLinkedFieldMeta(ABCMeta):
     """
@@ -39,11 +45,55 @@ class ABCLinkedFieldMeta(ABCMeta):
             return self._verbose_name
         return self.__name__
 
+    @classmethod
+    def provide_chain_values(mcs, field_chain):
+        """
+        Provide values of the fields whose classes define `provide_values` batch hook, with one call per class.
+        Chain may hold fields of many events, e.g. merged chains of a batch. Values of other fields are provided one by
+        one when they are written. Fields which already have their values are skipped.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
+
+        :rtype: void
+        :returns: void
+        """
+        fields_by_class = OrderedDict()
+        for field in field_chain:
+            if type(field).provide_values is not None and not field.is_provided:
+                fields_by_class.setdefault(type(field), list()).append(field)
+
+        for field_class, fields in fields_by_class.items():
+            values = list(field_class.provide_values(fields))
+            if len(values) != len(fields):
+                raise WikiUpdateException("{}.provide_values returned {} values for {} fields."
+                                          .format(field_class.__name__, len(values), len(fields)))
+            for field, value in zip(fields, values):
+                field.provided_value = value
+
+    @classmethod
+    def has_batch_hook(mcs, field_chain):
+        """
+        Check whether values of any field of the chain should be provided by `provide_values` batch hook.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :rtype: bool
+        :returns: True if `provide_chain_values` has work to do.
+        """
+        return any(type(field).provide_values is not None and not field.is_provided for field in field_chain)
+
 
 class AbstractLinkedField(object, metaclass=ABCLinkedFieldMeta):
     """
     Represents base field that should be linked with Confluence Wiki and should be updated when is changed on NetBox.
     """
+    # Optional class level batch hook. Classmethod taking list of fields of the class and returning their values in the
+    # same order, used instead of `provide_value` of each field, e.g. to look up all values with one external call.
+    provide_values = None
 
     def __init__(self, name, value, is_custom=False):
         """
@@ -61,6 +111,65 @@ class AbstractLinkedField(object, metaclass=ABCLinkedFieldMeta):
         self.is_custom = is_custom
         self.value = value
         self.name = "custom_{}".format(name) if self.is_custom else name
+        # Name of the excerpt on the page. Depends on page sharding, set by the updater.
+        self.excerpt_name = self.name
+        # Names of Confluence targets the field is written to. Set by the updater from routes.
+        self.targets = ()
+        # Value written to the page, provided once by `provide_value` or by batch hook of the class.
+        self.provided_value = NOT_PROVIDED
+
+    @property
+    def is_provided(self):
+        """
+        Check whether the value of the field was already provided.
+
+        :rtype: bool
+        :returns: True if `get_value` doesn't call `provide_value`.
+        """
+        return self.provided_value is not NOT_PROVIDED
+
+    def get_value(self):
+        """
+        Get value written to the page. It is provided once and kept, so the field is checked and written with the same
+        value.
+
+        :rtype: str
+        :returns: Value of the field.
+        """
+        if not self.is_provided:
+            self.provided_value = self.provide_value()
+        return self.provided_value
+
+    @classmethod
+    def make_accessor(cls, steps):
+        """
+        Make function which takes value of the field from webhook `data`. Called once when fields configuration is
+        loaded, the function is cached with it.
+
+        :type steps: tuple
+        :param steps: Compiled path of the field, see `field_paths.compile_path`.
+
+        :rtype: callable
+        :returns: Function of webhook `data`, raises KeyError if the field is not in it.
+        """
+        return field_paths.make_accessor(steps)
+
+    @classmethod
+    def get_unresolved(cls, data, steps):
+        """
+        Get related object which should be loaded from NetBox to take the value, so objects of many fields and events
+        can be loaded together.
+
+        :type data: dict
+        :param data: Webhook `data`.
+
+        :type steps: tuple
+        :param steps: Compiled path of the field.
+
+        :rtype: dict|None
+        :returns: Brief object or None if nothing should be loaded.
+        """
+        return None
 
     @abstractmethod
     def provide_value(self):
@@ -102,3 +211,19 @@ class StatusLinkedField(AbstractLinkedField):
         :returns: Status of the site.
         """
         return self.value['label']
+
+
+class RelatedObjectLinkedField(TextLinkedField):
+    """
+    Represents field of related object which is not in webhook payload, e.g. `site.region.name` of device(payload has
+    only brief `site` object). Related objects are loaded from NetBox by id and cached.
+    """
+    verbose_name = "Related object field"
+
+    @classmethod
+    def make_accessor(cls, steps):
+        return field_paths.make_accessor(steps, lambda reference: RelatedObjectResolver.get_shared().get(reference))
+
+    @classmethod
+    def get_unresolved(cls, data, steps):
+        return field_paths.get_unresolved(data, steps)
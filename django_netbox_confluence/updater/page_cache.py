@@ -0,0 +1,100 @@
+import hashlib
+import threading
+
+from django.core.cache import caches
+
+
+class PageCache(object):
+    """
+    Maps page titles to page id and last known version, so pages can be fetched by id instead of slow title search.
+    Kept in process memory and optionally mirrored to Django cache backend shared by all processes.
+    """
+
+    def __init__(self, namespace, backend_alias=None, timeout=None):
+        """
+        Init.
+
+        :type namespace: str
+        :param namespace: Namespace of cached pages, e.g. Confluence target and space key.
+
+        :type backend_alias: str|None
+        :param backend_alias: Alias of Django cache(`CACHES` setting) used as shared cache. None - process cache only.
+
+        :type timeout: int|None
+        :param timeout: Seconds to keep entries in the shared cache. None - forever.
+        """
+        self.namespace = namespace
+        self.backend = caches[backend_alias] if backend_alias else None
+        self.timeout = timeout
+        self.pages = dict()
+        self.lock = threading.Lock()
+
+    def make_key(self, page_title):
+        """
+        Make shared cache key. Title is hashed as it may contain characters not allowed by some backends.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: str
+        :returns: Cache key.
+        """
+        digest = hashlib.md5(page_title.encode('utf-8')).hexdigest()
+        return "dnc:page:{}:{}".format(self.namespace, digest)
+
+    def get(self, page_title):
+        """
+        Get cached page id and version.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: tuple(str, int)|None
+        :returns: Page id and version, None if page is not cached.
+        """
+        with self.lock:
+            entry = self.pages.get(page_title)
+        if entry is None and self.backend is not None:
+            entry = self.backend.get(self.make_key(page_title))
+            if entry is not None:
+                entry = tuple(entry)
+                with self.lock:
+                    self.pages[page_title] = entry
+        return entry
+
+    def set(self, page_title, page_id, version):
+        """
+        Save page id and version.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :type page_id: str
+        :param page_id: Id of the page.
+
+        :type version: int|None
+        :param version: Last known version of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        entry = (page_id, version)
+        with self.lock:
+            self.pages[page_title] = entry
+        if self.backend is not None:
+            self.backend.set(self.make_key(page_title), entry, self.timeout)
+
+    def invalidate(self, page_title):
+        """
+        Forget the page, e.g. when it was deleted or modified by someone else.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.pages.pop(page_title, None)
+        if self.backend is not None:
+            self.backend.delete(self.make_key(page_title))
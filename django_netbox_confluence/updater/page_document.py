@@ -0,0 +1,88 @@
+from collections import defaultdict
+
+
+class PageDocument(object):
+    """
+    Parsed Wiki page content with index of MultiExcerpt macros.
+    The tree is walked once, so looking up an excerpt doesn't scan the whole page.
+    """
+    CONTENT_NAMESPACE = "http://atlassian.com/content"
+    MACRO_TAG = "{%s}structured-macro" % CONTENT_NAMESPACE
+    PARAMETER_TAG = "{%s}parameter" % CONTENT_NAMESPACE
+    RICH_TEXT_BODY_TAG = "{%s}rich-text-body" % CONTENT_NAMESPACE
+    NAME_ATTRIBUTE = "{%s}name" % CONTENT_NAMESPACE
+    EXCERPT_NAME_PARAMETER = "MultiExcerptName"
+
+    def __init__(self, root):
+        """
+        Init.
+
+        :type root: lxml.etree._Element
+        :param root: Wrapper element which holds the page content.
+        """
+        self.root = root
+        # Version of the page the content was read at and whether it is the local copy, set by the adapter.
+        self.version = None
+        self.is_shadow = False
+        self.excerpts = defaultdict(list)
+        for macro in root.iter(self.MACRO_TAG):
+            self.index_macro(macro)
+
+    @staticmethod
+    def normalize_name(text):
+        """
+        Normalize excerpt name the way Confluence users may type it: all whitespaces are ignored.
+
+        :type text: str|None
+        :param text: Text of `MultiExcerptName` parameter.
+
+        :rtype: str
+        :returns: Excerpt name.
+        """
+        return "".join((text or "").split())
+
+    def index_macro(self, macro):
+        """
+        Add paragraphs of the macro to the index if it is MultiExcerpt macro.
+
+        :type macro: lxml.etree._Element
+        :param macro: `ac:structured-macro` element.
+
+        :rtype: void
+        :returns: void
+        """
+        name = None
+        for child in macro:
+            if child.tag == self.PARAMETER_TAG and child.get(self.NAME_ATTRIBUTE) == self.EXCERPT_NAME_PARAMETER:
+                name = self.normalize_name(child.text)
+            elif child.tag == self.RICH_TEXT_BODY_TAG and name is not None:
+                # Body of the excerpt follows its name parameter.
+                self.excerpts[name].extend(element for element in child
+                                           if isinstance(element.tag, str) and
+                                           element.tag.rpartition('}')[2] == 'p')
+
+    def get_paragraphs(self, name):
+        """
+        Get paragraphs which hold the value of the excerpt.
+
+        :type name: str
+        :param name: Name of the excerpt.
+
+        :rtype: list
+        :returns: List of `p` elements. Empty if there is no such excerpt.
+        """
+        return self.excerpts.get(name, [])
+
+    def add_macro(self, macro):
+        """
+        Add new macro to the end of the page and index it.
+
+        :type macro: lxml.etree._Element
+        :param macro: `ac:structured-macro` element.
+
+        :rtype: void
+        :returns: void
+        """
+        self.root.insert(-1, macro)
+        for element in macro.iter(self.MACRO_TAG):
+            self.index_macro(element)
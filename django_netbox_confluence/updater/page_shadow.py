@@ -0,0 +1,166 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class PageShadowStore(object):
+    """
+    Keeps the last known storage body, id and version of the pages, so pages written by the app are patched without
+    downloading them again. Copies are trusted for a limited time only, pages can be edited by someone else. Kept in
+    process memory(least recently used pages are dropped) and optionally mirrored to Django cache backend shared by all
+    processes.
+    """
+
+    def __init__(self, namespace, max_pages=1000, stale_after=300, backend_alias=None):
+        """
+        Init.
+
+        :type namespace: str
+        :param namespace: Namespace of the pages, e.g. Confluence target and space key.
+
+        :type max_pages: int
+        :param max_pages: Maximum number of pages kept in process memory.
+
+        :type stale_after: float|None
+        :param stale_after: Seconds after which the copy is read from Confluence again. None - never.
+
+        :type backend_alias: str|None
+        :param backend_alias: Alias of Django cache(`CACHES` setting) used as shared store. None - process memory only.
+        """
+        self.namespace = namespace
+        self.max_pages = max_pages
+        self.stale_after = stale_after
+        self.backend = caches[backend_alias] if backend_alias else None
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, namespace):
+        """
+        Create store configured by `DNC_PAGE_SHADOW_*` settings.
+
+        :type namespace: str
+        :param namespace: Namespace of the pages.
+
+        :rtype: PageShadowStore|None
+        :returns: Store or None if local copies are disabled.
+        """
+        if not getattr(settings, 'DNC_PAGE_SHADOW_ENABLED', True):
+            return None
+        return cls(namespace,
+                   max_pages=getattr(settings, 'DNC_PAGE_SHADOW_MAX_PAGES', 1000),
+                   stale_after=getattr(settings, 'DNC_PAGE_SHADOW_STALE_AFTER', 300),
+                   backend_alias=getattr(settings, 'DNC_PAGE_SHADOW_BACKEND', None))
+
+    def make_key(self, page_title):
+        """
+        Make shared cache key. Title is hashed as it may contain characters not allowed by some backends.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: str
+        :returns: Cache key.
+        """
+        digest = hashlib.md5(page_title.encode('utf-8')).hexdigest()
+        return "dnc:shadow:{}:{}".format(self.namespace, digest)
+
+    def is_fresh(self, entry):
+        """
+        Check whether the copy can be used without reading the page.
+
+        :type entry: tuple
+        :param entry: (page id, version, storage body, time the copy was read or written) tuple.
+
+        :rtype: bool
+        :returns: False if the copy is older than `stale_after`.
+        """
+        return self.stale_after is None or time.time() - entry[3] < self.stale_after
+
+    def get(self, page_title):
+        """
+        Get the copy of the page.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: tuple(str, int, str)|None
+        :returns: Page id, version and storage body. None if there is no fresh copy.
+        """
+        with self.lock:
+            entry = self.pages.get(page_title)
+            if entry is not None:
+                self.pages.move_to_end(page_title)
+        if entry is None and self.backend is not None:
+            entry = self.backend.get(self.make_key(page_title))
+            if entry is not None:
+                entry = tuple(entry)
+                self.keep(page_title, entry)
+        if entry is None or not self.is_fresh(entry):
+            return None
+        return entry[:3]
+
+    def keep(self, page_title, entry):
+        """
+        Put the copy to process memory, the least recently used pages are dropped when it is full.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :type entry: tuple
+        :param entry: (page id, version, storage body, time) tuple.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.pages[page_title] = entry
+            self.pages.move_to_end(page_title)
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+
+    def set(self, page_title, page_id, version, body):
+        """
+        Save the copy of the page which was just read or written.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :type page_id: str
+        :param page_id: Id of the page.
+
+        :type version: int|None
+        :param version: Version of the page. The copy isn't kept if it is unknown.
+
+        :type body: str
+        :param body: Storage format body.
+
+        :rtype: void
+        :returns: void
+        """
+        if version is None:
+            self.invalidate(page_title)
+            return
+        entry = (page_id, version, body, time.time())
+        self.keep(page_title, entry)
+        if self.backend is not None:
+            self.backend.set(self.make_key(page_title), entry, self.stale_after)
+
+    def invalidate(self, page_title):
+        """
+        Forget the copy, e.g. when the page was modified by someone else.
+
+        :type page_title: str
+        :param page_title: Title of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.pages.pop(page_title, None)
+        if self.backend is not None:
+            self.backend.delete(self.make_key(page_title))
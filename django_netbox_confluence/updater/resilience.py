@@ -0,0 +1,416 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+import requests
+from django.conf import settings
+from django.utils import timezone
+
+from django_netbox_confluence import metrics
+from django_netbox_confluence.throttling import AdaptiveTokenBucket
+from django_netbox_confluence.updater.exceptioins import ConfluenceUnavailableException
+
+
+logger = logging.getLogger(__name__)
+
+
+class CircuitBreaker(object):
+    """
+    Stops calls to the service after several failures in a row, so a degraded service isn't hammered and callers fail
+    fast. After the reset timeout one trial call is let through(half open state): success closes the circuit, failure
+    opens it again.
+    """
+    STATE_CLOSED = 'closed'
+    STATE_HALF_OPEN = 'half_open'
+    STATE_OPEN = 'open'
+
+    # Values of `dnc_confluence_circuit_state` gauge.
+    STATE_VALUES = {
+        STATE_CLOSED: 0,
+        STATE_HALF_OPEN: 1,
+        STATE_OPEN: 2,
+    }
+
+    def __init__(self, name, failure_threshold=5, reset_timeout=30):
+        """
+        Init.
+
+        :type name: str
+        :param name: Name of the service used in logs and metrics.
+
+        :type failure_threshold: int
+        :param failure_threshold: Number of failures in a row which opens the circuit. Zero or None - never open.
+
+        :type reset_timeout: float
+        :param reset_timeout: Seconds the circuit stays open before the trial call.
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.STATE_CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+        metrics.set_gauge('dnc_confluence_circuit_state', self.STATE_VALUES[self.state], target=self.name)
+
+    def set_state(self, state):
+        """
+        Change state and report it. Should be called under the lock.
+
+        :type state: str
+        :param state: One of STATE_* values.
+
+        :rtype: void
+        :returns: void
+        """
+        if state == self.state:
+            return
+        logger.warning("Circuit breaker of %s: %s -> %s.", self.name, self.state, state)
+        self.state = state
+        metrics.set_gauge('dnc_confluence_circuit_state', self.STATE_VALUES[state], target=self.name)
+        metrics.increment('dnc_confluence_circuit_transitions_total', target=self.name, state=state)
+
+    def before_call(self):
+        """
+        Check whether the call is allowed.
+
+        :raises: ConfluenceUnavailableException
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            if self.state == self.STATE_CLOSED:
+                return
+            retry_after = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.STATE_OPEN and retry_after <= 0:
+                self.set_state(self.STATE_HALF_OPEN)
+            if self.state == self.STATE_HALF_OPEN and not self.probing:
+                self.probing = True
+                return
+        raise ConfluenceUnavailableException("{} is unavailable, circuit breaker is open.".format(self.name),
+                                             retry_after=max(retry_after, 1))
+
+    def record_success(self):
+        """
+        Save successful call.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.failures = 0
+            self.probing = False
+            self.set_state(self.STATE_CLOSED)
+
+    def record_failure(self):
+        """
+        Save failed call, open the circuit if there are too many failures in a row.
+
+        :rtype: void
+        :returns: void
+        """
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == self.STATE_HALF_OPEN or (self.failure_threshold and
+                                                      self.failures >= self.failure_threshold):
+                self.opened_at = time.monotonic()
+                self.set_state(self.STATE_OPEN)
+
+
+class RetryPolicy(object):
+    """
+    Decides which calls are retried and how long to wait before the retry.
+    """
+    # Statuses which mean the request wasn't processed and can be sent again.
+    RETRY_STATUSES = (429, 502, 503, 504)
+    # POST isn't idempotent, it is repeated only when the service surely rejected it.
+    RETRY_STATUSES_POST = (429, 503)
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+
+    def __init__(self, max_retries=3, backoff_base=0.5, backoff_max=30):
+        """
+        Init.
+
+        :type max_retries: int
+        :param max_retries: Number of retries after the first attempt.
+
+        :type backoff_base: float
+        :param backoff_base: Delay before the first retry. Doubled with each retry.
+
+        :type backoff_max: float
+        :param backoff_max: Maximum delay. Calls asked to come back later than this aren't retried.
+        """
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+    def is_retryable(self, method, status):
+        """
+        Check whether failed call can be repeated.
+
+        :type method: str
+        :param method: HTTP method.
+
+        :type status: int|None
+        :param status: Response status code. None if there is no response(connection error or timeout).
+
+        :rtype: bool
+        :returns: True if the call can be repeated.
+        """
+        if method.upper() == 'POST':
+            return status in self.RETRY_STATUSES_POST
+        if status is None:
+            return method.upper() in self.IDEMPOTENT_METHODS
+        return status in self.RETRY_STATUSES
+
+    def get_delay(self, attempt, retry_after=None):
+        """
+        Get delay before the retry: Retry-After if the service gave it, otherwise exponential backoff with full jitter.
+
+        :type attempt: int
+        :param attempt: Number of the failed attempt starting from zero.
+
+        :type retry_after: float|None
+        :param retry_after: Seconds from Retry-After header.
+
+        :rtype: float|None
+        :returns: Seconds to wait. None if the service asked to wait longer than the maximum delay.
+        """
+        if retry_after is not None:
+            return retry_after if retry_after <= self.backoff_max else None
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    @staticmethod
+    def parse_retry_after(value):
+        """
+        Parse Retry-After header, which is either number of seconds or HTTP date.
+
+        :type value: str|None
+        :param value: Header value.
+
+        :rtype: float|None
+        :returns: Seconds to wait. None if there is no valid header.
+        """
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - timezone.now()).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+class ConfluenceGuard(object):
+    """
+    Resilience layer of Confluence calls: rate limiting, retries and circuit breaker.
+    Shared by sync and async adapters of the same Confluence, so all calls of the process are limited together.
+    """
+
+    # Guards shared within the process. Keyed by target name.
+    shared_guards = dict()
+    shared_guards_lock = threading.Lock()
+
+    def __init__(self, name, bucket, breaker, retry_policy):
+        """
+        Init.
+
+        :type name: str
+        :param name: Name of the service used in errors, logs and metrics.
+
+        :type bucket: AdaptiveTokenBucket
+        :param bucket: Rate limiter of calls.
+
+        :type breaker: CircuitBreaker
+        :param breaker: Circuit breaker.
+
+        :type retry_policy: RetryPolicy
+        :param retry_policy: Retry policy.
+        """
+        self.name = name
+        self.bucket = bucket
+        self.breaker = breaker
+        self.retry_policy = retry_policy
+
+    @classmethod
+    def get_shared(cls, target):
+        """
+        Get guard of the Confluence target shared within the process, create it on first call. Rate limit is taken
+        from the target, retries and circuit breaker are configured by global settings.
+
+        :type target: ConfluenceTarget
+        :param target: Confluence target.
+
+        :rtype: ConfluenceGuard
+        :returns: Guard object.
+        """
+        with cls.shared_guards_lock:
+            if target.name not in cls.shared_guards:
+                cls.shared_guards[target.name] = cls(
+                    target.name,
+                    AdaptiveTokenBucket(target.rate_limit, capacity=target.rate_burst, min_rate=target.rate_limit_min),
+                    CircuitBreaker(target.name,
+                                   failure_threshold=getattr(settings, 'DNC_CONFLUENCE_BREAKER_THRESHOLD', 5),
+                                   reset_timeout=getattr(settings, 'DNC_CONFLUENCE_BREAKER_RESET_TIMEOUT', 30)),
+                    RetryPolicy(max_retries=getattr(settings, 'DNC_CONFLUENCE_MAX_RETRIES', 3),
+                                backoff_base=getattr(settings, 'DNC_CONFLUENCE_BACKOFF_BASE', 0.5),
+                                backoff_max=getattr(settings, 'DNC_CONFLUENCE_BACKOFF_MAX', 30)),
+                )
+            return cls.shared_guards[target.name]
+
+    def handle_outcome(self, method, attempt, response, error):
+        """
+        Save the outcome of the call and decide what to do next.
+
+        :type method: str
+        :param method: HTTP method.
+
+        :type attempt: int
+        :param attempt: Number of the attempt starting from zero.
+
+        :type response: requests.Response|httpx.Response|None
+        :param response: Response. None if the call raised transport error.
+
+        :type error: Exception|None
+        :param error: Transport error.
+
+        :raises: ConfluenceUnavailableException
+
+        :rtype: float|None
+        :returns: Seconds to wait before the retry. None if the response should be returned as is.
+        """
+        status = response.status_code if response is not None else None
+        retry_after = RetryPolicy.parse_retry_after(response.headers.get('Retry-After')) if status else None
+
+        if error is not None or status >= 500:
+            self.breaker.record_failure()
+        else:
+            # Throttled service is up, so 429 closes the circuit too.
+            self.breaker.record_success()
+        if status == 429:
+            self.bucket.decrease()
+            if retry_after:
+                self.bucket.block(retry_after)
+        elif error is None and status < 500:
+            self.bucket.increase()
+
+        retryable = self.retry_policy.is_retryable(method, status)
+        if not retryable and error is None:
+            return None
+
+        metrics.increment('dnc_confluence_failed_calls_total', target=self.name, status=status or 'error')
+        delay = None
+        if self.breaker.state == CircuitBreaker.STATE_OPEN:
+            retry_after = max(retry_after or 0, self.breaker.reset_timeout)
+        elif retryable and attempt < self.retry_policy.max_retries:
+            delay = self.retry_policy.get_delay(attempt, retry_after)
+        if delay is None:
+            raise ConfluenceUnavailableException("{} {} failed after {} attempt(s): {}".format(
+                method, self.name, attempt + 1, error if error is not None else "status {}".format(status)
+            ), retry_after=retry_after)
+        logger.info("Retrying %s %s in %.1f s, attempt %s failed: %s.", method, self.name, delay, attempt + 1,
+                    error if error is not None else status)
+        return delay
+
+    def call(self, send, method, transport_errors):
+        """
+        Make the call with rate limiting, retries and circuit breaker.
+
+        :type send: callable
+        :param send: Function making the request and returning the response.
+
+        :type method: str
+        :param method: HTTP method.
+
+        :type transport_errors: tuple
+        :param transport_errors: Exception classes of connection errors and timeouts.
+
+        :raises: ConfluenceUnavailableException
+
+        :rtype: requests.Response
+        :returns: Response.
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            self.bucket.acquire()
+            response, error = None, None
+            request_timer = metrics.timer('dnc_confluence_request_duration_seconds', method=method.upper())
+            try:
+                with request_timer:
+                    response = send()
+                    request_timer.labels['status'] = response.status_code
+            except transport_errors as e:
+                error = e
+            delay = self.handle_outcome(method, attempt, response, error)
+            if delay is None:
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    async def acall(self, send, method, transport_errors):
+        """
+        Async version of `call`.
+
+        :type send: callable
+        :param send: Coroutine function making the request and returning the response.
+
+        :type method: str
+        :param method: HTTP method.
+
+        :type transport_errors: tuple
+        :param transport_errors: Exception classes of connection errors and timeouts.
+
+        :raises: ConfluenceUnavailableException
+
+        :rtype: httpx.Response
+        :returns: Response.
+        """
+        attempt = 0
+        while True:
+            self.breaker.before_call()
+            wait = self.bucket.try_acquire()
+            while wait:
+                await asyncio.sleep(wait)
+                wait = self.bucket.try_acquire()
+            response, error = None, None
+            request_timer = metrics.timer('dnc_confluence_request_duration_seconds', method=method.upper())
+            try:
+                with request_timer:
+                    response = await send()
+                    request_timer.labels['status'] = response.status_code
+            except transport_errors as e:
+                error = e
+            delay = self.handle_outcome(method, attempt, response, error)
+            if delay is None:
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+
+class ResilientSession(requests.Session):
+    """
+    Session which makes all requests through the guard.
+    """
+
+    def __init__(self, guard):
+        """
+        Init.
+
+        :type guard: ConfluenceGuard
+        :param guard: Guard of the Confluence.
+        """
+        super().__init__()
+        self.guard = guard
+
+    def request(self, method, url, *args, **kwargs):
+        return self.guard.call(lambda: super(ResilientSession, self).request(method, url, *args, **kwargs),
+                               method, (requests.ConnectionError, requests.Timeout))
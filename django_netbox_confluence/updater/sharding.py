@@ -0,0 +1,203 @@
+import zlib
+
+from django.conf import settings
+
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+
+
+class SinglePageSharding(object):
+    """
+    All objects of the model share one page, each field has one excerpt named after the field.
+    """
+    name = 'single'
+    # Whether pages and excerpts depend on the object.
+    per_object = False
+
+    def __init__(self, model_name):
+        """
+        Init.
+
+        :type model_name: str
+        :param model_name: Model name as it comes in webhook payload.
+        """
+        self.model_name = model_name
+        self.base_title = "partials-{}".format(model_name)
+
+    def get_object_key(self, data):
+        """
+        Get key of the object which decides its page and excerpt names.
+
+        :type data: dict
+        :param data: Webhook body.
+
+        :raises: WikiUpdateException
+
+        :rtype: str|None
+        :returns: Object key. None if the strategy doesn't depend on the object.
+        """
+        return None
+
+    def get_page_title(self, key):
+        """
+        Get title of the page which holds excerpts of the object.
+
+        :type key: str|None
+        :param key: Object key.
+
+        :rtype: str
+        :returns: Page title.
+        """
+        return self.base_title
+
+    def get_excerpt_name(self, key, field_name):
+        """
+        Get name of the excerpt which holds value of the object field.
+
+        :type key: str|None
+        :param key: Object key.
+
+        :type field_name: str
+        :param field_name: Name of the field(`custom_` prefixed for custom fields).
+
+        :rtype: str
+        :returns: Excerpt name.
+        """
+        return field_name
+
+    def parse_page_title(self, title):
+        """
+        Check whether the page belongs to the model in this layout.
+
+        :type title: str
+        :param title: Page title.
+
+        :rtype: str|None
+        :returns: Key of the page(object key for per object pages). None if the page isn't of this layout.
+        """
+        return '' if title == self.base_title else None
+
+    def parse_excerpt_name(self, page_key, excerpt_name, field_names=()):
+        """
+        Get object key and field name of the excerpt.
+
+        :type page_key: str
+        :param page_key: Key of the page returned by `parse_page_title`.
+
+        :type excerpt_name: str
+        :param excerpt_name: Name of the excerpt.
+
+        :type field_names: iterable
+        :param field_names: Names of the configured fields of the model(`custom_` prefixed for custom fields), used to
+        tell the field from the object key when the excerpt name holds both.
+
+        :rtype: tuple(str|None, str)
+        :returns: Object key(None if the layout doesn't keep it) and field name.
+        """
+        return None, excerpt_name
+
+
+class ObjectPageSharding(SinglePageSharding):
+    """
+    Each object has its own page, excerpts are named after the fields.
+    """
+    name = 'object'
+    per_object = True
+
+    def get_object_key(self, data):
+        key_field = getattr(settings, 'DNC_PAGE_SHARDING_KEY', 'id')
+        try:
+            key = data['data'][key_field]
+        except (KeyError, TypeError):
+            raise WikiUpdateException("Field `{}` used as page sharding key is not present in webhook payload."
+                                      .format(key_field))
+        # Excerpt names can't have whitespaces, so they are removed from the key.
+        key = "".join(str(key).split())
+        if not key:
+            raise WikiUpdateException("Page sharding key `{}` of the object is empty.".format(key_field))
+        return key
+
+    def get_page_title(self, key):
+        return "{}-{}".format(self.base_title, key)
+
+    def parse_page_title(self, title):
+        prefix = self.base_title + '-'
+        if not title.startswith(prefix) or title.startswith(prefix + 'bucket-'):
+            return None
+        return title[len(prefix):]
+
+    def parse_excerpt_name(self, page_key, excerpt_name, field_names=()):
+        return page_key, excerpt_name
+
+
+class BucketPageSharding(ObjectPageSharding):
+    """
+    Objects are spread over the fixed number of pages by hash of their key. Excerpts are named `<key>-<field>`.
+    """
+    name = 'bucket'
+
+    def __init__(self, model_name, buckets=None):
+        """
+        Init.
+
+        :type model_name: str
+        :param model_name: Model name as it comes in webhook payload.
+
+        :type buckets: int|None
+        :param buckets: Number of pages. Defaults to `DNC_PAGE_SHARDING_BUCKETS` setting.
+        """
+        super().__init__(model_name)
+        self.buckets = buckets or getattr(settings, 'DNC_PAGE_SHARDING_BUCKETS', 64)
+
+    def get_page_title(self, key):
+        # crc32 is the same in all processes, unlike `hash`.
+        return "{}-bucket-{}".format(self.base_title, zlib.crc32(key.encode('utf-8')) % self.buckets)
+
+    def get_excerpt_name(self, key, field_name):
+        return "{}-{}".format(key, field_name)
+
+    def parse_page_title(self, title):
+        prefix = self.base_title + '-bucket-'
+        if not title.startswith(prefix) or not title[len(prefix):].isdigit():
+            return None
+        return title[len(prefix):]
+
+    def parse_excerpt_name(self, page_key, excerpt_name, field_names=()):
+        # Both keys and field paths may have dashes, so the longest configured field the name ends with is taken.
+        for field_name in sorted(field_names, key=len, reverse=True):
+            key = excerpt_name[:-len(field_name) - 1]
+            if key and excerpt_name.endswith('-' + field_name):
+                return key, field_name
+        # Field isn't configured anymore. Fields with dashes are rejected by the configuration, so the last dash
+        # separates the key.
+        key, separator, field_name = excerpt_name.rpartition('-')
+        if not separator:
+            return None, excerpt_name
+        return key, field_name
+
+
+STRATEGIES = {strategy.name: strategy for strategy in (SinglePageSharding, ObjectPageSharding, BucketPageSharding)}
+
+
+def get_strategy(model_name, name=None):
+    """
+    Get page sharding strategy of the model.
+
+    :type model_name: str
+    :param model_name: Model name as it comes in webhook payload.
+
+    :type name: str|None
+    :param name: Strategy name. Defaults to the configured one: `DNC_PAGE_SHARDING_MODELS` entry of the model or
+    `DNC_PAGE_SHARDING`.
+
+    :raises: WikiUpdateException
+
+    :rtype: SinglePageSharding
+    :returns: Strategy object.
+    """
+    if name is None:
+        name = getattr(settings, 'DNC_PAGE_SHARDING_MODELS', {}).get(model_name,
+                                                                     getattr(settings, 'DNC_PAGE_SHARDING', 'single'))
+    try:
+        return STRATEGIES[name](model_name)
+    except KeyError:
+        raise WikiUpdateException("Unknown page sharding `{}`. Available: {}.".format(name, ', '.join(STRATEGIES)))
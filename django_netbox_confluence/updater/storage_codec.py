@@ -0,0 +1,135 @@
+import threading
+
+from django.conf import settings
+from lxml import etree
+
+
+class StorageCodec(object):
+    """
+    Parses and serializes Confluence storage format without the template engine.
+    Output is the same as of rendering `wrapper.xml` and `multiexcerpt.xml` templates and parsing the result.
+    """
+    CONTENT_NAMESPACE = "http://atlassian.com/content"
+
+    # Rendered `wrapper.xml` around the page content. Whitespaces are kept, as they are saved back with the content.
+    WRAPPER_PREFIX = ('<?xml version="1.0"?><!DOCTYPE xml SYSTEM "xhtml.ent" []>\n'
+                      '    <xml xmlns:atlassian-content="http://atlassian.com/content"\n'
+                      '        xmlns:ac="http://atlassian.com/content"\n'
+                      '        xmlns:ri="http://atlassian.com/resource/identifier"\n'
+                      '        xmlns:atlassian-template="http://atlassian.com/template"\n'
+                      '        xmlns:at="http://atlassian.com/template" xmlns="http://www.w3.org/1999/xhtml"\n'
+                      '    >\n'
+                      '        ')
+    WRAPPER_SUFFIX = '\n    </xml>\n'
+
+    # Parser can't be used by several threads at once, so each thread has its own.
+    _local = threading.local()
+
+    @classmethod
+    def get_parser(cls):
+        """
+        Get parser of the current thread, create it on first call.
+
+        :rtype: lxml.etree.XMLParser
+        :returns: Parser object.
+        """
+        # Pages come from remote server, so libxml2 limits of tree depth and text size are lifted only explicitly.
+        huge_tree = getattr(settings, 'DNC_STORAGE_HUGE_TREE', False)
+        parser = getattr(cls._local, 'parser', None)
+        if parser is None or cls._local.huge_tree != huge_tree:
+            # Ids aren't used, so they aren't collected.
+            parser = cls._local.parser = etree.XMLParser(collect_ids=False, huge_tree=huge_tree)
+            cls._local.huge_tree = huge_tree
+        return parser
+
+    @classmethod
+    def parse(cls, content_xml):
+        """
+        Parse storage format body. Content is fed to the parser between wrapper parts, so the whole wrapped document
+        isn't built as one more string.
+
+        :type content_xml: str
+        :param content_xml: Storage format body.
+
+        :raises: lxml.etree.XMLSyntaxError
+
+        :rtype: lxml.etree._Element
+        :returns: Wrapper element which holds the page content.
+        """
+        parser = cls.get_parser()
+        try:
+            parser.feed(cls.WRAPPER_PREFIX)
+            parser.feed(content_xml)
+            parser.feed(cls.WRAPPER_SUFFIX)
+        except etree.XMLSyntaxError:
+            # Parser is reset by `close`, so it can be used for the next page.
+            try:
+                parser.close()
+            except etree.XMLSyntaxError:
+                pass
+            raise
+        return parser.close()
+
+    @classmethod
+    def serialize(cls, root):
+        """
+        Serialize content of the wrapper element back to storage format.
+
+        :type root: lxml.etree._Element
+        :param root: Wrapper element which holds the page content.
+
+        :rtype: str
+        :returns: Storage format body.
+        """
+        # Children can't be serialized one by one, as each of them would get namespace declarations of the wrapper.
+        # Serialization is ASCII(other characters are escaped), so the content is decoded right from the bytes
+        # without copying it first.
+        body_xml = etree.tostring(root)
+        # <xml xmlns:******> <p></p>***<ac:structured-macro>***</ac:structured-macro> </xml>
+        #                  ^                                                        ^
+        return str(memoryview(body_xml)[body_xml.index(b'>') + 1:body_xml.rindex(b'<')], 'ascii')
+
+    @classmethod
+    def make_excerpt_macro(cls, macro_id, name, value):
+        """
+        Make MultiExcerpt macro element, same as parsed `multiexcerpt.xml` template.
+
+        :type macro_id: uuid.UUID|str
+        :param macro_id: Id of the macro.
+
+        :type name: str
+        :param name: Name of the excerpt.
+
+        :type value: str|int|None
+        :param value: Text of the excerpt. None - empty paragraph, as when existing excerpt is set to None.
+
+        :rtype: lxml.etree._Element
+        :returns: `ac:structured-macro` element.
+        """
+        namespace = '{%s}' % cls.CONTENT_NAMESPACE
+        macro = etree.Element(namespace + 'structured-macro', nsmap={'ac': cls.CONTENT_NAMESPACE})
+        macro.set(namespace + 'name', 'multiexcerpt')
+        macro.set(namespace + 'schema-version', '1')
+        macro.set(namespace + 'macro-id', str(macro_id))
+        macro.text = '\n        '
+
+        name_parameter = etree.SubElement(macro, namespace + 'parameter')
+        name_parameter.set(namespace + 'name', 'MultiExcerptName')
+        name_parameter.text = name
+        name_parameter.tail = '\n        '
+
+        output_parameter = etree.SubElement(macro, namespace + 'parameter')
+        output_parameter.set(namespace + 'name', 'atlassian-macro-output-type')
+        output_parameter.text = '\n            INLINE\n        '
+        output_parameter.tail = '\n        '
+
+        body = etree.SubElement(macro, namespace + 'rich-text-body')
+        body.text = '\n            '
+        body.tail = '\n    '
+
+        # Template paragraph has no namespace, so it is made the same way. Empty text is kept as None, otherwise the
+        # paragraph would be serialized as `<p></p>` instead of `<p/>`.
+        paragraph = etree.SubElement(body, 'p')
+        paragraph.text = None if value is None else str(value) or None
+        paragraph.tail = '\n        '
+        return macro
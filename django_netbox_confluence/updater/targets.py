@@ -0,0 +1,264 @@
+import asyncio
+import threading
+import weakref
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from django_netbox_confluence.updater.exceptioins import WikiUpdateException
+
+
+# Name of the target configured by `DNC_CONFLUENCE_CREDENTIALS` and `DNC_SPACE_KEY`, also the default route.
+DEFAULT_TARGET = 'default'
+
+_lock = threading.Lock()
+# Targets built from settings. None until loaded.
+_targets = [None]
+_executor = [None]
+
+
+class ConfluenceTarget(object):
+    """
+    Confluence space written by the updater. Each target has its own adapter(connection pool), rate limiter, circuit
+    breaker and limit of concurrent page writes.
+    """
+
+    def __init__(self, name, url, username, password, space_key, pool_size=10, timeout=60, rate_limit=None,
+                 rate_burst=None, rate_limit_min=None, concurrency=None):
+        """
+        Init.
+
+        :type name: str
+        :param name: Name of the target used in routes, errors and metrics.
+
+        :type url: str
+        :param url: Confluence url.
+
+        :type username: str
+        :param username: Confluence username.
+
+        :type password: str
+        :param password: Confluence password.
+
+        :type space_key: str
+        :param space_key: Key of the space.
+
+        :type pool_size: int
+        :param pool_size: Maximum number of kept connections.
+
+        :type timeout: float
+        :param timeout: Seconds to wait for Confluence response.
+
+        :type rate_limit: float|None
+        :param rate_limit: Maximum Confluence calls per second. None - no limit.
+
+        :type rate_burst: float|None
+        :param rate_burst: Maximum number of calls made at once.
+
+        :type rate_limit_min: float|None
+        :param rate_limit_min: Rate the limiter doesn't go below when Confluence throttles calls.
+
+        :type concurrency: int|None
+        :param concurrency: Maximum number of pages written at the same time by the process. None - no limit.
+        """
+        self.name = name
+        self.url = url
+        self.username = username
+        self.password = password
+        self.space_key = space_key
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.rate_limit = rate_limit
+        self.rate_burst = rate_burst
+        self.rate_limit_min = rate_limit_min
+        self.concurrency = concurrency
+        self.semaphore = threading.BoundedSemaphore(concurrency) if concurrency else None
+        # asyncio semaphores can't be shared by event loops, so there is one per loop. Semaphores of closed loops
+        # are dropped.
+        self.async_semaphores = weakref.WeakKeyDictionary()
+
+    def __repr__(self):
+        return "<ConfluenceTarget {}: {} {}>".format(self.name, self.url, self.space_key)
+
+    @property
+    def cache_namespace(self):
+        """
+        Namespace of the page cache, so pages of the same space key on different instances don't collide.
+
+        :rtype: str
+        :returns: Target name and space key.
+        """
+        return "{}:{}".format(self.name, self.space_key)
+
+    @contextmanager
+    def slot(self):
+        """
+        Context manager holding one of `concurrency` page write slots of the target, waits for a free one.
+        """
+        if self.semaphore is None:
+            yield
+            return
+        with self.semaphore:
+            yield
+
+    def get_async_semaphore(self):
+        """
+        Get semaphore of the running event loop. Should be called in the event loop.
+
+        :rtype: asyncio.Semaphore|None
+        :returns: Semaphore or None if concurrency isn't limited.
+        """
+        if not self.concurrency:
+            return None
+        loop = asyncio.get_running_loop()
+        with _lock:
+            for closed_loop in [other for other in self.async_semaphores if other.is_closed()]:
+                del self.async_semaphores[closed_loop]
+            if loop not in self.async_semaphores:
+                self.async_semaphores[loop] = asyncio.Semaphore(self.concurrency)
+            return self.async_semaphores[loop]
+
+
+def make_target(name, config):
+    """
+    Build target from its settings. Options which are not given are taken from global `DNC_CONFLUENCE_*` settings.
+
+    :type name: str
+    :param name: Name of the target.
+
+    :type config: dict
+    :param config: Item of `DNC_CONFLUENCE_TARGETS` setting.
+
+    :raises: WikiUpdateException
+
+    :rtype: ConfluenceTarget
+    :returns: Target object.
+    """
+    try:
+        return ConfluenceTarget(
+            name, config['url'], config['username'], config['password'], config['space_key'],
+            pool_size=config.get('pool_size', getattr(settings, 'DNC_CONFLUENCE_POOL_SIZE', 10)),
+            timeout=config.get('timeout', getattr(settings, 'DNC_CONFLUENCE_TIMEOUT', 60)),
+            rate_limit=config.get('rate_limit', getattr(settings, 'DNC_CONFLUENCE_RATE_LIMIT', None)),
+            rate_burst=config.get('rate_burst', getattr(settings, 'DNC_CONFLUENCE_RATE_BURST', None)),
+            rate_limit_min=config.get('rate_limit_min', getattr(settings, 'DNC_CONFLUENCE_RATE_LIMIT_MIN', None)),
+            concurrency=config.get('concurrency', getattr(settings, 'DNC_CONFLUENCE_CONCURRENCY', None)),
+        )
+    except (KeyError, TypeError) as e:
+        raise WikiUpdateException("Confluence target `{}` {}: Please check configuration in settings file."
+                                  .format(name, e))
+
+
+def load_targets():
+    """
+    Build targets from `DNC_CONFLUENCE_TARGETS` setting. Without it the only target is `default` configured by
+    `DNC_CONFLUENCE_CREDENTIALS` and `DNC_SPACE_KEY`.
+
+    :raises: WikiUpdateException
+
+    :rtype: OrderedDict
+    :returns: Mapping of target name to ConfluenceTarget.
+    """
+    config = getattr(settings, 'DNC_CONFLUENCE_TARGETS', None)
+    if not config:
+        try:
+            config = {DEFAULT_TARGET: dict(settings.DNC_CONFLUENCE_CREDENTIALS, space_key=settings.DNC_SPACE_KEY)}
+        except (AttributeError, TypeError, ValueError) as e:
+            raise WikiUpdateException("{}: Please check configuration in settings file.".format(e))
+    return OrderedDict((name, make_target(name, config[name])) for name in config)
+
+
+def get_targets():
+    """
+    Get all configured targets. Built on first call and kept for the process lifetime.
+
+    :raises: WikiUpdateException
+
+    :rtype: OrderedDict
+    :returns: Mapping of target name to ConfluenceTarget.
+    """
+    with _lock:
+        if _targets[0] is None:
+            _targets[0] = load_targets()
+        return _targets[0]
+
+
+def reset():
+    """
+    Forget targets built from settings, e.g. after settings are changed in tests.
+
+    :rtype: void
+    :returns: void
+    """
+    with _lock:
+        _targets[0] = None
+
+
+def get_target(name):
+    """
+    Get target by name.
+
+    :type name: str
+    :param name: Name of the target.
+
+    :raises: WikiUpdateException
+
+    :rtype: ConfluenceTarget
+    :returns: Target object.
+    """
+    try:
+        return get_targets()[name]
+    except KeyError:
+        raise WikiUpdateException("Confluence target `{}` is not configured. "
+                                  "Please check `DNC_CONFLUENCE_TARGETS` setting.".format(name))
+
+
+def parse_names(value):
+    """
+    Parse comma separated target names.
+
+    :type value: str
+    :param value: Target names, e.g. `ops, network`.
+
+    :rtype: tuple
+    :returns: Target names. Empty if the value is blank.
+    """
+    return tuple(name.strip() for name in value.split(',') if name.strip())
+
+
+def get_model_targets(model_name):
+    """
+    Get targets written by default for changes of the model. Routes are configured by `DNC_TARGET_ROUTES` setting:
+    mapping of model name(or `*` for all other models) to list of target names.
+
+    :type model_name: str
+    :param model_name: NetBox model name.
+
+    :raises: WikiUpdateException
+
+    :rtype: tuple
+    :returns: Target names.
+    """
+    routes = getattr(settings, 'DNC_TARGET_ROUTES', {})
+    names = routes.get(model_name, routes.get('*', (DEFAULT_TARGET,)))
+    if isinstance(names, str):
+        names = parse_names(names)
+    for name in names:
+        get_target(name)
+    return tuple(names)
+
+
+def get_executor():
+    """
+    Get thread pool writing targets of a fan-out in parallel. Size is configured by `DNC_TARGET_FANOUT_WORKERS`.
+
+    :rtype: ThreadPoolExecutor
+    :returns: Executor shared within the process.
+    """
+    with _lock:
+        if _executor[0] is None:
+            _executor[0] = ThreadPoolExecutor(max_workers=getattr(settings, 'DNC_TARGET_FANOUT_WORKERS', 8),
+                                              thread_name_prefix='dnc-fanout')
+        return _executor[0]
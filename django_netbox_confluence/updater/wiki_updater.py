@@ -1,8 +1,16 @@
+import asyncio
+from collections import OrderedDict
+
 from django.conf import settings
 
+from django_netbox_confluence import metrics
+from django_netbox_confluence.related_objects import RelatedObjectResolver
+from django_netbox_confluence.updater.async_confluence_adapter import AsyncConfluenceAdapter
 from django_netbox_confluence.updater.confluence_adapter import ConfluenceAdapter
-from django_netbox_confluence.updater.exceptioins import WikiUpdateException
-from django_netbox_confluence.models import NetBoxConfluenceField
+from django_netbox_confluence.updater import field_paths, field_plans, sharding, targets
+from django_netbox_confluence.updater.exceptioins import (ConfluenceUnavailableException, PageConflictException,
+                                                           WikiUpdateException)
+from django_netbox_confluence.updater.linked_fields import ABCLinkedFieldMeta
 
 
 class WikiPageUpdater(object):
@@ -13,35 +21,98 @@ class WikiPageUpdater(object):
     def __init__(self, data):
         self.model_name = data['model']
         self.data = data
-        self.page_title = self.generate_page_name(self.model_name)
+        self.sharding = sharding.get_strategy(self.model_name)
+        self.object_key = self.sharding.get_object_key(data)
+        self.page_title = self.sharding.get_page_title(self.object_key)
+        # Targets of the model route, fields may be routed to their own targets.
+        self.targets = targets.get_model_targets(self.model_name)
+        # Plans of the fields changed by the event, see `get_changed_plans`.
+        self.changed_plans = None
 
-        # Check whether settings for confluence updater exist.
-        try:
-            url = settings.DNC_CONFLUENCE_CREDENTIALS['url']
-            username = settings.DNC_CONFLUENCE_CREDENTIALS['username']
-            password = settings.DNC_CONFLUENCE_CREDENTIALS['password']
-            space_key = settings.DNC_SPACE_KEY
-        except (AttributeError, KeyError) as e:
-            raise WikiUpdateException("{}: Please check configuration in settings file.".format(e))
+    @staticmethod
+    def get_confluence_adapter(target_name=targets.DEFAULT_TARGET):
+        """
+        Get shared Confluence adapter of the target.
 
-        self.confluence = ConfluenceAdapter(url, username, password, space_key)
+        :type target_name: str
+        :param target_name: Name of the Confluence target.
+
+        :raises: WikiUpdateException
+
+        :rtype: ConfluenceAdapter
+        :returns: Adapter for the target Confluence space.
+        """
+        return ConfluenceAdapter.get_shared(targets.get_target(target_name))
 
     @staticmethod
-    def generate_page_name(model_name):
+    def generate_page_name(model_name, data=None):
         """
         Generate page name on the Wiki.
 
         :type model_name: str
         :param model_name: Model name which was changed.
 
+        :type data: dict|None
+        :param data: Webhook body. Required when pages of the model are sharded by object.
+
+        :raises: WikiUpdateException
+
         :rtype: str
-        :returns: Name of the page that should correspond to the changed model on the NetBox.
+        :returns: Name of the page that should correspond to the changed object on the NetBox.
+        """
+        strategy = sharding.get_strategy(model_name)
+        return strategy.get_page_title(strategy.get_object_key(data))
+
+    def get_snapshots(self):
+        """
+        Get snapshots of the object before and after the change, sent by newer NetBox versions.
+
+        :rtype: tuple(dict, dict)|None
+        :returns: Pre-change and post-change snapshots. None if the payload doesn't have both(e.g. object is created or
+        deleted) or diffing is disabled by `DNC_SNAPSHOT_DIFF_ENABLED`.
+        """
+        if not getattr(settings, 'DNC_SNAPSHOT_DIFF_ENABLED', True):
+            return None
+        snapshots = self.data.get('snapshots')
+        if type(snapshots) is not dict:
+            return None
+        prechange, postchange = snapshots.get('prechange'), snapshots.get('postchange')
+        if type(prechange) is not dict or type(postchange) is not dict:
+            return None
+        return prechange, postchange
+
+    def get_changed_plans(self):
+        """
+        Get plans of the configured fields changed by the event. All fields are changed if the payload has no snapshots.
+        Plans are taken once per event.
+
+        :raises: WikiUpdateException
+
+        :rtype: list
+        :returns: List of FieldPlan.
         """
-        return "partials-{}".format(model_name)
+        if self.changed_plans is not None:
+            return self.changed_plans
+        # Get all fields that are configured by Django admin panel. Configuration is cached until it is changed.
+        with metrics.timer('dnc_stage_duration_seconds', stage='fields', model=self.model_name):
+            plans = field_plans.get_field_plans(self.model_name)
+        snapshots = self.get_snapshots()
+        if snapshots is not None:
+            changed = [plan for plan in plans if field_paths.is_changed(snapshots[0], snapshots[1], plan.steps)]
+            # Objects share excerpts of the single page, so all fields of the changed object are written to keep
+            # the excerpts holding values of the same object.
+            if changed and not self.sharding.per_object:
+                changed = plans
+            if len(changed) < len(plans):
+                metrics.increment('dnc_unchanged_fields_total', len(plans) - len(changed), model=self.model_name)
+            plans = changed
+        self.changed_plans = plans
+        return plans
 
     def get_field_chain(self):
         """
-        Create fields chain. List of AbstractLinkedField derivatives.
+        Create fields chain. List of AbstractLinkedField derivatives. Fields not changed by the event are left out, so
+        the chain is empty(and the page isn't fetched) when none of the configured fields is changed.
 
         :raises: WikiUpdateException
 
@@ -49,46 +120,351 @@ class WikiPageUpdater(object):
         :returns: List of LinkedFields.
         """
         field_chain = list()
-        # Get all fields that are configured by Django admin panel.
-        fields = NetBoxConfluenceField.objects.filter(model_name=self.model_name)
-
-        for field in fields:
-            # Get field value form webhook request payload.
+        plans = self.get_changed_plans()
+        self.prefetch_related([self])
+        for plan in plans:
+            # Get field value form webhook request payload, related objects are loaded from NetBox.
             try:
-                if field.is_custom_field:
-                    new_value = self.data['data']['custom_fields'][field.field_name]
-                else:
-                    new_value = self.data['data'][field.field_name]
+                new_value = plan.accessor(self.data['data'])
             except KeyError:
                 raise WikiUpdateException("Field {} is configured in updater but does not present in webhook payload."
-                                          " May be `Is Custom Field` checkbox wrong state.".format(field))
+                                          " May be `Is Custom Field` checkbox wrong state.".format(plan.label))
             # Create AbstractLinkedField derivative class object.
-            field_object = field.field_type_class(field.field_name, new_value, is_custom=field.is_custom_field)
+            field_object = plan.field_class(plan.field_name, new_value, is_custom=plan.is_custom)
+            field_object.excerpt_name = self.sharding.get_excerpt_name(self.object_key, field_object.name)
+            field_object.targets = plan.targets or self.targets
             # Append to chain list.
             field_chain.append(field_object)
 
         return field_chain
 
+    @staticmethod
+    def prefetch_related(updaters):
+        """
+        Load related objects needed by changed fields of the events, so objects of the same endpoint are loaded by one
+        NetBox request instead of a request per field and event. Loaded objects are cached. Errors are not raised here,
+        fields whose objects couldn't be loaded fail on their own when the field chain is built.
+
+        :type updaters: list
+        :param updaters: Updaters of the events.
+
+        :rtype: void
+        :returns: void
+        """
+        references = list()
+        for updater in updaters:
+            try:
+                plans = updater.get_changed_plans()
+            except WikiUpdateException:
+                continue
+            for plan in plans:
+                reference = plan.field_class.get_unresolved(updater.data['data'], plan.steps)
+                if reference is not None:
+                    references.append(reference)
+        if not references:
+            return
+        try:
+            RelatedObjectResolver.get_shared().resolve(references)
+        except WikiUpdateException:
+            pass
+
+    @staticmethod
+    def merge_field_chains(field_chains):
+        """
+        Merge field chains of several events of the same page into one chain.
+        When the same excerpt(field of the same object) appears in several chains the value from the later chain wins.
+
+        :type field_chains: list
+        :param field_chains: List of field chains ordered from the oldest event to the newest one.
+
+        :rtype: list
+        :returns: List of LinkedFields.
+        """
+        merged = OrderedDict()
+        for field_chain in field_chains:
+            for field in field_chain:
+                merged[field.excerpt_name] = field
+        return list(merged.values())
+
     def update(self):
         """
         Update the data on the Wiki page to correspond the date from webhook.
 
         :raises: WikiUpdateException
 
-        :rtype: void
-        :returns: void
+        :rtype: bool
+        :returns: Whether the page was written. False when the page already had all the values.
         """
         # Implemented as chain of responsibilities.
         # Each field will change its own field for which it is responsible and pass data to another one.
         # [LinkedField1, LinkedField2, ...]
         # (Wikis old content) -> LinkedField1 -> LinkedField2 -> ... -> (Wikis new content).
-        field_chain = self.get_field_chain()
+        return self.write(self.get_field_chain())
+
+    def provide_values(self, field_chain):
+        """
+        Provide values of the fields whose types have batch hook before the chain is written to the targets, so each
+        type makes one call for the whole chain(or merged chains of a batch) instead of a call per field and target.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
 
-        page_id, page_content = self.confluence.get_page_or_create(self.page_title)
+        :rtype: void
+        :returns: void
+        """
+        if not ABCLinkedFieldMeta.has_batch_hook(field_chain):
+            return
+        with metrics.timer('dnc_stage_duration_seconds', stage='provide', model=self.model_name):
+            ABCLinkedFieldMeta.provide_chain_values(field_chain)
+
+    @staticmethod
+    def split_by_target(field_chain):
+        """
+        Split field chain into chains of the Confluence targets the fields are routed to.
 
-        # Provide page content to each field so each will update the content with it specific way.
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :rtype: OrderedDict
+        :returns: Mapping of target name to list of LinkedFields.
+        """
+        chains = OrderedDict()
         for field in field_chain:
-            page_content = self.confluence.update_content_for_field(page_content, field)
+            for name in field.targets or (targets.DEFAULT_TARGET,):
+                chains.setdefault(name, list()).append(field)
+        return chains
+
+    @staticmethod
+    def raise_target_errors(errors):
+        """
+        Raise errors of the targets which failed. The only error is raised as is. Several errors are joined into one,
+        it is ConfluenceUnavailableException if all targets are unavailable, so the update is retried later.
+
+        :type errors: list
+        :param errors: List of (target name, exception) tuples.
+
+        :raises: WikiUpdateException
+
+        :rtype: void
+        :returns: void
+        """
+        if not errors:
+            return
+        if len(errors) == 1:
+            raise errors[0][1]
+        message = "Writing to Confluence targets failed: {}".format(
+            "; ".join("{}: {}".format(name, error) for name, error in errors))
+        if all(isinstance(error, ConfluenceUnavailableException) for _, error in errors):
+            raise ConfluenceUnavailableException(message, retry_after=max(error.retry_after or 0
+                                                                          for _, error in errors) or None)
+        raise WikiUpdateException(message)
+
+    def write(self, field_chain):
+        """
+        Apply field chain to the Wiki page with single fetch and single save per Confluence target. Targets are
+        written in parallel, a target which fails doesn't stop the others.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written. False when all targets already had all the values.
+        """
+        # Nothing to write, so the page isn't even fetched(or created).
+        if not field_chain:
+            return False
+
+        self.provide_values(field_chain)
+        chains = self.split_by_target(field_chain)
+        names = list(chains)
+        # The first target is written by the calling thread, the others by the fan-out pool.
+        futures = [(name, targets.get_executor().submit(self.write_target, name, chains[name])) for name in names[1:]]
+        written, errors = False, list()
+        try:
+            written = self.write_target(names[0], chains[names[0]])
+        except WikiUpdateException as e:
+            errors.append((names[0], e))
+        for name, future in futures:
+            try:
+                written = future.result() or written
+            except WikiUpdateException as e:
+                errors.append((name, e))
+        self.raise_target_errors(errors)
+        return written
+
+    def write_target(self, target_name, field_chain):
+        """
+        Apply field chain to the Wiki page of the target. Waits for a free slot if the target limits concurrent writes.
+
+        :type target_name: str
+        :param target_name: Name of the Confluence target.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written. False when the page already had all the values.
+        """
+        target = targets.get_target(target_name)
+        confluence = ConfluenceAdapter.get_shared(target)
+        # Model and target labels are added to metrics of all stages including those recorded by the adapter.
+        with metrics.labels(model=self.model_name, target=target.name), target.slot():
+            try:
+                return self.patch_page(confluence, field_chain)
+            except PageConflictException:
+                # Local copy of the page was outdated, so the page is read from Confluence and patched again.
+                return self.patch_page(confluence, field_chain)
+
+    def patch_page(self, confluence, field_chain):
+        """
+        Fetch the page, apply field chain and save the page if anything is changed.
+
+        :type confluence: ConfluenceAdapter
+        :param confluence: Adapter of the target.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException, PageConflictException
+
+        :rtype: bool
+        :returns: Whether the page was written.
+        """
+        with metrics.timer('dnc_stage_duration_seconds', stage='fetch'):
+            page_id, page_content = confluence.get_page_or_create(self.page_title)
+
+        # Saving creates new page version, so it is done only when there are changes.
+        with metrics.timer('dnc_stage_duration_seconds', stage='patch'):
+            changed = self.apply_field_chain(page_content, field_chain)
+        if not changed:
+            metrics.increment('dnc_page_writes_total', result='skipped')
+            return False
 
         # After all fields are done with the changes update page content.
-        self.confluence.update_page_content(page_id, self.page_title, page_content)
+        with metrics.timer('dnc_stage_duration_seconds', stage='save'):
+            confluence.update_page_content(page_id, self.page_title, page_content)
+        metrics.increment('dnc_page_writes_total', result='written')
+        return True
+
+    async def awrite(self, field_chain):
+        """
+        Same as `write` but uses non-blocking Confluence adapters, targets are written concurrently by the event loop.
+        Should be awaited in the event loop.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written. False when all targets already had all the values.
+        """
+        if not field_chain:
+            return False
+
+        if ABCLinkedFieldMeta.has_batch_hook(field_chain):
+            # Batch hooks may make blocking external calls, so they don't run in the event loop.
+            await asyncio.get_running_loop().run_in_executor(targets.get_executor(), self.provide_values, field_chain)
+        chains = self.split_by_target(field_chain)
+        results = await asyncio.gather(*[self.awrite_target(name, chain) for name, chain in chains.items()],
+                                       return_exceptions=True)
+        written, errors = False, list()
+        for name, result in zip(chains, results):
+            if isinstance(result, WikiUpdateException):
+                errors.append((name, result))
+            elif isinstance(result, BaseException):
+                raise result
+            else:
+                written = result or written
+        self.raise_target_errors(errors)
+        return written
+
+    async def awrite_target(self, target_name, field_chain):
+        """
+        Same as `write_target` but uses non-blocking Confluence adapter.
+
+        :type target_name: str
+        :param target_name: Name of the Confluence target.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException
+
+        :rtype: bool
+        :returns: Whether the page was written. False when the page already had all the values.
+        """
+        target = targets.get_target(target_name)
+        semaphore = target.get_async_semaphore()
+        if semaphore is None:
+            return await self._awrite_target(target, field_chain)
+        async with semaphore:
+            return await self._awrite_target(target, field_chain)
+
+    async def _awrite_target(self, target, field_chain):
+        confluence = AsyncConfluenceAdapter.get_shared(target)
+        with metrics.labels(model=self.model_name, target=target.name):
+            try:
+                return await self.apatch_page(confluence, field_chain)
+            except PageConflictException:
+                return await self.apatch_page(confluence, field_chain)
+
+    async def apatch_page(self, confluence, field_chain):
+        """
+        Same as `patch_page` but uses non-blocking Confluence adapter.
+
+        :type confluence: AsyncConfluenceAdapter
+        :param confluence: Adapter of the target.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :raises: WikiUpdateException, PageConflictException
+
+        :rtype: bool
+        :returns: Whether the page was written.
+        """
+        with metrics.timer('dnc_stage_duration_seconds', stage='fetch'):
+            page_id, page_content = await confluence.get_page_or_create(self.page_title)
+
+        with metrics.timer('dnc_stage_duration_seconds', stage='patch'):
+            changed = self.apply_field_chain(page_content, field_chain)
+        if not changed:
+            metrics.increment('dnc_page_writes_total', result='skipped')
+            return False
+
+        with metrics.timer('dnc_stage_duration_seconds', stage='save'):
+            await confluence.update_page_content(page_id, self.page_title, page_content)
+        metrics.increment('dnc_page_writes_total', result='written')
+        return True
+
+    @staticmethod
+    def apply_field_chain(page_content, field_chain):
+        """
+        Provide page content to each field so each will update the content with it specific way.
+        Fields which already have the same value on the page are skipped.
+
+        :type page_content: PageDocument
+        :param page_content: Wiki page content.
+
+        :type field_chain: list
+        :param field_chain: List of LinkedFields.
+
+        :rtype: bool
+        :returns: Whether any field was changed.
+        """
+        # Values are usually provided by the updater already, but the chain may be applied directly, e.g. by `dnc_reshard`.
+        ABCLinkedFieldMeta.provide_chain_values(field_chain)
+        changed = False
+        for field in field_chain:
+            if ConfluenceAdapter.is_field_up_to_date(page_content, field):
+                continue
+            page_content = ConfluenceAdapter.update_content_for_field(page_content, field)
+            changed = True
+        return changed
@@ -6,4 +6,7 @@ from . import views
 app_name = 'django_netbox_confluence'
 urlpatterns = [
     path('model_change_trigger/', views.ModelChangeTriggerView.as_view()),
+    path('async/model_change_trigger/', views.AsyncModelChangeTriggerView.as_view()),
+    path('batch/model_change_trigger/', views.BatchModelChangeTriggerView.as_view()),
+    path('metrics/', views.MetricsView.as_view()),
 ]
@@ -1,11 +1,23 @@
 import json
+import math
+import re
+from collections import OrderedDict
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
 
 from django.conf import settings
+from django.db import transaction
 from django.views import View
 from django.utils.decorators import method_decorator
 from django.views.decorators.csrf import csrf_exempt
-from django.http.response import JsonResponse
+from django.http.response import HttpResponse, JsonResponse
+from django.http import Http404
 
+from django_netbox_confluence import dead_letters, deliveries, jobs, metrics, profiling
+from django_netbox_confluence.admission import aadmit, admit
+from django_netbox_confluence.models import DeadLetter
+from django_netbox_confluence.updater import field_plans
+from django_netbox_confluence.updater.exceptioins import AdmissionRejectedException, ConfluenceUnavailableException
 from django_netbox_confluence.updater.wiki_updater import WikiPageUpdater, WikiUpdateException
 from django_netbox_confluence.auth import authentication_required
 
@@ -15,6 +27,13 @@ class NetBoxVikiAPIView(View):
     Base for all NetBox webhook handlers.
     """
     http_method_names = ['post']
+    # Top level `model` key placed before any nested object or list. NetBox puts it before `data`, so the model is
+    # known without decoding the whole body. Keys of nested objects(like `model` of device type) are never matched.
+    MODEL_PEEK_RE = re.compile(rb'\A\s*\{[^{}\[\]]*?"model"\s*:\s*"([^"\\]*)"')
+    DEDUPLICATED_MESSAGES = {
+        deliveries.RESULT_DUPLICATE: "Event was already delivered.",
+        deliveries.RESULT_STALE: "Newer event was already delivered.",
+    }
 
     @method_decorator(csrf_exempt)
     def dispatch(self, *args, **kwargs):
@@ -32,6 +51,79 @@ class NetBoxVikiAPIView(View):
         """
         return json.loads(request.body)
 
+    def peek_model(self, request):
+        """
+        Get model name from the beginning of the request body without decoding it.
+
+        :type request: WSGIRequest
+        :param request: Request object.
+
+        :rtype: str|None
+        :returns: Model name. None if it can't be found cheaply, then the whole body should be decoded.
+        """
+        if not getattr(settings, 'DNC_WEBHOOK_PEEK_MODEL', True):
+            return None
+        match = self.MODEL_PEEK_RE.match(request.body)
+        if match is None:
+            return None
+        try:
+            return match.group(1).decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+
+    def dropped_response(self, model_name):
+        """
+        Make response for the webhook of the model which has no configured fields. Nothing is written for such
+        webhooks, so they are acknowledged without touching Confluence or the queue.
+
+        :type model_name: str
+        :param model_name: Model name from webhook payload.
+
+        :rtype: HttpResponse
+        :returns: Response with 204 status.
+        """
+        metrics.increment('dnc_webhooks_dropped_total', model=model_name)
+        return HttpResponse(status=204)
+
+    def deduplicated_response(self, reason):
+        """
+        Make response for the event which was already delivered or is older than the delivered one. Nothing is written
+        for such events.
+
+        :type reason: str
+        :param reason: `duplicate` or `stale`.
+
+        :rtype: JsonResponse
+        :returns: Response with 200 status.
+        """
+        return JsonResponse({
+            "message": self.DEDUPLICATED_MESSAGES[reason],
+            "error": None,
+            "result": reason,
+        }, status=200)
+
+    def keep_failed(self, data, error, source=DeadLetter.SOURCE_WEBHOOK, page_title=None):
+        """
+        Keep failed event as dead letter and forget its delivery, so it is written if NetBox delivers it again.
+
+        :type data: dict
+        :param data: Validated webhook body.
+
+        :type error: Exception
+        :param error: Reason of the failure.
+
+        :type source: str
+        :param source: One of `DeadLetter.SOURCE_*`.
+
+        :type page_title: str|None
+        :param page_title: Title of the page.
+
+        :rtype: void
+        :returns: void
+        """
+        dead_letters.store(data, error, source, page_title=page_title)
+        deliveries.forget(data)
+
     def validate_data(self, data):
         """
         Validating whether webhook body is formed right.
@@ -42,6 +134,7 @@ class NetBoxVikiAPIView(View):
         :rtype: void
         :returns: void
         """
+        assert type(data) is dict, "Webhook payload should be object, got {}".format(type(data))
         assert "model" in data, "No `model` in webhook payload."
         assert type(data["model"]) is str, "`model` should be string, got {}".format(type(data["model"]))
 
@@ -52,34 +145,453 @@ class NetBoxVikiAPIView(View):
         assert type(data["data"]["custom_fields"]) is dict, ("`custom_fields` should be dict, got {}"
                                                              .format(type(data["data"]["custom_fields"])))
 
+    def unavailable_response(self, error):
+        """
+        Make response for the case when Confluence can't take requests now.
+
+        :type error: ConfluenceUnavailableException
+        :param error: Raised exception.
+
+        :rtype: JsonResponse
+        :returns: Response with 503 status and Retry-After header when the delay is known.
+        """
+        response = JsonResponse({
+            "message": "Confluence is unavailable.",
+            "error": str(error),
+        }, status=503)
+        if error.retry_after is not None:
+            response['Retry-After'] = str(int(math.ceil(error.retry_after)))
+        return response
+
+    def rejected_response(self, error):
+        """
+        Make response for the update which wasn't admitted because too many updates are in flight.
+
+        :type error: AdmissionRejectedException
+        :param error: Raised exception.
+
+        :rtype: JsonResponse
+        :returns: Response with 429 status and Retry-After header.
+        """
+        response = JsonResponse({
+            "message": "Too many updates in flight.",
+            "error": str(error),
+        }, status=429)
+        if error.retry_after is not None:
+            response['Retry-After'] = str(int(math.ceil(error.retry_after)))
+        return response
+
 
 class ModelChangeTriggerView(NetBoxVikiAPIView):
     """
     Webhook handler.
     """
 
+    @metrics.timed_view('dnc_webhook_duration_seconds')
     @authentication_required
+    @profiling.profiled_view
     def post(self, request):
+        # Most webhooks of unconfigured models are dropped before the body is decoded.
+        model_name = self.peek_model(request)
+        if model_name is not None and not field_plans.is_configured(model_name):
+            return self.dropped_response(model_name)
+
+        # Take data form NetBox webhook payload and validate format.
+        parse_timer = metrics.timer('dnc_stage_duration_seconds', stage='parse', model='')
+        try:
+            with parse_timer:
+                data = self.serialize_data(request)
+                self.validate_data(data)
+                parse_timer.labels['model'] = data['model']
+        except (json.JSONDecodeError, AssertionError) as e:
+            return JsonResponse({
+                "message": "Invalid input.",
+                "error": str(e),
+            }, status=400)
+
+        # Checked again if the model couldn't be peeked.
+        if data['model'] != model_name and not field_plans.is_configured(data['model']):
+            return self.dropped_response(data['model'])
+
+        if getattr(settings, 'DNC_QUEUE_ENABLED', True):
+            # Repeated and out-of-order deliveries would overwrite the page with the same or older values.
+            reason = deliveries.check(data)
+            if reason is not None:
+                return self.deduplicated_response(reason)
+
+            # Confluence is updated by `dnc_worker` so the webhook doesn't wait for it.
+            try:
+                job = jobs.enqueue(data)
+            except WikiUpdateException as e:
+                deliveries.forget(data)
+                return JsonResponse({
+                    "message": "Invalid input.",
+                    "error": str(e),
+                }, status=400)
+            return JsonResponse({
+                "message": "Queued.",
+                "error": None,
+                "job": job.pk,
+            }, status=202)
+
+        try:
+            updater = WikiPageUpdater(data)
+            # Updates beyond the configured in-flight limits wait for a slot and are rejected after a while. Delivery
+            # is checked in the slot, so rejected events aren't remembered and are written when NetBox retries them.
+            with admit(updater.page_title):
+                reason = deliveries.check(data)
+                if reason is not None:
+                    return self.deduplicated_response(reason)
+                written = updater.update()
+        except AdmissionRejectedException as e:
+            # Shedding load, so nothing is stored. Response asks NetBox to retry.
+            return self.rejected_response(e)
+        except ConfluenceUnavailableException as e:
+            # NetBox doesn't reliably retry webhooks, so failed events are kept for replay.
+            self.keep_failed(data, e)
+            return self.unavailable_response(e)
+        except WikiUpdateException as e:
+            self.keep_failed(data, e)
+            return JsonResponse({
+                "message": "Update failed.",
+                "error": str(e),
+            }, status=400)
+
+        if not written:
+            return JsonResponse({
+                "message": "Page is up to date.",
+                "error": None,
+                "result": "skipped",
+            }, status=200)
+
+        return JsonResponse({
+            "message": "Successfully updated.",
+            "error": None,
+            "result": "written",
+        }, status=201)
+
+
+class AsyncModelChangeTriggerView(NetBoxVikiAPIView):
+    """
+    Webhook handler for ASGI deployments. Waits for Confluence without blocking the worker, so one worker serves many
+    webhooks concurrently.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # Django handles class based view as async only since 4.1, so the view function is marked explicitly.
+        return markcoroutinefunction(super().as_view(**initkwargs))
+
+    async def http_method_not_allowed(self, request, *args, **kwargs):
+        return super().http_method_not_allowed(request, *args, **kwargs)
+
+    @metrics.timed_view('dnc_webhook_duration_seconds')
+    @authentication_required
+    @profiling.profiled_view
+    async def post(self, request):
+        # Configured models may be read from database, which can't be accessed from async code directly.
+        model_name = self.peek_model(request)
+        if model_name is not None and not await sync_to_async(field_plans.is_configured)(model_name):
+            return self.dropped_response(model_name)
+
         # Take data form NetBox webhook payload and validate format.
+        parse_timer = metrics.timer('dnc_stage_duration_seconds', stage='parse', model='')
         try:
-            data = self.serialize_data(request)
-            self.validate_data(data)
+            with parse_timer:
+                data = self.serialize_data(request)
+                self.validate_data(data)
+                parse_timer.labels['model'] = data['model']
         except (json.JSONDecodeError, AssertionError) as e:
             return JsonResponse({
                 "message": "Invalid input.",
                 "error": str(e),
             }, status=400)
 
-        # TODO: Handle in queue.
+        if data['model'] != model_name and not await sync_to_async(field_plans.is_configured)(data['model']):
+            return self.dropped_response(data['model'])
+
+        if getattr(settings, 'DNC_QUEUE_ENABLED', True):
+            reason = await sync_to_async(deliveries.check)(data)
+            if reason is not None:
+                return self.deduplicated_response(reason)
+
+            try:
+                job = await sync_to_async(jobs.enqueue)(data)
+            except WikiUpdateException as e:
+                await sync_to_async(deliveries.forget)(data)
+                return JsonResponse({
+                    "message": "Invalid input.",
+                    "error": str(e),
+                }, status=400)
+            return JsonResponse({
+                "message": "Queued.",
+                "error": None,
+                "job": job.pk,
+            }, status=202)
+
         try:
-            WikiPageUpdater(data).update()
+            updater = WikiPageUpdater(data)
+            async with aadmit(updater.page_title):
+                reason = await sync_to_async(deliveries.check)(data)
+                if reason is not None:
+                    return self.deduplicated_response(reason)
+                # Fields configuration may be read from database, which can't be accessed from async code directly.
+                field_chain = await sync_to_async(updater.get_field_chain)()
+                written = await updater.awrite(field_chain)
+        except AdmissionRejectedException as e:
+            return self.rejected_response(e)
+        except ConfluenceUnavailableException as e:
+            await sync_to_async(self.keep_failed)(data, e)
+            return self.unavailable_response(e)
         except WikiUpdateException as e:
+            await sync_to_async(self.keep_failed)(data, e)
             return JsonResponse({
                 "message": "Update failed.",
                 "error": str(e),
             }, status=400)
 
+        if not written:
+            return JsonResponse({
+                "message": "Page is up to date.",
+                "error": None,
+                "result": "skipped",
+            }, status=200)
+
         return JsonResponse({
             "message": "Successfully updated.",
             "error": None,
+            "result": "written",
         }, status=201)
+
+
+class BatchModelChangeTriggerView(NetBoxVikiAPIView):
+    """
+    Webhook handler for many events in one request, e.g. from scripts and replay tools. Body is JSON array of webhook
+    payloads or NDJSON(one payload per line). Events of the same page are applied with single fetch and single save.
+    Response has result of each event in the same order as the events.
+    """
+
+    def serialize_events(self, request):
+        """
+        Split request body into events.
+
+        :type request: WSGIRequest
+        :param request: Request object.
+
+        :raises: json.JSONDecodeError, AssertionError
+
+        :rtype: list
+        :returns: Decoded payloads. NDJSON lines which can't be decoded are kept as raised exceptions.
+        """
+        body = request.body.lstrip()
+        if body[:1] == b'[':
+            return json.loads(body)
+        assert body, "No events in the request."
+
+        events = list()
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                events.append(e)
+        return events
+
+    @staticmethod
+    def event_result(status, message, error=None, **extra):
+        """
+        Make result of one event. Has the same fields as response of the single event webhook.
+
+        :type status: int
+        :param status: Status the single event webhook would respond with.
+
+        :type message: str
+        :param message: Message.
+
+        :type error: str|None
+        :param error: Error description.
+
+        :param extra: Additional fields, e.g. `job` or `result`.
+
+        :rtype: dict
+        :returns: Event result.
+        """
+        result = {"status": status, "message": message, "error": error}
+        result.update(extra)
+        return result
+
+    @metrics.timed_view('dnc_webhook_duration_seconds')
+    @authentication_required
+    @profiling.profiled_view
+    def post(self, request):
+        try:
+            events = self.serialize_events(request)
+            assert type(events) is list, "Batch should be array of webhook payloads, got {}".format(type(events))
+        except (json.JSONDecodeError, AssertionError) as e:
+            return JsonResponse({
+                "message": "Invalid input.",
+                "error": str(e),
+            }, status=400)
+
+        max_events = getattr(settings, 'DNC_BATCH_MAX_EVENTS', 1000)
+        if len(events) > max_events:
+            return JsonResponse({
+                "message": "Too many events.",
+                "error": "Batch has {} events, at most {} are accepted.".format(len(events), max_events),
+            }, status=413)
+
+        results = [None] * len(events)
+        accepted = list()
+        for index, data in enumerate(events):
+            try:
+                if isinstance(data, json.JSONDecodeError):
+                    raise data
+                self.validate_data(data)
+            except (json.JSONDecodeError, AssertionError) as e:
+                results[index] = self.event_result(400, "Invalid input.", str(e))
+                continue
+            if not field_plans.is_configured(data['model']):
+                metrics.increment('dnc_webhooks_dropped_total', model=data['model'])
+                results[index] = self.event_result(204, "Model has no configured fields.", result="dropped")
+                continue
+            accepted.append((index, data))
+
+        if getattr(settings, 'DNC_QUEUE_ENABLED', True):
+            self.enqueue_events(accepted, results)
+        else:
+            self.write_events(accepted, results)
+
+        return JsonResponse({
+            "message": "Processed.",
+            "error": None,
+            "results": results,
+        }, status=200)
+
+    def is_deduplicated(self, index, data, results):
+        """
+        Check delivery of the event and fill its result if the event is dropped.
+
+        :type index: int
+        :param index: Index of the event.
+
+        :type data: dict
+        :param data: Validated webhook body.
+
+        :type results: list
+        :param results: Results of all events.
+
+        :rtype: bool
+        :returns: True if the event is a duplicate or stale.
+        """
+        reason = deliveries.check(data)
+        if reason is None:
+            return False
+        results[index] = self.event_result(200, self.DEDUPLICATED_MESSAGES[reason], result=reason)
+        return True
+
+    def enqueue_events(self, events, results):
+        """
+        Put events into the queue. Jobs of the same page are coalesced by the worker.
+
+        :type events: list
+        :param events: List of (index, webhook body) tuples.
+
+        :type results: list
+        :param results: Results of all events, filled at the indexes of the given events.
+
+        :rtype: void
+        :returns: void
+        """
+        # Single transaction, so the batch is stored with one commit.
+        with transaction.atomic():
+            for index, data in events:
+                if self.is_deduplicated(index, data, results):
+                    continue
+                try:
+                    job = jobs.enqueue(data)
+                except WikiUpdateException as e:
+                    deliveries.forget(data)
+                    results[index] = self.event_result(400, "Invalid input.", str(e))
+                    continue
+                results[index] = self.event_result(202, "Queued.", job=job.pk)
+
+    def write_events(self, events, results):
+        """
+        Group events by page and write each page once. When several events change the same field, the later wins.
+        Pages are written within admission limits, events of the page which isn't admitted in time get 429 result.
+
+        :type events: list
+        :param events: List of (index, webhook body) tuples.
+
+        :type results: list
+        :param results: Results of all events, filled at the indexes of the given events.
+
+        :rtype: void
+        :returns: void
+        """
+        updaters = list()
+        for index, data in events:
+            try:
+                updaters.append((index, WikiPageUpdater(data)))
+            except WikiUpdateException as e:
+                self.keep_failed(data, e, DeadLetter.SOURCE_BATCH)
+                results[index] = self.event_result(400, "Update failed.", str(e))
+
+        # Related objects of all events are loaded together.
+        WikiPageUpdater.prefetch_related([updater for _, updater in updaters])
+        pages = OrderedDict()
+        for index, updater in updaters:
+            try:
+                field_chain = updater.get_field_chain()
+            except WikiUpdateException as e:
+                self.keep_failed(updater.data, e, DeadLetter.SOURCE_BATCH)
+                results[index] = self.event_result(400, "Update failed.", str(e))
+                continue
+            pages.setdefault(updater.page_title, list()).append((index, updater, field_chain))
+
+        for title, updates in pages.items():
+            try:
+                # Pages are admitted like single events. Deliveries are checked in the slot, so events of the rejected
+                # page aren't remembered and are written when they are sent again.
+                with admit(title):
+                    updates = [update for update in updates
+                               if not self.is_deduplicated(update[0], update[1].data, results)]
+                    if not updates:
+                        continue
+                    written = updates[-1][1].write(
+                        WikiPageUpdater.merge_field_chains([chain for _, _, chain in updates]))
+            except AdmissionRejectedException as e:
+                result = self.event_result(429, "Too many updates in flight.", str(e), retry_after=e.retry_after)
+            except WikiUpdateException as e:
+                for _, event_updater, _ in updates:
+                    self.keep_failed(event_updater.data, e, DeadLetter.SOURCE_BATCH, page_title=title)
+                if isinstance(e, ConfluenceUnavailableException):
+                    result = self.event_result(503, "Confluence is unavailable.", str(e), retry_after=e.retry_after)
+                else:
+                    result = self.event_result(400, "Update failed.", str(e))
+            else:
+                if written:
+                    result = self.event_result(201, "Successfully updated.", result="written")
+                else:
+                    result = self.event_result(200, "Page is up to date.", result="skipped")
+            for index, _, _ in updates:
+                results[index] = result
+
+
+class MetricsView(View):
+    """
+    Metrics of the process in Prometheus text format.
+    """
+    http_method_names = ['get']
+
+    def get(self, request):
+        if not metrics.is_enabled():
+            raise Http404("Metrics are disabled.")
+
+        if not metrics.is_authorized(request.META.get('HTTP_AUTHORIZATION', None)):
+            return JsonResponse({
+                "message": "Unauthorized access.",
+                "error": "Wrong authorization token.",
+            }, status=401)
+        return HttpResponse(metrics.render_prometheus(), content_type='text/plain; version=0.0.4; charset=utf-8')